@@ -7,10 +7,13 @@ from __future__ import unicode_literals
 
 import os
 import re
+import errno
 import hashlib
 import datetime
 import copy
+import json
 import pathlib
+import tempfile
 
 from six.moves.urllib.parse import urlsplit  # pylint: disable=import-error,relative-import
 from six.moves.urllib.parse import quote  # pylint: disable=import-error,no-name-in-module,relative-import
@@ -256,29 +259,47 @@ class FileUtils(object):
                 filtered.append(blob)
         return filtered
 
+    @staticmethod
+    def _blob_reference(blob, source, container, blob_service):
+        """Return the reference to a listed blob."""
+        if source.file_group:
+            blob_sas = generate_blob_sas_token(blob, container, blob_service)
+        elif source.container_url:
+            blob_sas = construct_sas_url(blob, urlsplit(source.container_url))
+        elif source.url:
+            blob_sas = source.url
+        else:
+            raise ValueError("FileSource has no file source.")
+        file_name = os.path.basename(blob.name)
+        file_name_only = os.path.splitext(file_name)[0]
+        return {'url': blob_sas,
+                'filePath': blob.name,
+                'fileName': file_name,
+                'fileNameWithoutExtension': file_name_only,
+                'contentLength': blob.properties.content_length}
+
     def list_container_contents(self, source, container, blob_service):
         """List blob references in container."""
         if container not in self.resource_file_cache:
-            self.resource_file_cache[container] = []
-            blobs = blob_service.list_blobs(container)
-            for blob in blobs:
-                if source.file_group:
-                    blob_sas = generate_blob_sas_token(blob, container, blob_service)
-                elif source.container_url:
-                    blob_sas = construct_sas_url(blob, urlsplit(source.container_url))
-                elif source.url:
-                    blob_sas = source.url
-                else:
-                    raise ValueError("FileSource has no file source.")
-                file_name = os.path.basename(blob.name)
-                file_name_only = os.path.splitext(file_name)[0]
-                self.resource_file_cache[container].append(
-                    {'url': blob_sas,
-                     'filePath': blob.name,
-                     'fileName': file_name,
-                     'fileNameWithoutExtension': file_name_only})
+            self.resource_file_cache[container] = [
+                self._blob_reference(blob, source, container, blob_service)
+                for blob in blob_service.list_blobs(container)]
         return self.filter_resource_cache(container, source.prefix)
 
+    def _iter_container_contents(self, source, container, blob_service, manifest):
+        if container in self.resource_file_cache and manifest is None:
+            for blob in self.filter_resource_cache(container, source.prefix):
+                yield blob
+            return
+        # The listing follows its continuation tokens lazily, one page at a time
+        for blob in blob_service.list_blobs(container, prefix=source.prefix or None):
+            if manifest is not None:
+                # Known files are skipped before signing a URL for them
+                if not manifest.is_new(blob):
+                    continue
+                manifest.record(blob)
+            yield self._blob_reference(blob, source, container, blob_service)
+
     def resolve_container_sas_if_needed(self, container_url):
         if container_url_has_sas(container_url):
             return container_url
@@ -298,8 +319,8 @@ class FileUtils(object):
             self.container_sas_cache[container] = generate_container_sas_token(container, storage_client)
             return self.container_sas_cache[container]
 
-    def get_container_list(self, source):
-        """List blob references in container."""
+    def _resolve_source(self, source):
+        """Return the container of a file source and the storage client to list it with."""
         if source.file_group:
             # Input data stored in auto-storage
             storage_client = self.resolve_storage_account()
@@ -315,9 +336,24 @@ class FileUtils(object):
             container = uri.pathname.split('/')[1]
         else:
             raise ValueError('Unknown source.')
+        return container, storage_client
 
+    def get_container_list(self, source):
+        """List blob references in container."""
+        container, storage_client = self._resolve_source(source)
         return self.list_container_contents(source, container, storage_client)
 
+    def iter_container_list(self, source, manifest=None):
+        """Iterate over the blob references in a container as the pages of the listing
+        arrive, rather than after listing the whole container. References listed this
+        way are not cached.
+        :param manifest: If given, only list the blobs that are new or changed since
+         the manifest was saved, recording them in it.
+        :type manifest: :class:`FileManifest`
+        """
+        container, storage_client = self._resolve_source(source)
+        return self._iter_container_contents(source, container, storage_client, manifest)
+
     def resolve_resource_file(self, resource_file):
         """Convert new resourceFile reference to server-supported reference"""
         if resource_file.http_url:
@@ -349,3 +385,65 @@ class FileUtils(object):
             # TODO: Input data from an arbitrary HTTP GET source
             raise ValueError('Not implemented')
         raise ValueError('Malformed ResourceFile')
+
+
+class FileManifest(object):
+    """The files of a task per file factory that tasks have been submitted for, kept in
+    a JSON file between runs so that later runs only submit tasks for new files. Files
+    are identified by their name and ETag, so a file that is overwritten is new again.
+    Files listed since the manifest was loaded are only added to it when it is saved,
+    once their tasks have been submitted. Task IDs carry on from those of earlier runs,
+    so that new tasks can be added to the same job.
+    :param str file_path: The path of the manifest file. It is created when the
+     manifest is first saved.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.files = {}
+        self.next_task_id = 0
+        self._pending = {}
+        self._pending_task_id = None
+        try:
+            with open(file_path, 'r') as manifest_file:
+                content = json.load(manifest_file)
+        except IOError as error:
+            if error.errno != errno.ENOENT:
+                raise
+        else:
+            self.files = content['files']
+            self.next_task_id = content['nextTaskId']
+
+    @staticmethod
+    def _version(blob):
+        return blob.properties.etag or str(blob.properties.last_modified)
+
+    def is_new(self, blob):
+        """Whether a listed blob is not in the manifest, or has changed since."""
+        return self.files.get(blob.name) != self._version(blob)
+
+    def record(self, blob):
+        """Record that a task is being submitted for a listed blob."""
+        self._pending[blob.name] = self._version(blob)
+
+    def use_task_ids(self, stop):
+        """Record that the tasks being submitted use the task IDs up to stop."""
+        self._pending_task_id = stop
+
+    def save(self):
+        """Add the recorded files to the manifest and write it to its file."""
+        self.files.update(self._pending)
+        if self._pending_task_id is not None:
+            self.next_task_id = max(self.next_task_id, self._pending_task_id)
+        self._pending = {}
+        self._pending_task_id = None
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'w') as manifest_file:
+            json.dump({'nextTaskId': self.next_task_id, 'files': self.files}, manifest_file)
+        try:
+            os.replace(temp_path, self.file_path)
+        except AttributeError:  # Python 2
+            if os.path.exists(self.file_path):
+                os.remove(self.file_path)
+            os.rename(temp_path, self.file_path)
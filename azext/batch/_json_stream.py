@@ -0,0 +1,233 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Incremental reading and writing of JSON documents as a sequence of events."""
+
+from __future__ import unicode_literals
+
+import codecs
+import json
+from json.decoder import scanstring
+import re
+
+
+CHUNK_SIZE = 64 * 1024
+
+START_MAP = 'start_map'
+END_MAP = 'end_map'
+START_ARRAY = 'start_array'
+END_ARRAY = 'end_array'
+KEY = 'key'
+VALUE = 'value'
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?')
+_LITERALS = {'true': True, 'false': False, 'null': None}
+
+
+def _read_tokens(stream, chunk_size):
+    """Yield the tokens of a JSON document read from a stream in chunks.
+    Strings are yielded as ('"', value) pairs, numbers and literals as (None, value)
+    pairs and structural characters as (char, None) pairs. A leading byte order mark
+    is skipped.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer = ''
+    index = 0
+    eof = False
+    start = True
+    while True:
+        index = _WHITESPACE.match(buffer, index).end()
+        complete = None
+        if index < len(buffer):
+            char = buffer[index]
+            if char in '{}[],:':
+                yield char, None
+                index += 1
+                continue
+            if char == '"':
+                try:
+                    value, end = scanstring(buffer, index + 1, True)
+                    yield '"', value
+                    index = end
+                    continue
+                except ValueError:
+                    if eof:
+                        raise ValueError("Invalid JSON string at offset {}".format(index))
+            elif char in '-0123456789':
+                match = _NUMBER.match(buffer, index)
+                if match and (match.end() < len(buffer) or eof):
+                    text = match.group()
+                    value = float(text) if match.group(1) or match.group(2) else int(text)
+                    complete = (value, match.end())
+                elif eof:
+                    raise ValueError("Invalid JSON number at offset {}".format(index))
+            else:
+                for literal, value in _LITERALS.items():
+                    if buffer.startswith(literal, index):
+                        complete = (value, index + len(literal))
+                        break
+                else:
+                    if eof or len(buffer) - index >= 5:
+                        raise ValueError("Unexpected character '{}' in JSON".format(char))
+            if complete:
+                yield None, complete[0]
+                index = complete[1]
+                continue
+        elif eof:
+            return
+        chunk = stream.read(chunk_size)
+        # Bytes may decode to nothing until the rest of a character is read
+        eof = not chunk
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk, final=eof)
+        elif start and chunk.startswith('\ufeff'):
+            chunk = chunk[1:]
+        start = False
+        buffer = buffer[index:] + chunk
+        index = 0
+
+
+def iter_events(stream, chunk_size=CHUNK_SIZE):
+    """Parse a JSON document incrementally.
+    :param stream: A readable file-like object in text or binary mode.
+    :param int chunk_size: The number of characters to read at a time.
+    :returns: A generator of (event, value) pairs. The value is the key name for KEY
+     events, the scalar for VALUE events and None otherwise.
+    """
+    tokens = _read_tokens(stream, chunk_size)
+    stack = []
+
+    def next_token():
+        return next(tokens, ('', None))
+
+    def read_key(char, value):
+        if char != '"':
+            raise ValueError("Expected a JSON object key")
+        if next_token()[0] != ':':
+            raise ValueError("Expected ':' after JSON object key '{}'".format(value))
+        return value
+
+    char, value = next_token()
+    while True:
+        # A value is expected at this point
+        if char == '{':
+            yield START_MAP, None
+            char, value = next_token()
+            if char != '}':
+                stack.append('}')
+                yield KEY, read_key(char, value)
+                char, value = next_token()
+                continue
+            yield END_MAP, None
+        elif char == '[':
+            yield START_ARRAY, None
+            char, value = next_token()
+            if char != ']':
+                stack.append(']')
+                continue
+            yield END_ARRAY, None
+        elif char in ('"', None):
+            yield VALUE, value
+        elif char:
+            raise ValueError("Unexpected '{}' in JSON".format(char))
+        else:
+            raise ValueError("Unexpected end of JSON document")
+        # Close any finished containers, then move on to the next item
+        while stack:
+            char, value = next_token()
+            if char == stack[-1]:
+                stack.pop()
+                yield (END_MAP if char == '}' else END_ARRAY), None
+            elif char == ',':
+                break
+            elif char:
+                raise ValueError("Unexpected '{}' in JSON".format(char))
+            else:
+                raise ValueError("Unexpected end of JSON document")
+        else:
+            return
+        if stack[-1] == '}':
+            yield KEY, read_key(*next_token())
+        char, value = next_token()
+
+
+def read_value(events, event, value):
+    """Build the value starting with the given event.
+    :param events: The remaining events of the document.
+    """
+    if event == VALUE:
+        return value
+    if event == START_MAP:
+        result = {}
+        for event, value in events:
+            if event == END_MAP:
+                return result
+            result[value] = read_value(events, *next(events))
+    elif event == START_ARRAY:
+        result = []
+        for event, value in events:
+            if event == END_ARRAY:
+                return result
+            result.append(read_value(events, event, value))
+    raise ValueError("Unexpected end of JSON document")
+
+
+def skip_value(events, event):
+    """Consume the events of the value starting with the given event."""
+    depth = 1 if event in (START_MAP, START_ARRAY) else 0
+    while depth:
+        event, _ = next(events)
+        if event in (START_MAP, START_ARRAY):
+            depth += 1
+        elif event in (END_MAP, END_ARRAY):
+            depth -= 1
+
+
+class JsonWriter(object):
+    """Write a JSON document to a file-like object one event at a time.
+    :param sink: A writable file-like object in text mode.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._first = [True]
+        self._after_key = False
+
+    def _separate(self):
+        if self._after_key:
+            self._after_key = False
+        elif self._first[-1]:
+            self._first[-1] = False
+        else:
+            self.sink.write(',')
+
+    def start_map(self):
+        self._separate()
+        self.sink.write('{')
+        self._first.append(True)
+
+    def start_array(self):
+        self._separate()
+        self.sink.write('[')
+        self._first.append(True)
+
+    def end_map(self):
+        self._first.pop()
+        self.sink.write('}')
+
+    def end_array(self):
+        self._first.pop()
+        self.sink.write(']')
+
+    def key(self, name):
+        self._separate()
+        self.sink.write(json.dumps(name))
+        self.sink.write(':')
+        self._after_key = True
+
+    def value(self, value):
+        self._separate()
+        self.sink.write(json.dumps(value))
@@ -0,0 +1,1511 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Compiled evaluation of ARM-style template expressions.
+
+A template is compiled once into a tree of nodes in which every string value
+holding '[...]' expressions has already been tokenized and parsed. Compiled
+templates are cached by content, so expanding the same template again only
+evaluates the parsed expressions against the new parameter values.
+"""
+
+# pylint: disable=too-few-public-methods
+from __future__ import unicode_literals
+
+import collections
+import hashlib
+import json
+import multiprocessing
+import re
+import tempfile
+import threading
+
+from . import errors
+from . import _json_stream as json_stream
+
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+try:
+    _UNICODE_TYPE = unicode
+except NameError:
+    _UNICODE_TYPE = str
+
+
+_TOKEN_PATTERN = re.compile(r"\s+|'(?:[^']|'')*'|[\[\]().,]|[^\s\[\]().,']+|'")
+_DELIMITER_PATTERN = re.compile(r"[\[\]()']")
+_CLOSING = {'[': ']', '(': ')'}
+_INTEGER_PATTERN = re.compile(r'-?\d+$')
+
+_STRING = 'string'
+_SYMBOL = 'symbol'
+_WORD = 'word'
+
+DEFAULT_CACHE_SIZE = 64
+DEFAULT_RESULT_CACHE_SIZE = 256
+
+
+def _to_text(value):
+    """Return the string form of an evaluated expression."""
+    return value if isinstance(value, _UNICODE_TYPE) else str(value)
+
+
+def _typed(value):
+    """Return the value to substitute for a string consisting of a single expression.
+    Booleans, numbers and JSON fragments keep their type, everything else becomes a string.
+    """
+    if isinstance(value, (_UNICODE_TYPE, bool, int, dict, list, CopyLoop)):
+        return value
+    return _to_text(value)
+
+
+def _copy_json(value):
+    """Return a copy of a JSON fragment that shares no containers with the original."""
+    if isinstance(value, dict):
+        return {k: _copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(v) for v in value]
+    return value
+
+
+class _Token(object):
+    __slots__ = ('kind', 'text', 'start', 'end')
+
+    def __init__(self, kind, text, start, end):
+        self.kind = kind
+        self.text = text
+        self.start = start
+        self.end = end
+
+
+def _tokenize(expression):
+    """Split the source of an expression into string, symbol and word tokens.
+    :param str expression: The text between the enclosing '[' and ']'.
+    :returns: A list of tokens, whitespace excluded.
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(expression):
+        text = match.group()
+        if text.isspace():
+            continue
+        if len(text) > 1 and text[0] == '\'':
+            kind = _STRING
+        elif text in '[]().,':
+            kind = _SYMBOL
+        else:
+            kind = _WORD
+        tokens.append(_Token(kind, text, match.start(), match.end()))
+    return tokens
+
+
+def _find_expression_end(content, start):
+    """Find the ']' closing an expression, respecting nesting and quoted strings.
+    :param str content: The string value being scanned.
+    :param int start: Index of the character after the opening '['.
+    :returns: Index of the closing ']', or None if the expression is not closed.
+    """
+    depth = 0
+    quoted = False
+    for match in _DELIMITER_PATTERN.finditer(content, start):
+        char = match.group()
+        if quoted:
+            quoted = char != '\''
+        elif char == '\'':
+            quoted = True
+        elif char in '[(':
+            depth += 1
+        elif depth:
+            depth -= 1
+        elif char == ']':
+            return match.start()
+    return None
+
+
+def _split_string(content):
+    """Split a template string into literal text and expression sources.
+    '[[' escapes a literal '['.
+    :param str content: The string value from the template.
+    :returns: A list of (is_expression, text) pairs.
+    """
+    segments = []
+    literal = []
+    index = 0
+    while True:
+        start = content.find('[', index)
+        if start < 0:
+            break
+        if content.startswith('[[', start):
+            literal.append(content[index:start + 1])
+            index = start + 2
+            continue
+        end = _find_expression_end(content, start + 1)
+        if end is None:
+            # No closing delimiter for the expression, keep the rest as it is
+            break
+        literal.append(content[index:start])
+        if any(literal):
+            segments.append((False, ''.join(literal)))
+        literal = []
+        segments.append((True, content[start + 1:end]))
+        index = end + 1
+    literal.append(content[index:])
+    if any(literal) or not segments:
+        segments.append((False, ''.join(literal)))
+    return segments
+
+
+class _Parser(object):
+    """Recursive parser turning expression tokens into evaluable nodes.
+    Anything that is not a recognised function call evaluates to its own text.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.closing = {}
+        stack = []
+        for index, token in enumerate(self.tokens):
+            if token.kind != _SYMBOL:
+                continue
+            if token.text in _CLOSING:
+                stack.append(index)
+            elif token.text in ')]' and stack:
+                opening = stack.pop()
+                if _CLOSING[self.tokens[opening].text] == token.text:
+                    self.closing[opening] = index
+
+    def parse(self):
+        return self._parse(0, len(self.tokens))
+
+    def _source(self, low, high):
+        return self.expression[self.tokens[low].start:self.tokens[high - 1].end]
+
+    def _split_arguments(self, low, high):
+        arguments = []
+        start = index = low
+        while index < high:
+            token = self.tokens[index]
+            if token.text in _CLOSING and token.kind == _SYMBOL:
+                index = self.closing.get(index, index)
+            elif token.text == ',' and token.kind == _SYMBOL:
+                arguments.append(self._parse(start, index))
+                start = index + 1
+            index += 1
+        if start < high or arguments:
+            arguments.append(self._parse(start, high))
+        return arguments
+
+    def _parse_accessors(self, low, high):
+        accessors = []
+        index = low
+        while index < high:
+            token = self.tokens[index]
+            if token.text == '.' and index + 1 < high and self.tokens[index + 1].kind == _WORD:
+                accessors.append(_Literal(self.tokens[index + 1].text))
+                index += 2
+            elif token.text == '[' and self.closing.get(index, high) < high:
+                accessors.append(self._parse(index + 1, self.closing[index]))
+                index = self.closing[index] + 1
+            else:
+                return None
+        return accessors
+
+    def _parse(self, low, high):
+        if low >= high:
+            return _Literal('')
+        first = self.tokens[low]
+        if first.kind == _STRING and high - low == 1:
+            return _Literal(first.text[1:-1].replace('\'\'', '\''))
+        if first.kind == _SYMBOL and self.closing.get(low) == high - 1:
+            # Remove enclosing brackets or parentheses to evaluate the contents
+            return self._parse(low + 1, high - 1)
+        if first.kind == _WORD and high - low > 2 and self.tokens[low + 1].text == '(':
+            end = self.closing.get(low + 1)
+            if end is not None:
+                node = self._parse_function(first.text, low, end, high)
+                if node is not None:
+                    return node
+        return _Literal(self._source(low, high))
+
+    def _parse_function(self, name, low, end, high):
+        if name == 'reference':
+            raise NotImplementedError("ARM-style 'reference' syntax not supported.")
+        arguments = self._split_arguments(low + 2, end)
+        if name == 'concat' and end == high - 1:
+            return _Concat(arguments)
+        if name == 'copyIndex' and end == high - 1:
+            if len(arguments) > 2:
+                raise ValueError("Template reference misformatted for copyIndex '{}'".format(
+                    self._source(low, high)))
+            return _CopyIndex(arguments)
+        if name in ('parameters', 'variables'):
+            if len(arguments) != 1:
+                raise ValueError("Template reference misformatted for {} '{}'".format(
+                    name, self._source(low, high)))
+            accessors = self._parse_accessors(end + 1, high)
+            if accessors is None:
+                return None
+            if name == 'parameters':
+                return _ParameterReference(arguments[0], accessors)
+            return _VariableReference(arguments[0], accessors)
+        return None
+
+
+def parse_expression(expression):
+    """Parse the source of a single template expression.
+    :param str expression: The text between the enclosing '[' and ']'.
+    :returns: An expression node.
+    """
+    return _Parser(expression).parse()
+
+
+class _Literal(object):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, context):  # pylint: disable=unused-argument
+        return self.value
+
+    def children(self):  # pylint: disable=no-self-use
+        return ()
+
+
+class _Concat(object):
+    __slots__ = ('arguments',)
+
+    def __init__(self, arguments):
+        self.arguments = arguments
+
+    def children(self):
+        return self.arguments
+
+    def evaluate(self, context):
+        return ''.join(_to_text(a.evaluate(context)) for a in self.arguments)
+
+
+class _CopyIndex(object):
+    """copyIndex([loopName], [offset]): the current iteration of a copy loop."""
+    __slots__ = ('arguments',)
+
+    def __init__(self, arguments):
+        self.arguments = arguments
+
+    def children(self):
+        return self.arguments
+
+    def evaluate(self, context):
+        values = [a.evaluate(context) for a in self.arguments]
+        name, offset = None, 0
+        if len(values) == 2:
+            name, offset = values
+        elif values and _INTEGER_PATTERN.match(_to_text(values[0])):
+            offset = values[0]
+        elif values:
+            name = values[0]
+        try:
+            offset = int(offset)
+        except ValueError:
+            raise ValueError("copyIndex offset '{}' is not an integer".format(offset))
+        return context.copy_index(None if name is None else _to_text(name), offset)
+
+
+class _ParameterReference(object):
+    __slots__ = ('name', 'accessors')
+
+    def __init__(self, name, accessors):
+        self.name = name
+        self.accessors = accessors
+
+    def children(self):
+        return [self.name] + self.accessors
+
+    def evaluate(self, context):
+        return context.parameter(_to_text(self.name.evaluate(context)), self.accessors)
+
+
+class _VariableReference(object):
+    __slots__ = ('name', 'accessors')
+
+    def __init__(self, name, accessors):
+        self.name = name
+        self.accessors = accessors
+
+    def children(self):
+        return [self.name] + self.accessors
+
+    def evaluate(self, context):
+        return context.variable(_to_text(self.name.evaluate(context)), self.accessors)
+
+
+class _StaticNode(object):
+    """A part of the template that contains no expressions."""
+    __slots__ = ('value',)
+    static = True
+
+    def __init__(self, value):
+        self.value = value
+
+    def children(self):  # pylint: disable=no-self-use
+        return ()
+
+
+class _StringNode(object):
+    """A string value containing one or more expressions."""
+    __slots__ = ('parts', 'whole', 'depends')
+    static = False
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.depends = None
+        self.whole = len(parts) == 1 and not isinstance(parts[0], _UNICODE_TYPE)
+
+    def children(self):
+        return [p for p in self.parts if not isinstance(p, _UNICODE_TYPE)]
+
+    def expand(self, context):
+        if self.whole:
+            # Parameter and variable values are resolved once but may be used many times
+            return _copy_json(_typed(self.parts[0].evaluate(context)))
+        return ''.join(p if isinstance(p, _UNICODE_TYPE) else _to_text(p.evaluate(context))
+                       for p in self.parts)
+
+
+class _ObjectNode(object):
+    """A JSON object with at least one expression in its keys or values."""
+    __slots__ = ('items', 'members', 'depends')
+    static = False
+
+    def __init__(self, items):
+        self.items = items
+        self.depends = None
+        self.members = None
+        if all(isinstance(k, _UNICODE_TYPE) for k, _ in items):
+            self.members = dict(items)
+
+    def children(self):
+        nodes = [k for k, _ in self.items if not isinstance(k, _UNICODE_TYPE)]
+        nodes.extend(n for _, n in self.items)
+        return nodes
+
+    def expand(self, context):
+        result = {}
+        for key, node in self.items:
+            if not isinstance(key, _UNICODE_TYPE):
+                key = _to_text(context.expand(key))
+            result[key] = context.expand(node)
+        return result
+
+
+class _ArrayNode(object):
+    """A JSON array with at least one expression in its items."""
+    __slots__ = ('items', 'depends')
+    static = False
+
+    def __init__(self, items):
+        self.items = items
+        self.depends = None
+
+    def children(self):
+        return self.items
+
+    def expand(self, context):
+        return [context.expand(n) for n in self.items]
+
+
+class _VariableNode(object):
+    """The definition of a variable within the 'variables' section of the template,
+    evaluated through the variable lookup so it is only expanded once."""
+    __slots__ = ('reference', 'static', 'value', 'depends')
+
+    def __init__(self, name, node):
+        self.depends = None
+        self.reference = _VariableReference(_Literal(name), [])
+        self.static = node.static
+        self.value = node.value if node.static else None
+
+    def children(self):
+        return [self.reference]
+
+    def expand(self, context):
+        return self.reference.evaluate(context)
+
+
+class _CopyNode(object):
+    """A property generated by an ARM-style 'copy' loop, holding 'count' expansions
+    of the 'input' value."""
+    __slots__ = ('name', 'count', 'input', 'depends')
+    static = False
+
+    def __init__(self, name, count, input_node):
+        self.depends = None
+        self.name = name
+        self.count = count
+        self.input = input_node
+
+    def children(self):
+        return [self.count, self.input]
+
+    def expand(self, context):
+        return context.copy_loop(self)
+
+
+class CopyLoop(Sequence):
+    """The items of a template 'copy' loop, each expanded when it is requested
+    rather than held in memory. Nested loops within an item are lists unless the
+    template was expanded lazily.
+    """
+
+    def __init__(self, context, node, count, bindings):
+        self.name = node.name
+        self._context = context
+        self._node = node
+        self._count = count
+        self._bindings = bindings
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item(i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("copy loop index out of range")
+        return self._item(index)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self._item(index)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, CopyLoop)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "<CopyLoop '{}' of {} items>".format(self.name, self._count)
+
+    def _item(self, index):
+        context = self._context
+        saved = context.copy_indices
+        context.copy_indices = self._bindings + [(self.name, index)]
+        try:
+            return context.expand(self._node.input)
+        finally:
+            context.copy_indices = saved
+
+
+def materialize(value):
+    """Return a JSON fragment with every lazily expanded copy loop replaced by a list.
+    Containers are only copied where they hold a copy loop.
+    :param value: An expanded JSON fragment.
+    """
+    if isinstance(value, CopyLoop):
+        return [materialize(i) for i in value]
+    if isinstance(value, list):
+        items = [materialize(i) for i in value]
+        if all(new is old for new, old in zip(items, value)):
+            return value
+        return items
+    if isinstance(value, dict):
+        changes = {}
+        for key, item in value.items():
+            converted = materialize(item)
+            if converted is not item:
+                changes[key] = converted
+        if changes:
+            value = dict(value)
+            value.update(changes)
+    return value
+
+
+def _is_copy_definitions(value):
+    """Whether the value of a 'copy' property defines property copy loops."""
+    return isinstance(value, list) and bool(value) and all(
+        isinstance(d, dict) and 'name' in d and 'count' in d and 'input' in d for d in value)
+
+
+def _compile_copy(definition, siblings):
+    name = definition['name']
+    if not isinstance(name, _UNICODE_TYPE) or '[' in name:
+        raise ValueError("Copy loop name must be a literal string: {}".format(name))
+    if name in siblings:
+        raise ValueError("Copy loop '{}' conflicts with a property of the same name".format(name))
+    return name, _CopyNode(name, compile_value(definition['count']),
+                           compile_value(definition['input']))
+
+
+def _compile_string(value):
+    segments = _split_string(value)
+    if len(segments) == 1 and not segments[0][0]:
+        return _StaticNode(segments[0][1])
+    return _StringNode([parse_expression(text) if is_expression else text
+                        for is_expression, text in segments])
+
+
+def compile_value(value):
+    """Compile a JSON fragment into a tree of template nodes.
+    :param value: A loaded JSON value.
+    """
+    if isinstance(value, _UNICODE_TYPE):
+        return _compile_string(value)
+    if isinstance(value, dict):
+        items = []
+        for key, item in value.items():
+            if key == 'copy' and _is_copy_definitions(item):
+                items.extend(_compile_copy(d, value) for d in item)
+                continue
+            key_node = _compile_string(key)
+            items.append((key_node.value if key_node.static else key_node, compile_value(item)))
+        if all(isinstance(k, _UNICODE_TYPE) and n.static for k, n in items):
+            return _StaticNode({k: n.value for k, n in items})
+        return _ObjectNode(items)
+    if isinstance(value, list):
+        items = [compile_value(i) for i in value]
+        if all(n.static for n in items):
+            return _StaticNode([n.value for n in items])
+        return _ArrayNode(items)
+    return _StaticNode(value)
+
+
+def _references(node):
+    """Return the parameter and variable references made anywhere within a node."""
+    references = []
+    pending = [node]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, (_ParameterReference, _VariableReference)):
+            references.append(item)
+        pending.extend(item.children())
+    return references
+
+
+def _static_name(reference):
+    """Return the name used by a reference, or None if it is computed."""
+    if isinstance(reference.name, _Literal):
+        return _to_text(reference.name.value)
+    return None
+
+
+def _dependency_order(dependencies):
+    """Order variables so that each comes after the variables it references.
+    :param dict dependencies: The names of the variables referenced by each variable.
+    :returns: A list of variable names.
+    :raises: ValueError if the variables reference each other in a cycle.
+    """
+    order = []
+    done = set()
+    for root in dependencies:
+        if root in done:
+            continue
+        path = [root]
+        stack = [iter(dependencies[root])]
+        while stack:
+            for name in stack[-1]:
+                if name in path:
+                    cycle = path[path.index(name):] + [name]
+                    raise ValueError("Template variables contain a reference "
+                                     "cycle: {}".format(' -> '.join(cycle)))
+                if name in dependencies and name not in done:
+                    path.append(name)
+                    stack.append(iter(dependencies[name]))
+                    break
+            else:
+                stack.pop()
+                done.add(path[-1])
+                order.append(path.pop())
+    return order
+
+
+def _parameter_dependencies(references, variable_parameters):
+    """Return the names of the parameters that a set of references depends on,
+    directly or through variables, or None if that cannot be known in advance."""
+    names = set()
+    for reference in references:
+        name = _static_name(reference)
+        if name is None:
+            return None
+        if isinstance(reference, _ParameterReference):
+            names.add(name)
+            continue
+        inner = variable_parameters.get(name, frozenset())
+        if inner is None:
+            return None
+        names.update(inner)
+    return frozenset(names)
+
+
+def _annotate(node, variable_parameters):
+    """Record on each node of a compiled template the parameters it depends on.
+    :returns: The parameter names, or None if they cannot be known in advance.
+    """
+    if node.static:
+        return frozenset()
+    if isinstance(node, _VariableNode):
+        depends = variable_parameters.get(_static_name(node.reference), frozenset())
+    elif isinstance(node, _StringNode):
+        depends = _parameter_dependencies(_references(node), variable_parameters)
+    else:
+        if isinstance(node, _ObjectNode):
+            children = [n for k, n in node.items] + [
+                k for k, _ in node.items if not isinstance(k, _UNICODE_TYPE)]
+        elif isinstance(node, _ArrayNode):
+            children = node.items
+        else:
+            children = [node.count, node.input]
+        depends = frozenset()
+        for child in children:
+            inner = _annotate(child, variable_parameters)
+            depends = None if depends is None or inner is None else depends | inner
+    node.depends = depends
+    return depends
+
+
+def _contains_copy(node):
+    pending = [node]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, (_CopyNode, _CopyIndex)):
+            return True
+        pending.extend(item.children())
+    return False
+
+
+def _fold_expression(expression, constants):
+    """Replace the constant parts of an expression with literals.
+    :param dict constants: The values of the variables that depend on no parameters.
+    """
+    if isinstance(expression, _Concat):
+        expression.arguments = [_fold_expression(a, constants) for a in expression.arguments]
+        if all(isinstance(a, _Literal) for a in expression.arguments):
+            return _Literal(''.join(_to_text(a.value) for a in expression.arguments))
+    elif isinstance(expression, _CopyIndex):
+        expression.arguments = [_fold_expression(a, constants) for a in expression.arguments]
+    elif isinstance(expression, (_ParameterReference, _VariableReference)):
+        expression.name = _fold_expression(expression.name, constants)
+        expression.accessors = [_fold_expression(a, constants) for a in expression.accessors]
+        name = _static_name(expression)
+        if isinstance(expression, _VariableReference) and name in constants and all(
+                isinstance(a, _Literal) for a in expression.accessors):
+            try:
+                return _Literal(_ExpansionContext.navigate(
+                    constants[name], [a.value for a in expression.accessors]))
+            except (KeyError, IndexError, TypeError, ValueError):
+                pass  # Reported when the template is expanded
+    return expression
+
+
+def _fold(node, constants):
+    """Evaluate the parts of a compiled template that depend on no parameters.
+    :param dict constants: The values of the variables that depend on no parameters.
+    :returns: The folded node, a :class:`_StaticNode` if nothing dynamic remains.
+    """
+    if node.static:
+        return node
+    if isinstance(node, _StringNode):
+        node.parts = [p if isinstance(p, _UNICODE_TYPE) else _fold_expression(p, constants)
+                      for p in node.parts]
+        if any(not isinstance(p, (_UNICODE_TYPE, _Literal)) for p in node.parts):
+            return node
+        if node.whole:
+            return _StaticNode(_typed(node.parts[0].value))
+        return _StaticNode(''.join(p if isinstance(p, _UNICODE_TYPE) else _to_text(p.value)
+                                   for p in node.parts))
+    if isinstance(node, _VariableNode):
+        name = _static_name(node.reference)
+        if name in constants:
+            node.static = True
+            node.value = constants[name]
+        return node
+    if isinstance(node, _ArrayNode):
+        node.items = [_fold(n, constants) for n in node.items]
+        if all(n.static for n in node.items):
+            return _StaticNode([n.value for n in node.items])
+        return node
+    if isinstance(node, _ObjectNode):
+        items = []
+        for key, item in node.items:
+            if not isinstance(key, _UNICODE_TYPE):
+                key = _fold(key, constants)
+                key = _to_text(key.value) if key.static else key
+            items.append((key, _fold(item, constants)))
+        node.items = items
+        node.members = None
+        if all(isinstance(k, _UNICODE_TYPE) for k, _ in items):
+            if all(n.static for _, n in items):
+                return _StaticNode({k: n.value for k, n in items})
+            node.members = dict(items)
+        return node
+    node.count = _fold(node.count, constants)
+    node.input = _fold(node.input, constants)
+    return node
+
+
+def parse_pointer(pointer):
+    """Split a JSON pointer (RFC 6901) into its reference tokens.
+    :param str pointer: A JSON pointer such as '/job/properties'.
+    :returns: A list of member names and array indices as strings.
+    """
+    if not pointer:
+        return []
+    if not pointer.startswith('/'):
+        raise ValueError("Invalid JSON pointer '{}'".format(pointer))
+    return [t.replace('~1', '/').replace('~0', '~') for t in pointer[1:].split('/')]
+
+
+def _copy_root(value):
+    """Return a value whose outermost container is not shared with any other."""
+    return type(value)(value) if isinstance(value, (dict, list)) else value
+
+
+def _pointer_index(token, length):
+    if not _INTEGER_PATTERN.match(token) or token.startswith('-') or \
+            (token.startswith('0') and token != '0') or int(token) >= length:
+        raise KeyError(token)
+    return int(token)
+
+
+def _resolve_pointer(value, tokens):
+    """Return the part of an expanded JSON value that a JSON pointer refers to.
+    :raises: KeyError if the value has no such part.
+    """
+    for token in tokens:
+        if isinstance(value, dict):
+            value = value[token]
+        elif isinstance(value, (list, CopyLoop)):
+            value = value[_pointer_index(token, len(value))]
+        else:
+            raise KeyError(token)
+    return value
+
+
+class _ExpansionContext(object):
+    """The state of a single expansion of a compiled template. Parameters, variables
+    and the values found at paths within them are resolved at most once."""
+
+    def __init__(self, template, parameters, lazy=False):
+        self.template = template
+        self.parameters = parameters or {}
+        self.lazy = lazy
+        self.copy_indices = []
+        self._resolved = {}
+        self._resolving = []
+
+    def expand(self, node):
+        if node.static:
+            # Copied, as the compiled template is shared by every expansion
+            return _copy_json(node.value)
+        return node.expand(self)
+
+    def expand_value(self, value):
+        """Expand a JSON fragment that is not part of the compiled template."""
+        if isinstance(value, (dict, list)):
+            return self.expand(compile_value(value))
+        return value
+
+    def reuse(self, previous, changed):
+        """Take over the parameters and variables resolved by a previous expansion
+        of the same template that do not depend on any of the changed parameters."""
+        for key, value in previous._resolved.items():  # pylint: disable=protected-access
+            kind, name, _ = key
+            if kind == 'parameters':
+                depends = frozenset([name])
+            else:
+                depends = self.template.variable_parameters.get(name)
+            if depends is not None and not depends & changed:
+                self._resolved[key] = value
+
+    def reexpand(self, node, previous, changed):
+        """Expand a node, reusing its value from a previous expansion if it does not
+        depend on any of the changed parameters."""
+        if node.static:
+            return _copy_json(node.value)
+        if node.depends is not None and not node.depends & changed:
+            return previous
+        if isinstance(node, _ObjectNode) and node.members is not None \
+                and isinstance(previous, dict):
+            return {k: self.reexpand(n, previous[k], changed) if k in previous else self.expand(n)
+                    for k, n in node.items}
+        if isinstance(node, _ArrayNode) and isinstance(previous, list) \
+                and len(previous) == len(node.items):
+            return [self.reexpand(n, p, changed) for n, p in zip(node.items, previous)]
+        return self.expand(node)
+
+    def resolve_variables(self):
+        """Evaluate every variable, each after the variables it depends on."""
+        for name in self.template.variable_order:
+            self.variable(name, ())
+
+    def copy_loop(self, node, lazy=None):
+        """Return the items of a copy loop, as a :class:`CopyLoop` if expanding lazily."""
+        count = self.expand(node.count)
+        try:
+            if isinstance(count, bool):
+                raise ValueError()
+            count = int(count)
+        except (TypeError, ValueError):
+            raise ValueError("The count of copy loop '{}' is not an integer: {}".format(
+                node.name, count))
+        if count < 0:
+            raise ValueError("The count of copy loop '{}' cannot be negative".format(node.name))
+        loop = CopyLoop(self, node, count, list(self.copy_indices))
+        if self.lazy if lazy is None else lazy:
+            return loop
+        return list(loop)
+
+    def copy_index(self, name, offset):
+        """Return the current iteration of the named (or innermost) copy loop."""
+        for loop_name, index in reversed(self.copy_indices):
+            if name is None or loop_name == name:
+                return index + offset
+        if name is None:
+            raise ValueError("copyIndex() can only be used within a copy loop")
+        raise ValueError("copyIndex() refers to unknown copy loop '{}'".format(name))
+
+    @staticmethod
+    def navigate(value, keys):
+        for key in keys:
+            if isinstance(value, list):
+                key = int(key)
+            elif not isinstance(key, _UNICODE_TYPE):
+                key = _to_text(key)
+            value = value[key]
+        return value
+
+    def _select(self, node, keys):
+        for index, key in enumerate(keys):
+            if node.static:
+                return self.navigate(node.value, keys[index:])
+            if isinstance(node, _ObjectNode) and node.members is not None:
+                node = node.members[_to_text(key)]
+            elif isinstance(node, _ArrayNode):
+                node = node.items[int(key)]
+            else:
+                return self.navigate(self.expand(node), keys[index:])
+        return self.expand(node)
+
+    def _lookup(self, kind, name, accessors, resolve):
+        keys = tuple(a.evaluate(self) for a in accessors)
+        try:
+            return self._resolved[(kind, name, keys)]
+        except KeyError:
+            value = resolve(name, keys)
+            self._resolved[(kind, name, keys)] = value
+            return value
+        except TypeError:  # Unhashable key, no memoization
+            return resolve(name, keys)
+
+    def parameter(self, name, accessors):
+        """Return the value of a template parameter.
+        :param str name: The parameter name.
+        :param list accessors: Member and index accessors applied to the value.
+        """
+        return self._lookup('parameters', name, accessors, self._resolve_parameter)
+
+    def variable(self, name, accessors):
+        """Return the value of a template variable.
+        :param str name: The variable name.
+        :param list accessors: Member and index accessors applied to the value.
+        """
+        return self._lookup('variables', name, accessors, self._resolve_variable)
+
+    def _resolve_parameter(self, name, keys):
+        definitions = self.template.parameters
+        if definitions is None:
+            raise ValueError("Template defines no parameters but tried to use '{}'".format(name))
+        try:
+            definition = definitions[name]
+        except (KeyError, TypeError):
+            raise ValueError("Template does not define parameter '{}'".format(name))
+        default = definition.get('defaultValue')
+        value = self.parameters.get(name)
+        if value is None:
+            value = default
+        if value is None:
+            raise errors.MissingParameterValue(
+                "No value supplied for parameter '{}' and no default value".format(name),
+                parameter_name=name,
+                parameter_description=definition.get('metadata', {}).get('description'))
+        if not keys:
+            return self.expand_value(self.template.validator(name, definition).validate(value))
+        try:
+            value = self.navigate(value, keys)
+        except (KeyError, IndexError, TypeError, ValueError):
+            try:
+                value = self.navigate(default, keys)
+            except (KeyError, IndexError, TypeError, ValueError):
+                raise ValueError("Unable to resolve the value referenced "
+                                 "on parameter '{}'".format(name))
+        return self.expand_value(value)
+
+    def _resolve_variable(self, name, keys):
+        try:
+            node = self.template.variables[name]
+        except (KeyError, TypeError):
+            raise ValueError("Template contains no definition for variable '{}'".format(name))
+        if keys:
+            try:
+                if ('variables', name, ()) in self._resolved:
+                    return self.navigate(self._resolved[('variables', name, ())], keys)
+                return self._select(node, keys)
+            except (KeyError, IndexError, TypeError, ValueError):
+                raise ValueError("Unable to resolve the value referenced "
+                                 "on variable '{}'".format(name))
+        if name in self._resolving:
+            cycle = self._resolving[self._resolving.index(name):] + [name]
+            raise ValueError("Template variables contain a reference "
+                             "cycle: {}".format(' -> '.join(cycle)))
+        self._resolving.append(name)
+        try:
+            return self.expand(node)
+        finally:
+            self._resolving.pop()
+
+
+class CompiledTemplate(object):
+    """A template that has been parsed once and can be expanded any number of times.
+    :param dict template: The loaded JSON template. The compiled template keeps
+     no reference to it.
+    :param str template_hash: The content hash of the template, if already known.
+    """
+
+    def __init__(self, template, template_hash=None):
+        self.content_hash = template_hash or content_hash(template)
+        template = _copy_json(template)
+        self.parameters = template.get('parameters')
+        self.validators = {}
+        self.root = compile_value(template)
+        variables = template.get('variables')
+        node = None
+        if isinstance(self.root, _ObjectNode) and self.root.members is not None:
+            node = self.root.members.get('variables')
+        if isinstance(node, _ObjectNode) and node.members is not None:
+            # Share the nodes compiled as part of the template body, which then
+            # resolve through the variable lookup to be evaluated only once
+            self.variables = node.members
+            node.items = [(k, _VariableNode(k, n)) for k, n in node.items]
+            node.members = dict(node.items)
+        elif isinstance(variables, dict):
+            self.variables = {k: compile_value(v) for k, v in variables.items()}
+        else:
+            self.variables = {}
+        self.variable_dependencies = {}
+        for name, variable in self.variables.items():
+            self.variable_dependencies[name] = set(
+                _static_name(r) for r in _references(variable)
+                if isinstance(r, _VariableReference) and _static_name(r) is not None)
+        self.variable_order = _dependency_order(self.variable_dependencies)
+        self._annotate()
+        self.constants = self._constant_variables()
+        if self.constants:
+            for name in self.variables:
+                self.variables[name] = _fold(self.variables[name], self.constants)
+            self.root = _fold(self.root, self.constants)
+            self._annotate()
+        references = _references(self.root)
+        for variable in self.variables.values():
+            references.extend(_references(variable))
+        self.parameter_references = set(
+            _static_name(r) for r in references if isinstance(r, _ParameterReference))
+        self.computed_references = any(_static_name(r) is None for r in references)
+
+    def _annotate(self):
+        self.variable_parameters = {}
+        for name in self.variable_order:
+            self.variable_parameters[name] = _annotate(self.variables[name],
+                                                       self.variable_parameters)
+        _annotate(self.root, self.variable_parameters)
+
+    def _constant_variables(self):
+        """Evaluate the variables that depend on no parameters."""
+        context = _ExpansionContext(self, {})
+        constants = {}
+        for name in self.variable_order:
+            node = self.variables[name]
+            if self.variable_parameters[name] != frozenset() or _contains_copy(node):
+                continue
+            try:
+                constants[name] = context.variable(name, ())
+            except (ValueError, TypeError):
+                pass  # Reported when the template is expanded
+        return constants
+
+    def validator(self, name, definition):
+        """Return the validator compiled from the definition of a parameter."""
+        try:
+            return self.validators[name]
+        except KeyError:
+            # Imported here as the template utilities depend on this module
+            from ._template_utils import ParameterValidator
+            validator = self.validators[name] = ParameterValidator(name, definition)
+            return validator
+
+    def locate(self, pointer):
+        """Return the compiled node for the part of the template at a JSON pointer.
+        :param str pointer: A JSON pointer, or None for the whole template.
+        :returns: The node, and the pointer tokens left to resolve in its expansion
+         where the structure of the template is only known once it is expanded.
+        :raises: KeyError if the template has no part at the pointer.
+        """
+        node = self.root
+        tokens = parse_pointer(pointer)
+        for index, token in enumerate(tokens):
+            if isinstance(node, _ObjectNode) and node.members is not None:
+                node = node.members[token]
+            elif isinstance(node, _ArrayNode):
+                node = node.items[_pointer_index(token, len(node.items))]
+            else:
+                return node, tokens[index:]
+        return node, []
+
+    def referenced_parameters(self, pointer=None):
+        """Return the names of the parameters that a part of the template references,
+        directly or through variables.
+        :param str pointer: A JSON pointer to the part of the template, or None for
+         the whole template.
+        """
+        if pointer is None:
+            return self.parameter_references
+        try:
+            node, _ = self.locate(pointer)
+        except KeyError:
+            return set()
+        names = set()
+        for reference in _references(node):
+            name = _static_name(reference)
+            if isinstance(reference, _ParameterReference) and name is not None:
+                names.add(name)
+                continue
+            depends = self.variable_parameters.get(name, frozenset()) if name else None
+            if depends is None:
+                return self.parameter_references
+            names.update(depends)
+        return names
+
+    def missing_parameters(self, parameters=None, pointer=None):
+        """Return the names of the parameters referenced by the template that have
+        neither a value nor a default value. Parameters referenced through a
+        computed name can only be found when the template is expanded.
+        :param dict parameters: Parameter values by name.
+        :param str pointer: A JSON pointer to the only part of the template to check.
+        """
+        parameters = parameters or {}
+        definitions = self.parameters if isinstance(self.parameters, dict) else {}
+        referenced = self.referenced_parameters(pointer)
+        missing = []
+        for name, definition in definitions.items():
+            if name not in referenced or not isinstance(definition, dict):
+                continue
+            if parameters.get(name) is None and definition.get('defaultValue') is None:
+                missing.append(name)
+        return missing
+
+    def expand(self, parameters=None, lazy=False, pointer=None):
+        """Return the template with all expressions evaluated. The result shares no
+        containers with the template, the parameter values or any other expansion.
+        :param dict parameters: Parameter values by name.
+        :param bool lazy: Whether to return the items of copy loops as a
+         :class:`CopyLoop` that expands each item on demand, rather than as a list.
+        :param str pointer: A JSON pointer to the only part of the template to expand,
+         such as '/job'. Only the variables and parameters that part references are
+         then evaluated.
+        :raises: KeyError if the template has no part at the pointer.
+        """
+        context = _ExpansionContext(self, parameters, lazy)
+        if pointer is None:
+            context.resolve_variables()
+            return context.expand(self.root)
+        node, tokens = self.locate(pointer)
+        if tokens:
+            return _resolve_pointer(context.expand(node), tokens)
+        return context.expand(node)
+
+    def expand_value(self, value, parameters=None):
+        """Expand a JSON fragment using the parameters and variables of this template.
+        :param value: The JSON fragment to expand.
+        :param dict parameters: Parameter values by name.
+        """
+        return _ExpansionContext(self, parameters).expand(compile_value(value))
+
+
+class ExpansionSession(object):
+    """Expand a compiled template repeatedly with changing parameter values. Each
+    expansion only re-evaluates the parts of the template that depend on parameters
+    that have changed since the previous one, directly or through variables. All
+    other parts of the result are shared with the previous result, which must not be
+    modified in place. Parameters and variables resolved before an expansion failed
+    (for example for a missing parameter value) are also reused.
+    :param template: The compiled template.
+    :type template: :class:`CompiledTemplate`
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self._context = None
+        self._result = None
+        self._result_parameters = None
+        self._result_lazy = None
+        self._result_pointer = None
+
+    @staticmethod
+    def changed_parameters(previous, parameters):
+        """Return the names of the parameters whose values differ. Parameters with
+        object values holding expressions of their own are included as well if
+        anything changed."""
+        changed = set(n for n in set(previous) | set(parameters)
+                      if previous.get(n) != parameters.get(n))
+        if changed:
+            changed.update(n for n, v in parameters.items()
+                           if isinstance(v, (dict, list)) and not compile_value(v).static)
+        return changed
+
+    def expand(self, parameters=None, lazy=False, pointer=None):
+        """Return the template with all expressions evaluated.
+        :param dict parameters: Parameter values by name.
+        :param bool lazy: Whether to return the items of copy loops as a
+         :class:`CopyLoop` that expands each item on demand, rather than as a list.
+        :param str pointer: A JSON pointer to the only part of the template to expand.
+        """
+        parameters = dict(parameters or {})
+        node, tokens = self.template.locate(pointer)
+        context = _ExpansionContext(self.template, parameters, lazy)
+        previous = self._context
+        if previous is not None and previous.lazy == lazy:
+            context.reuse(previous, self.changed_parameters(previous.parameters, parameters))
+        self._context = context
+        if pointer is None:
+            context.resolve_variables()
+        if self._result is None or (self._result_lazy, self._result_pointer) != (lazy, pointer):
+            result = context.expand(node)
+        else:
+            changed = self.changed_parameters(self._result_parameters, parameters)
+            result = _copy_root(context.reexpand(node, self._result, changed))
+        self._result = result
+        self._result_parameters = parameters
+        self._result_lazy = lazy
+        self._result_pointer = pointer
+        if tokens:
+            return _copy_root(_resolve_pointer(result, tokens))
+        return result
+
+
+def _member_node(node, name):
+    """Return the node of a member of a compiled JSON object."""
+    if node.static:
+        return _StaticNode(node.value[name])
+    return node.members[name]
+
+
+def _expand_scalar(value, context):
+    if isinstance(value, _UNICODE_TYPE) and '[' in value:
+        return context.expand(_compile_string(value))
+    return value
+
+
+def _stream_value(events, event, value, writer, context):
+    """Write the expansion of the value starting with the given event as it is read."""
+    depth = 0
+    while True:
+        if event == json_stream.START_MAP:
+            writer.start_map()
+            depth += 1
+        elif event == json_stream.START_ARRAY:
+            writer.start_array()
+            depth += 1
+        elif event == json_stream.END_MAP:
+            writer.end_map()
+            depth -= 1
+        elif event == json_stream.END_ARRAY:
+            writer.end_array()
+            depth -= 1
+        elif event == json_stream.KEY and value == 'copy':
+            definitions = json_stream.read_value(events, *next(events))
+            _stream_copy(definitions, writer, context)
+        elif event == json_stream.KEY:
+            writer.key(_to_text(_expand_scalar(value, context)))
+        else:
+            writer.value(_expand_scalar(value, context))
+        if not depth:
+            return
+        event, value = next(events)
+
+
+def _stream_copy(definitions, writer, context):
+    """Write the properties generated by copy loops an item at a time."""
+    node = compile_value({'copy': definitions})
+    if node.static or 'copy' in node.members:
+        writer.key('copy')
+        writer.value(context.expand(_member_node(node, 'copy')))
+        return
+    for name, loop in node.items:
+        writer.key(name)
+        writer.start_array()
+        for item in context.copy_loop(loop, lazy=True):
+            writer.value(item)
+        writer.end_array()
+
+
+def _seekable_copy(stream):
+    """Copy the remaining content of a stream to a temporary file."""
+    copy = tempfile.TemporaryFile('w+b')
+    while True:
+        chunk = stream.read(json_stream.CHUNK_SIZE)
+        if not chunk:
+            break
+        copy.write(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+    copy.seek(0)
+    return copy
+
+
+class StreamedTemplate(object):
+    """A template that is read incrementally from a file-like object and expanded
+    straight to another. Only the 'parameters' and 'variables' sections are held
+    in memory, everything else is read, expanded and written an element at a time.
+    :param stream: A readable file-like object with the JSON template. Streams that
+     cannot seek are first copied to a temporary file.
+    :param int chunk_size: The number of characters to read at a time.
+    """
+
+    def __init__(self, stream, chunk_size=json_stream.CHUNK_SIZE):
+        seekable = getattr(stream, 'seekable', None)
+        if not seekable or not seekable():
+            stream = _seekable_copy(stream)
+        self._stream = stream
+        self._start = stream.tell()
+        self._chunk_size = chunk_size
+        self.sections = {}
+        events = self._events()
+        for key, event, value in events:
+            if key in ('parameters', 'variables'):
+                self.sections[key] = json_stream.read_value(events.events, event, value)
+            else:
+                json_stream.skip_value(events.events, event)
+        self.compiled = CompiledTemplate(self.sections)
+
+    def _events(self):
+        self._stream.seek(self._start)
+        return _MemberEvents(json_stream.iter_events(self._stream, self._chunk_size))
+
+    def expand(self, sink, parameters=None, member=None):
+        """Write the expanded template to a file-like object.
+        :param sink: A writable file-like object in text mode.
+        :param dict parameters: Parameter values by name.
+        :param str member: The name of a top level element to write instead of
+         the whole template.
+        """
+        context = _ExpansionContext(self.compiled, parameters)
+        context.resolve_variables()
+        writer = json_stream.JsonWriter(sink)
+        found = False
+        if member is None:
+            writer.start_map()
+        events = self._events()
+        for key, event, value in events:
+            if member is not None and key != member:
+                json_stream.skip_value(events.events, event)
+                continue
+            found = True
+            if member is None:
+                writer.key(_to_text(_expand_scalar(key, context)))
+            if key in self.sections:
+                json_stream.skip_value(events.events, event)
+                writer.value(context.expand(_member_node(self.compiled.root, key)))
+            else:
+                _stream_value(events.events, event, value, writer, context)
+        if member is None:
+            writer.end_map()
+        elif not found:
+            raise ValueError("Template missing required '{}' element".format(member))
+
+
+class _MemberEvents(object):
+    """Iterate the top level members of a JSON object as (key, event, value) triples,
+    where the event and value start the member's value."""
+
+    def __init__(self, events):
+        self.events = events
+        event, _ = next(events)
+        if event != json_stream.START_MAP:
+            raise ValueError("template isn't a JSON dictionary")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        event, key = next(self.events)
+        if event == json_stream.END_MAP:
+            raise StopIteration
+        event, value = next(self.events)
+        return key, event, value
+
+    next = __next__
+
+
+_WORKER_TEMPLATE = None
+_WORKER_POINTER = None
+
+
+def _initialize_worker(template, pointer=None):
+    global _WORKER_TEMPLATE, _WORKER_POINTER  # pylint: disable=global-statement
+    _WORKER_TEMPLATE = template
+    _WORKER_POINTER = pointer
+
+
+def _expand_in_worker(item):
+    index, parameters = item
+    try:
+        return index, _WORKER_TEMPLATE.expand(parameters, pointer=_WORKER_POINTER), None
+    except Exception as error:  # pylint: disable=broad-except
+        return index, None, error
+
+
+def expand_many(template, parameter_sets, workers=None, chunk_size=None, pointer=None):
+    """Expand a compiled template against many sets of parameter values in a pool of
+    worker processes. Each worker receives the compiled template once when it starts.
+    :param template: The compiled template.
+    :type template: :class:`CompiledTemplate`
+    :param parameter_sets: An iterable of parameter value dictionaries.
+    :param int workers: The number of worker processes, defaults to the CPU count.
+    :param int chunk_size: The number of parameter sets sent to a worker at a time.
+    :param str pointer: A JSON pointer to the only part of the template to expand.
+    :returns: A generator of (index, expanded template) pairs in order of completion,
+     where index is the position of the parameter values in parameter_sets.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1:
+        for index, parameters in enumerate(parameter_sets):
+            yield index, template.expand(parameters, pointer=pointer)
+        return
+    if not chunk_size:
+        try:
+            chunk_size = max(1, len(parameter_sets) // (workers * 4))
+        except TypeError:
+            chunk_size = 16
+    pool = multiprocessing.Pool(workers, _initialize_worker, (template, pointer))
+    try:
+        results = pool.imap_unordered(_expand_in_worker, enumerate(parameter_sets), chunk_size)
+        for index, expanded, error in results:
+            if error is not None:
+                raise error
+            yield index, expanded
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def content_hash(template):
+    """Return a digest identifying the content of a JSON template."""
+    content = json.dumps(template, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class CompiledTemplateCache(object):
+    """A thread-safe, least-recently-used cache of compiled templates keyed by content.
+    :param int max_size: The maximum number of compiled templates to keep.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, template):
+        """Return the compiled form of a template, compiling it if required.
+        :param dict template: The loaded JSON template.
+        """
+        key = content_hash(template)
+        with self._lock:
+            compiled = self._entries.pop(key, None)
+            if compiled is not None:
+                self._entries[key] = compiled
+                return compiled
+        compiled = CompiledTemplate(template, key)
+        with self._lock:
+            self._entries[key] = compiled
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return compiled
+
+
+class ExpansionResultCache(object):
+    """A thread-safe, least-recently-used cache of expanded templates keyed by the
+    content of the template and the parameter values. Every call returns a copy of
+    the cached result, so modifying it leaves the cache unchanged.
+    :param int max_size: The maximum number of expanded templates to keep.
+    """
+
+    def __init__(self, max_size=DEFAULT_RESULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Remove every result and reset the hit and miss counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def expand(self, template, parameters=None, lazy=False, pointer=None):
+        """Return the expansion of a compiled template, from the cache if it has
+        been expanded with the same parameter values before.
+        :param template: The compiled template.
+        :type template: :class:`CompiledTemplate`
+        :param dict parameters: Parameter values by name.
+        :param bool lazy: Whether copy loops are expanded on demand.
+        :param str pointer: A JSON pointer to the only part of the template to expand.
+        """
+        try:
+            key = (template.content_hash, content_hash(parameters or {}), lazy, pointer)
+        except TypeError:  # Parameter values that are not JSON, no caching
+            key = None
+        with self._lock:
+            result = self._entries.pop(key, self) if key else self
+            if result is not self:
+                self._entries[key] = result
+                self.hits += 1
+                return _copy_json(result)
+            self.misses += 1
+        result = template.expand(parameters, lazy, pointer)
+        if key:
+            with self._lock:
+                self._entries[key] = result
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            return _copy_json(result)
+        return result
+
+
+compiled_templates = CompiledTemplateCache()
+
+
+def compile_template(template):
+    """Return the compiled form of a template from the shared cache.
+    :param dict template: The loaded JSON template.
+    """
+    return compiled_templates.get(template)
@@ -6,11 +6,19 @@
 # pylint: disable=too-many-lines
 from __future__ import unicode_literals
 
+import ast
+import bisect
 import copy
+import hashlib
+import heapq
 import itertools
 import json
+import math
 from logging import getLogger
+import operator
+import os
 import re
+import threading
 from msrest.serialization import Model
 try:
     from shlex import quote as shell_escape
@@ -19,133 +27,180 @@ except ImportError:
 
 from . import errors
 from . import _pool_utils as pool_utils
+from . import _template_cache as template_cache
+from . import _template_engine as engine
 from . import models
 
 logger = getLogger(__name__)
+
+# The opt-in cache of expanded templates, see enable_expansion_cache
+expansion_results = None
 try:
     _UNICODE_TYPE = unicode
 except NameError:
     _UNICODE_TYPE = str
+try:
+    _range = xrange
+except NameError:
+    _range = range
 
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
 
-def _validate_int(value, content):
-    """Return parameter value as an integer.
-    :param str value: The raw parameter value.
-    :param dict content: The template parameter definition.
-    :returns: int
-    """
-    try:
-        original = str(value)
-        value = int(value)
-    except (ValueError, UnicodeEncodeError):
-        raise TypeError("'{}' is not a valid integer.".format(value))
-    if str(value) != original:
-        raise TypeError("'{}' is not a valid integer.".format(value))
-    try:
-        if value < int(content['minValue']):
-            raise ValueError("Minimum value: {}".format(content['minValue']))
-    except KeyError:
-        pass
-    try:
-        if value > int(content['maxValue']):
-            raise ValueError("Maximum value: {}".format(content['maxValue']))
-    except KeyError:
-        pass
-    return value
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
+# The number of tasks submitted in each add_collection request
+MAX_TASKS_PER_REQUEST = 100
 
-def _validate_string(value, content):
-    """Return parameter value as a string.
-    :param str value: The raw parameter value.
-    :param dict content: The template parameter definition.
-    :returns: str
-    """
-    if value is None:
-        raise TypeError("String value must be provided")
+# The number of parametric sweep tasks generated at a time when iterating
+_SWEEP_BLOCK_SIZE = 1000
 
-    value = value if isinstance(value, _UNICODE_TYPE) else str(value)
-    try:
-        if len(value) < int(content['minLength']):
-            raise ValueError("Minimum length: {}".format(content['minLength']))
-    except KeyError:
-        pass
+# The number of parametric sweep tasks from which their values are calculated with NumPy
+_VECTORIZED_SWEEP_SIZE = 64
+
+# The number of files listed ahead of the task per file tasks being submitted
+_LISTING_PREFETCH_SIZE = 10000
+
+# The task factories generating tasks for the files in a container
+FILE_TASK_FACTORIES = ('taskPerFile', 'taskPerFileBatch')
+
+# The fewest consecutive numeric task IDs a task depends on replaced by a task ID range
+MIN_TASK_ID_RANGE = 3
+
+# The task IDs a task ID range refers to
+_NUMERIC_TASK_ID = re.compile(r'^(0|[1-9][0-9]*)$')
+
+
+_PARAMETER_TYPES = frozenset(['int', 'string', 'bool', 'object'])
+_APPLICATION_PARAMETER_TYPES = frozenset(['int', 'string', 'bool'])
+
+
+def _bound(content, key):
+    """Return an integer constraint from a parameter definition, or None if absent."""
     try:
-        if len(value) > int(content['maxLength']):
-            raise ValueError("Maximum length: {}".format(content['maxLength']))
+        return int(content[key])
     except KeyError:
-        pass
-    return value
+        return None
 
 
-def _validate_bool(value):
-    """Return parameter value as boolean.
-    :param str value: The raw parameter value.
+class ParameterValidator(object):
+    """A template parameter definition compiled for validating values.
+    Bounds, length limits and the set of allowed values are read from the
+    definition once, so each value is checked in constant time.
+    :param str name: The parameter name.
     :param dict content: The template parameter definition.
-    :returns: bool
     """
-    if value in [True, False]:
+
+    def __init__(self, name, content):
+        self.name = name
+        self.type = content.get('type')
+        self.min_value = self.max_value = self.min_length = self.max_length = None
+        if self.type == 'int':
+            self.min_value = _bound(content, 'minValue')
+            self.max_value = _bound(content, 'maxValue')
+        elif self.type == 'string':
+            self.min_length = _bound(content, 'minLength')
+            self.max_length = _bound(content, 'maxLength')
+        self.allowed_values = content.get('allowedValues')
+        self.allowed_set = None
+        if self.allowed_values is not None:
+            try:
+                self.allowed_set = frozenset(self.allowed_values)
+            except TypeError:
+                pass  # Unhashable allowed values are checked one by one
+
+    def convert(self, value):
+        """Return the value converted to the parameter type, without checking
+        any further constraints.
+        :raises: TypeError if the value is not compatible with the type.
+        """
+        if self.type == 'int':
+            return self._convert_int(value)
+        if self.type == 'bool':
+            return self._convert_bool(value)
+        if self.type == 'string':
+            if value is None:
+                raise TypeError("String value must be provided")
+            return value if isinstance(value, _UNICODE_TYPE) else str(value)
+        if self.type == 'object':
+            return value
+        raise ValueError("The parameter '{}' specifies an unsupported "
+                         "type: {}".format(self.name, self.type))
+
+    @staticmethod
+    def _convert_int(value):
+        try:
+            original = str(value)
+            converted = int(value)
+        except (ValueError, UnicodeEncodeError):
+            raise TypeError("'{}' is not a valid integer.".format(value))
+        if str(converted) != original:
+            raise TypeError("'{}' is not a valid integer.".format(value))
+        return converted
+
+    @staticmethod
+    def _convert_bool(value):
+        if value in [True, False]:
+            return value
+        try:
+            if str(value).lower() == 'true':
+                return True
+            if str(value).lower() == 'false':
+                return False
+            raise TypeError("'{}' is not a valid bool".format(value))
+        except UnicodeEncodeError:
+            raise TypeError("'{}' is not a valid bool".format(value))
+
+    def _check(self, value):
+        if self.min_value is not None and value < self.min_value:
+            raise ValueError("Minimum value: {}".format(self.min_value))
+        if self.max_value is not None and value > self.max_value:
+            raise ValueError("Maximum value: {}".format(self.max_value))
+        if self.min_length is not None and len(value) < self.min_length:
+            raise ValueError("Minimum length: {}".format(self.min_length))
+        if self.max_length is not None and len(value) > self.max_length:
+            raise ValueError("Maximum length: {}".format(self.max_length))
+        if self.allowed_values is None:
+            return
+        try:
+            allowed = value in self.allowed_set
+        except TypeError:  # No set of allowed values, or an unhashable value
+            allowed = value in self.allowed_values
+        if not allowed:
+            raise ValueError("Allowed values: {}".format(
+                ', '.join(str(v) for v in self.allowed_values)))
+
+    def validate(self, value):
+        """Validate the input parameter is valid for specified template. Checks the following:
+            Check input fit with parameter type, if yes, convert to correct type
+            Check input matched with the restriction of parameter
+        :param str value: The raw parameter value.
+        :returns: Validated input paramater.
+        """
+        try:
+            value = self.convert(value)
+            self._check(value)
+        except TypeError:
+            raise TypeError("The value '{}' of parameter '{}' is not a {}".format(
+                value, self.name, self.type))
+        except ValueError as value_error:
+            raise ValueError(
+                "The value '{}' of parameter '{}' does not meet the requirement: {}".format(
+                    value, self.name, str(value_error)))
         return value
-    try:
-        if str(value).lower() == 'true':
-            return True
-        if str(value).lower() == 'false':
-            return False
-        raise TypeError("'{}' is not a valid bool".format(value))
-    except UnicodeEncodeError:
-        raise TypeError("'{}' is not a valid bool".format(value))
-
-
-def _is_substitution(content, start, end):
-    """This is to support non-ARM-style direct parameter string substitution as a
-    simplification of the concat function. We may wish to remove this
-    if we want to adhere more strictly to ARM.
-    :param str content: The contents of an expression from the template.
-    :param int start: The start index of the expression.
-    :param int end: The end index of the expression.
-    """
-    return not (content[start - 1] == '"' and content[end + 1] == '"')
-
-
-def _find(delimiter, content, start_index):
-    """Given that a string starts at the index specified, scan for the end of that string.
-    :param str delimiter: Delimiter for which to search.
-    :param str content: String to scan.
-    :param int start_index: Index of the character after opening string delimiter.
-    :returns: Index of the closing string delimiter.
-    """
-    index = start_index
-    while index < len(content):
-        char = content[index]
-        if char == '\\':
-            index += 1
-        elif char == delimiter:
-            return index
-        index += 1
-    raise ValueError()
-
-
-def _find_nested(delimiter, content, start_index):
-    """Scan a string to find a specified delimiter, respecting nesting of brackets and strings.
-    :param str delimiter: Delimiter for which to search.
-    :param str content: String to scan.
-    :param int start_index: Index of the character after opening string delimiter.
-    :returns: Index of the closing string delimiter.
-    """
-    index = start_index
-    while index < len(content):
-        char = content[index]
-        if char == delimiter:
-            return index
-        if char == '[':
-            index = _find_nested(']', content, index + 1)
-        elif char == '(':
-            index = _find_nested(')', content, index + 1)
-        elif char == '"':
-            index = _find('"', content, index + 1)
-        elif char == '\'':
-            index = _find('\'', content, index + 1)
-        index += 1
-    return index
+
+
+def compile_parameter_validators(definitions):
+    """Return a validator for each parameter definition.
+    :param dict definitions: Parameter definitions by name.
+    """
+    return {name: ParameterValidator(name, content)
+            for name, content in (definitions or {}).items()}
 
 
 def _merge_metadata(base_metadata, more_metadata):
@@ -292,19 +347,19 @@ def _get_installation_cmdline(references, os_flavor):
     return {'cmdLine': command, 'isWindows': package_type == 'choco'}
 
 
-def _validate_parameter_usage(parameters, definitions):
+def _validate_parameter_usage(parameters, definitions, validators=None):
     """Validate the parameters supplied by the job against those defined on the template.
     :param dict parameters: Parameters supplied by the job.
     :param dict definitions: Parameter definitions from the application template.
+    :param dict validators: Validators compiled from the definitions, if available.
     """
     if parameters is None:
         parameters = {}
     if definitions is None:
         definitions = {}
     for name, definition in definitions.items():
-        supported_types = ['int', 'string', 'bool']
         try:
-            if definition['type'] not in supported_types:
+            if definition['type'] not in _APPLICATION_PARAMETER_TYPES:
                 raise ValueError("The parameter '{}' specifies an unsupported "
                                  "type: {}".format(name, definition['type']))
         except KeyError:
@@ -314,20 +369,14 @@ def _validate_parameter_usage(parameters, definitions):
         if parameter is None:
             raise ValueError("A value for parameter '{}' must be provided "
                              "by the job.".format(name))
+        validator = validators[name] if validators else ParameterValidator(name, definition)
         # Rule: If the parameter definition specifies 'int', the value provided must be compatible
-        if definition['type'] == 'int':
-            try:
-                _validate_int(parameter, {})
-            except TypeError:
-                raise ValueError("'Value '{}' supplied for parameter '{}' must be an "
-                                 "integer.".format(parameter, name))
         # Rule: if the parameter definition specified 'bool', the value provided must be compatible
-        elif definition['type'] == 'bool':
-            try:
-                _validate_bool(parameter)
-            except TypeError:
-                raise ValueError("'Value '{}' supplied for parameter '{}' must be a "
-                                 "boolean.".format(parameter, name))
+        try:
+            validator.convert(parameter)
+        except TypeError:
+            raise ValueError("'Value '{}' supplied for parameter '{}' must be {}.".format(
+                parameter, name, 'an integer' if validator.type == 'int' else 'a boolean'))
     # Rule: Only parameters values defined by the template are permitted
     violations = [k for k in parameters if k not in definitions]
     if violations:
@@ -375,29 +424,7 @@ def _validate_parameter(name, content, value):
     :param str value: The raw parameter value.
     :returns: Validated input paramater, otherwise None.
     """
-    try:
-        if content['type'] == 'int':
-            value = _validate_int(value, content)
-        elif content['type'] == 'bool':
-            value = _validate_bool(value)
-        elif content['type'] == 'string':
-            value = _validate_string(value, content)
-        elif content['type'] == 'object':
-            pass
-        else:
-            raise ValueError("The parameter '{}' specifies an unsupported "
-                             "type: {}".format(name, content['type']))
-        if value not in content.get('allowedValues', [value]):
-            raise ValueError("Allowed values: {}".format(', '.join(content['allowedValues'])))
-    except TypeError:
-        raise TypeError("The value '{}' of parameter '{}' is not a {}".format(
-            value, name, content['type']))
-    except ValueError as value_error:
-        raise ValueError(
-            "The value '{}' of parameter '{}' does not meet the requirement: {}".format(
-                value, name, str(value_error)))
-    else:
-        return value
+    return ParameterValidator(name, content).validate(value)
 
 
 def _get_template_params(template, param_values):
@@ -426,299 +453,19 @@ def _get_template_params(template, param_values):
     return param_keys
 
 
-def _parse_arm_parameter(name, template_obj, parameters):
-    """Render the content of an ARM property
-    :param str name: The name of the property to render.
-    :param dict template_obj: The loaded contents of the JSON template.
-    :param dict parameters: The loaded contents of the JSON parameters.
-    """
-    # Find name of root parameter
-    param_name_end = _find_nested(')', name, 0)  # Find end of name
-    if param_name_end >= len(name):
-        raise ValueError(
-            "Template reference misformatted for parameter '{}'".format(name))
-    # Interpret name of parameter
-    param_name = _parse_arm_expression(
-        name[1:param_name_end-1],
-        template_obj,
-        parameters)
-
-    # Make sure there are defined parameters
-    if 'parameters' not in template_obj:
-        raise ValueError("Template defines no parameters but tried to use '{}'".format(param_name))
-
-    try:
-        # Get parameter object
-        param_def = template_obj['parameters'][param_name]
-        # Parse nested object if exists
-        if len(name) > param_name_end+1:
-            param_def = _parse_nested_object(
-                param_def.get('defaultValue', param_def),
-                name[param_name_end+1:],
-                template_obj,
-                parameters)
-    except KeyError:
-        if param_def.get('type') != 'object':
-            raise ValueError("Template does not define parameter '{}'".format(param_name))
-
-    user_value = param_def.get('defaultValue') if isinstance(param_def, dict) else param_def
-    if parameters and param_name in parameters:
-        # Support both ARM and dictionary syntax
-        # ARM: '<PropertyName>' : { 'value' : '<PropertyValue>' }
-        # Dictionary: '<PropertyName>' : <PropertyValue>'
-        try:
-            parameters_value = parameters[param_name]
-            if len(name) > param_name_end + 1:
-                parameters_value = _parse_nested_object(
-                    parameters_value,
-                    name[param_name_end + 1:],
-                    template_obj,
-                    parameters)
-            user_value = parameters_value
-        except (TypeError, KeyError):
-            pass
-
-    if user_value is None:
-        raise errors.MissingParameterValue(
-            "No value supplied for parameter '{}' and no default value".format(param_name),
-            parameter_name=param_name,
-            parameter_description=param_def.get('metadata', {}).get('description'))
-    if isinstance(user_value, dict):
-        # If substitute value is a complex object - it may require
-        # additional parameter substitutions
-        return _parse_template(json.dumps(user_value), template_obj, parameters)
-    try:
-        if not isinstance(param_def, dict):
-            return param_def
-        return _validate_parameter(param_name, param_def, user_value)
-    except TypeError:
-        raise TypeError("Value '{}' for parameter '{}' must be a {}.".format(
-            user_value, param_name, param_def['type']))
-
-
-def _parse_nested_object(obj, references, template_obj, parameters):
-    """ Decouple [] and . notation references. Then applies to object.
-
-    :param object obj: Root object being traversed
-    :param str references: String of references to be decoupled
-    :param dict template_obj: The loaded contents of the JSON template.
-    :param dict parameters: The loaded contents of the JSON parameters.
-    :return: Object referenced
-    """
-    obj_refs = []
-    ret_obj = obj
-    var_name = references
-    # Find and interpret each nested object and add them to a queue
-    while True:
-        start_dict = _find_nested('[', var_name, 0)
-        start_obj = _find_nested('.', var_name, 0)
-        # Handles nested [] references
-        if 0 <= start_dict < start_obj:
-            end_index = _find_nested(']', var_name, start_dict + 1)
-            obj_ref_str = var_name[start_dict + 1:end_index]
-            obj_refs.append(
-                _parse_arm_expression(obj_ref_str, template_obj, parameters))
-            var_name = var_name[:start_dict] + var_name[end_index + 1:]
-        # Handles nested . references
-        elif 0 <= start_obj < start_dict:
-            next_start_dict = _find_nested('[', var_name, 1)
-            next_start_obj = _find_nested('.', var_name, 1)
-            end_index = next_start_dict if next_start_dict < next_start_obj else next_start_obj
-            end_index = end_index if end_index > start_obj else len(var_name)
-            obj_ref_str = var_name[start_obj + 1:end_index]
-            obj_refs.append(
-                _parse_arm_expression(obj_ref_str, template_obj, parameters))
-            var_name = var_name[:start_obj] + var_name[end_index:]
-        else:
-            break
-
-    while obj_refs:
-        ref = obj_refs.pop(0)
-        if isinstance(ret_obj, list):
-            ref = int(ref)
-        ret_obj = ret_obj[ref]
-
-    return ret_obj
-
-
-def _parse_arm_variable(name, template_obj, parameters):
-    """Render the value of an ARM variable.
-    :param str name: The name of the variable to render.
-    :param dict template_obj: The loaded contents of the JSON template.
-    :param dict parameters: The loaded contents of the JSON parameters.
-    """
-    try:
-        # Get head object referenced
-        variable_name_end = _find_nested(')', name, 0)  # Find end of variable name
-        if variable_name_end >= len(name):
-            raise ValueError("Template reference misformatted for variable '{}'".format(name))
-        variable_name = _parse_arm_expression(
-            name[1:variable_name_end-1],
-            template_obj,
-            parameters)  # Make sure inner name is fully parsed
-        variable_obj = template_obj['variables'][variable_name]
-        # If there is any text after ')' then there additional references on the object
-        if len(name) > variable_name_end+1:
-            variable_obj = _parse_nested_object(
-                variable_obj,
-                name[variable_name_end+1:],
-                template_obj,
-                parameters)
-
-        # parse the result object
-        variable = _parse_arm_expression(
-            variable_obj,
-            template_obj, parameters)
-    except KeyError:
-        raise ValueError("Template contains no definition for variable '{}'".format(name))
-    if isinstance(variable, dict):
-        # If substitute value is a complex object - it may require
-        # additional parameter substitutions
-        return _parse_template(json.dumps(variable), template_obj, parameters)
-    return variable
-
-
-def _parse_arm_concat(expression, template_obj, parameters):
-    """Evaluate an ARM concat expression.
-    :param str expression: The concat expression to evaluate.
-    :param dict template_obj: The loaded contents of the JSON template.
-    :param dict parameters: The loaded contents of the JSON parameters.
-    """
-    content = ""
-    index = 0
-    while index < len(expression):
-        end = _find_nested(',', expression, index)
-        argument = expression[index:end].strip()
-        content += _parse_arm_expression(argument, template_obj, parameters)
-        index = end + 1
-    return content
-
-
-def _parse_arm_expression(expression, template_obj, parameters):
-    """Determine if a section of the template is an ARM reference, and calculate
-    the replacement accordingly. The result will be correctly typed to suit the
-    parameter definition (e.g. will return a number if the parameter requires a number)
-    :param str expression: A section of template contained within [].
-    :param dict template_obj: The loaded contents of the JSON template.
-    :param dict parameters: The loaded contents of the JSON parameters.
-    """
-    if not isinstance(expression, str):
-        return expression
-    if expression[0] == '[' and expression[-1] == ']':
-        # Remove the enclosing brackets to check the contents
-        return _parse_arm_expression(expression[1:-1], template_obj, parameters)
-    if expression[0] == '(' and expression[-1] == ')':
-        # If the section is surrounded by ( ), then we need to further process the contents
-        # as either a parameter name, or a concat operation
-        return _parse_arm_expression(expression[1:-1], template_obj, parameters)
-    if expression[0] == '\'' and expression[-1] == '\'':
-        # If a string, remove quotes in order to perform parameter look-up
-        return expression[1:-1]
-    if re.match(r'^parameters', expression):
-        result = _parse_arm_parameter(expression[11:], template_obj, parameters)
-    elif re.match(r'^variables', expression):
-        result = _parse_arm_variable(expression[10:], template_obj, parameters)
-    elif re.match(r'^concat', expression):
-        result = _parse_arm_concat(expression[7:-1], template_obj, parameters)
-    elif re.match(r'^reference', expression):
-        raise NotImplementedError("ARM-style 'reference' syntax not supported.")
-    else:
-        result = expression
-    return result
-
-
-def _parse_template_string(string_content, template_obj, parameters):
-    """Given a string value (including quotes), evaluate any embedded template expressions
-    delimited by '[' and ']'.
-    :param str string_content: The contents of the template string.
-    :param dict template_obj: The loaded JSON template file.
-    :param dict parameters: The contents of the parameters file.
-    """
-    updated_content = ""
-    current_index = 0
-    while current_index < len(string_content):
-        try:
-            expression_start = string_content.index('[', current_index)
-        except ValueError:  # No template expression to evaluate
-            break
-        if expression_start < len(string_content) - 1 and \
-                string_content[expression_start + 1] == '[':
-            # Found escaped expression
-            updated_content += string_content[current_index:expression_start] + '['
-            current_index = expression_start + 2
-            continue
-        expression_end = _find_nested(']', string_content, expression_start + 1)
-        if expression_end >= len(string_content):
-            # No closing delimiter for the expression (not our problem)
-            break
-        # Everything between [ and ]
-        expression = string_content[expression_start + 1:expression_end]
-        parsed = _parse_arm_expression(expression, template_obj, parameters)
-        if _is_substitution(string_content, expression_start, expression_end):
-            # Replacing within the middle of a string
-            parsed = parsed if isinstance(parsed, _UNICODE_TYPE) else str(parsed)
-            updated_content += string_content[current_index:expression_start] + json.dumps(parsed)[1:-1]
-            current_index = expression_end + 1
-        elif isinstance(parsed, bool):
-            parsed = "true" if parsed else "false"
-            updated_content += string_content[current_index:expression_start - 1] + parsed
-            current_index = expression_end + 2
-        elif isinstance(parsed, int):
-            # Replacing an entire element value, and we want to remove any surrounding quotes
-            updated_content += string_content[current_index:expression_start - 1] + str(parsed)
-            current_index = expression_end + 2
-        elif isinstance(parsed, dict):
-            json_content = json.dumps(parsed)
-            updated_content += string_content[current_index:expression_start - 1] + json_content
-            current_index = expression_end + 2
-        else:
-            parsed = parsed if isinstance(parsed, _UNICODE_TYPE) else str(parsed)
-            updated_content += string_content[current_index:expression_start] + json.dumps(parsed)[1:-1]
-            current_index = expression_end + 1
-    updated_content += string_content[current_index:]
-    return updated_content
-
-
 def _parse_template(template_str, template_obj, parameters):
-    """Expand all parameters, and variables in the template.
-
-    We want to expand all template expressions (delimited by '[' and ']') in the supplied template
-    string. However, that syntax collides with JSON syntax for arrays and we don't want to collide
-    with any of those. To avoid such a collision, we iterate through all of the string values
-    (delimited by double quotes (")) and then expand template expressions only within those.
-
+    """Expand all parameters, and variables in a serialized template fragment.
     :param str template_str: Content of the template file as a string.
     :param dict template_obj: Contents of the template file.
     :param dict parameters: Contents of the parameters file.
     :returns: Fully resolved JSON template.
     """
-    updated_json = ""
-    current_index = 0
-    while current_index < len(template_str):
-        try:
-            string_start = template_str.index('"', current_index)
-        except ValueError:  # Didn't find another string to expand
-            break
-        try:
-            string_end = _find('"', template_str, string_start + 1)
-        except ValueError:  # Didn't find terminating quote for string (not our problem)
-            break
-        string_content = template_str[string_start:string_end + 1]
-        if '[' in string_content:
-            updated_json += template_str[current_index:string_start]
-            updated_json += _parse_template_string(string_content, template_obj, parameters)
-        else:
-            updated_json += template_str[current_index:string_end + 1]
-        current_index = string_end + 1
-    updated_json += template_str[current_index:]
     try:
-        return json.loads(updated_json)
+        fragment = json.loads(template_str)
     except ValueError as exp:
-        try:
-            return json.loads(updated_json.encode('string_escape').replace('\\\\', '\\'))
-        except LookupError:
-            raise ValueError("Unable to load JSON template {}, error: {}".format(
-                updated_json, str(exp)))
+        raise ValueError("Unable to load JSON template {}, error: {}".format(
+            template_str, str(exp)))
+    return engine.compile_template(template_obj).expand_value(fragment, parameters)
 
 
 def _process_resource_files(request, fileutils):
@@ -770,36 +517,108 @@ def _parse_task_output_files(task, file_utils):
                 destination.container.container_url)
 
 
+class _SweepPlaceholder(object):
+    """A {n} or {n:m} placeholder for the n-th parametric sweep value, in the latter
+    case zero padded to m digits."""
+    pattern = re.compile(r'\{(\d+)(?::(\d+))?\}')
+
+    def __init__(self, match):
+        self.text = match.group(0)
+        self.index = int(match.group(1))
+        self.padding = None
+        if match.group(2) is not None:
+            self.padding = int(match.group(2))
+            if self.padding < 1 or self.padding > 9:
+                raise ValueError(
+                    "The parameter pattern '{}' is out of bound. "
+                    "The padding number can be only between 1 to 9.".format(self.text))
+
+    def __call__(self, parameters):
+        if self.index >= len(parameters):
+            raise ValueError("The parameter pattern '{}' is out of bound.".format(self.text))
+        value = parameters[self.index]
+        if self.padding is None:
+            return str(value)
+        if value < 0:
+            raise ValueError(
+                "The parameter '{}' is negative and cannot be used in pattern '{}'.".format(
+                    value, self.text))
+        return str(value).zfill(self.padding)
+
+
+class _FilePlaceholder(object):
+    """A placeholder for a property of the file a task is generated for."""
+    pattern = re.compile(r'\{(url|filePath|fileName|fileNameWithoutExtension)\}')
+
+    def __init__(self, match):
+        self.key = match.group(1)
+
+    def __call__(self, file_ref):
+        return file_ref[self.key]
+
+
+class _FileBatchPlaceholder(object):
+    """A placeholder for the number of files a task is generated for, or the
+    space-separated list of one property of each of them."""
+    pattern = re.compile(r'\{(fileCount|urls|filePaths|fileNames|fileNamesWithoutExtension)\}')
+    _FILE_KEYS = {'urls': 'url', 'filePaths': 'filePath', 'fileNames': 'fileName',
+                  'fileNamesWithoutExtension': 'fileNameWithoutExtension'}
+
+    def __init__(self, match):
+        self.key = self._FILE_KEYS.get(match.group(1))
+
+    def __call__(self, file_refs):
+        if self.key is None:
+            return str(len(file_refs))
+        return ' '.join(f[self.key] for f in file_refs)
+
+
+class _PlaceholderFormat(object):
+    """A string split once into literal text and placeholders, so that replacing the
+    placeholders only joins the literal text with the placeholder values.
+    By design, user should escape all the literal '{' or '}' to '{{' or '}}'.
+    All other '{' or '}' characters are used for replacement.
+    :param str source: The string containing placeholders.
+    :param type placeholder_type: The placeholder class, such as
+     :class:`_SweepPlaceholder` or :class:`_FilePlaceholder`.
+    """
+
+    def __init__(self, source, placeholder_type):
+        # Handle '{' and '}' escape scenario: '{{' is replaced from the left, and '}}'
+        # from the right, so that {{{0}}} is a placeholder within brackets.
+        text = source.replace('{{', _LEFT_BRACKET)
+        text = text[::-1].replace('}}', _RIGHT_BRACKET)[::-1]
+        self.segments = []
+        position = 0
+        for match in placeholder_type.pattern.finditer(text):
+            self._add_literal(text[position:match.start()])
+            self.segments.append(placeholder_type(match))
+            position = match.end()
+        self._add_literal(text[position:])
+
+    def _add_literal(self, text):
+        if '{' in text or '}' in text:
+            raise ValueError(
+                "Invalid use of bracket characters, did you forget to escape (using {{}})?")
+        if text:
+            self.segments.append(text.replace(_LEFT_BRACKET, '{').replace(_RIGHT_BRACKET, '}'))
+
+    def format(self, context):
+        """Return the string with the placeholders replaced by values from the context."""
+        return ''.join([s if isinstance(s, _UNICODE_TYPE) else s(context) for s in self.segments])
+
+
+_LEFT_BRACKET = u'\uE800'  # pylint: disable=anomalous-unicode-escape-in-string
+_RIGHT_BRACKET = u'\uE801'  # pylint: disable=anomalous-unicode-escape-in-string
+
+
 def _transform_sweep_str(data, parameters):
     """Replace string placeholders with parametric sweep values.
     :param str data: The string containing placeholders.
     :param list parameters: The sweep values, each value maps
      to one of {0}, {1}, .. {n} by index.
     """
-    # Handle {n} or {n:m} scenario
-    reg = re.compile(r'\{(\d+)(:(\d+))?\}')
-
-    def replace(match):
-        r, r1, _, r3 = [data[start:end] for start, end in match.regs]
-        n = int(r1)
-        if n >= len(parameters):
-            raise ValueError("The parameter pattern '{}' is out of bound.".format(r))
-        number_str = str(parameters[n])
-        if ':' in r:
-            # This is {n:m} scenario
-            if parameters[n] < 0:
-                raise ValueError(
-                    "The parameter '{}' is negative and cannot be used in pattern '{}'.".format(
-                        parameters[n], r))
-            m = int(r3)
-            if m < 1 or m > 9:
-                raise ValueError(
-                    "The parameter pattern '{}' is out of bound. "
-                    "The padding number can be only between 1 to 9.".format(r))
-            return number_str.zfill(m)
-        # This is just {n} scenario
-        return number_str
-    return reg.sub(replace, data)
+    return _PlaceholderFormat(data, _SweepPlaceholder).format(parameters)
 
 
 def _transform_file_str(content, file_ref):
@@ -808,16 +627,11 @@ def _transform_file_str(content, file_ref):
     :param dict file_ref: The file information, containing 'url',
      'filePath etc properties.
     """
-    replace_props = ['url', 'filePath', 'fileName', 'fileNameWithoutExtension']
-    for prop in replace_props:
-        content = re.sub("{" + prop + "}", file_ref[prop], content)
-    return content
+    return _PlaceholderFormat(content, _FilePlaceholder).format(file_ref)
 
 
 def _replacement_transform(transformer, source_obj, source_key, context):
-    """Transform a string by applying specific context values.
-    By design, user should escape all the literal '{' or '}' to '{{' or '}}'.
-    All other '{' or '}' characters are used for replacement
+    """Transform a string attribute by applying specific context values.
     :param func transformer: The tranformation function to run.
     :param dict source_obj: The object containing the string to be transformed.
     :param str key: The key of the string to be transformed.
@@ -828,81 +642,242 @@ def _replacement_transform(transformer, source_obj, source_key, context):
     source_str = getattr(source_obj, source_key, None)
     if not source_str:
         return
-    # Handle '{' and '}' escape scenario : replace '{{' to LEFT_BRACKET_REPLACE_CHAR,
-    # and '}}' to RIGHT_BRACKET_REPLACE_CHAR. The reverse function is used to handle {{{0}}}.
-    LEFT_BRACKET_REPLACE_CHAR = u'\uE800'  # pylint: disable=anomalous-unicode-escape-in-string
-    RIGHT_BRACKET_REPLACE_CHAR = u'\uE801'  # pylint: disable=anomalous-unicode-escape-in-string
-    transformed = re.sub(r'\{\{', LEFT_BRACKET_REPLACE_CHAR, source_str)[::-1]
-    transformed = re.sub(r'\}\}', RIGHT_BRACKET_REPLACE_CHAR, transformed)[::-1]
-    transformed = transformer(transformed, context)
-    if '{' in transformed or '}' in transformed:
-        raise ValueError(
-            "Invalid use of bracket characters, did you forget to escape (using {{}})?")
-    # Replace LEFT_BRACKET_REPLACE_CHAR back to '{', and RIGHT_BRACKET_REPLACE_CHAR back to '}'
-    transformed = re.sub(LEFT_BRACKET_REPLACE_CHAR, '{', transformed)
-    transformed = re.sub(RIGHT_BRACKET_REPLACE_CHAR, '}', transformed)
-    setattr(source_obj, source_key, transformed)
-
-
-def _transform_repeat_task(task, context, index, transformer):
-    """Apply the transformer to a task template to yield a new task.
-    :param dict task: The repeatTask task template.
-    :param context: The task-factory specific context to apply to the template.
-    :param index: The task factory index to use as task ID.
-    :param func transformer: The transforming function to apply the
-     context to the template.
-    """
-    if not task or not task.command_line:
-        raise ValueError("RepeatTask and it's command line must be defined.")
-    new_task = models.ExtendedTaskParameter(id=str(index), **copy.deepcopy(task.__dict__))
-    _replacement_transform(transformer, new_task, 'command_line', context)
-    _replacement_transform(transformer, new_task, 'display_name', context)
-    try:
-        for resource in new_task.resource_files:
-            _replacement_transform(transformer, resource, 'file_path', context)
-            _replacement_transform(transformer, resource, 'http_url', context)
-            try:
-                for param in ['file_group', 'prefix', 'container_url', 'url']:
-                    _replacement_transform(transformer, resource.source, param, context)
-            except AttributeError:
-                # Using a traditional ResourceFile object with no 'source'.
-                pass
-    except TypeError:
-        # No resource files
-        pass
-    try:
-        for env_variable in new_task.environment_settings:
-            for param in ['name', 'value']:
-                _replacement_transform(transformer, env_variable, param, context)
-    except TypeError:
-        # No resource files
-        pass
-    try:
-        for output in new_task.output_files:
-            _replacement_transform(transformer, output, 'file_pattern', context)
-            try:
-                for param in ['path', 'container_url']:
-                    _replacement_transform(transformer, output.destination.container, param, context)
-            except AttributeError:
-                pass  # Not using container reference
+    setattr(source_obj, source_key, transformer(source_str, context))
+
+
+# The attributes of a repeat task in which placeholders are replaced. Nested attributes
+# apply to each item of a list. The destinations of output files are replaced in place
+# when the task is submitted, so they are always copied.
+_REPEAT_TASK_PLACEHOLDERS = {
+    'command_line': None,
+    'display_name': None,
+    'resource_files': {
+        'file_path': None,
+        'http_url': None,
+        'source': {'file_group': None, 'prefix': None, 'container_url': None, 'url': None}},
+    'environment_settings': {'name': None, 'value': None},
+    'output_files': {
+        'file_pattern': None,
+        'destination': {
+            'container': {'path': None, 'container_url': None},
+            'auto_storage': {'path': None, 'file_group': None}}},
+}
+_ALWAYS_COPIED = frozenset(['output_files', 'destination', 'container', 'auto_storage'])
+
+
+def _placeholder_paths(value, paths):
+    """Return the subset of paths within a value that hold placeholders (or must be
+    copied regardless), or None if there are none."""
+    if isinstance(value, list):
+        found = {}
+        for item in value:
+            _merge_paths(found, _placeholder_paths(item, paths) or {})
+        return found or None
+    found = {}
+    for key, subpaths in paths.items():
+        item = getattr(value, key, None)
+        if not item:
+            continue
+        if subpaths is None:
+            if '{' in item or '}' in item:
+                found[key] = None
+            continue
+        nested = _placeholder_paths(item, subpaths)
+        if nested is not None:
+            found[key] = nested
+        elif key in _ALWAYS_COPIED:
+            found[key] = {}
+    return found or None
+
+
+def _merge_paths(paths, more_paths):
+    """Add the paths found in one item of a list to those found in the others."""
+    for key, subpaths in more_paths.items():
+        if subpaths is None or key not in paths:
+            paths[key] = subpaths
+        else:
+            _merge_paths(paths[key], subpaths)
+
+
+class _TaskSkeleton(object):
+    """A repeat task compiled once for generating many tasks from it. Attributes
+    without placeholders are shared by every generated task; only the objects on the
+    path to a placeholder are copied for each task.
+    :param task: The repeatTask task template.
+    :type task: :class:`RepeatTask<azext.batch.models.RepeatTask>`
+    :param type placeholder_type: The type of placeholder, either
+     :class:`_SweepPlaceholder` or :class:`_FilePlaceholder`.
+    """
+
+    def __init__(self, task, placeholder_type):
+        if not task or not task.command_line:
+            raise ValueError("RepeatTask and it's command line must be defined.")
+        self.placeholder_type = placeholder_type
+        self.formats = {}
+        self.attributes = dict(task.__dict__)
+        # Not an attribute of a task, and would be logged as unknown for every task
+        self.attributes.pop('additional_properties', None)
+        self.paths = _placeholder_paths(task, _REPEAT_TASK_PLACEHOLDERS) or {}
+
+    def _render(self, value, paths, context):
+        if isinstance(value, list):
+            return [self._render(i, paths, context) for i in value]
+        if paths is None:
+            if not value:
+                return value
             try:
-                for param in ['path', 'file_group']:
-                    _replacement_transform(transformer, output.destination.auto_storage, param, context)
-            except AttributeError:
-                pass  # Not using autostorage reference
-    except TypeError:
-        # No resource files
-        pass
-    return new_task
+                string_format = self.formats[value]
+            except KeyError:
+                string_format = self.formats[value] = _PlaceholderFormat(
+                    value, self.placeholder_type)
+            return string_format.format(context)
+        value = copy.copy(value)
+        for key, subpaths in paths.items():
+            item = getattr(value, key, None)
+            if item:
+                setattr(value, key, self._render(item, subpaths, context))
+        return value
+
+    def render(self, context, index):
+        """Return the task generated for a context.
+        :param context: The task-factory specific context to apply to the template.
+        :param index: The task factory index to use as task ID.
+        """
+        attributes = dict(self.attributes)
+        for key, subpaths in self.paths.items():
+            attributes[key] = self._render(attributes[key], subpaths, context)
+        return models.ExtendedTaskParameter(id=str(index), **attributes)
+
+
+class _FileBatchSkeleton(_TaskSkeleton):
+    """A repeat task compiled once for generating a task for each of many batches of
+    files. Resource files with placeholders for a single file are repeated for every
+    file in the batch, and the rest of the task can refer to the whole batch.
+    :param task: The repeatTask task template.
+    :type task: :class:`RepeatTask<azext.batch.models.RepeatTask>`
+    """
+    _FILE_ATTRIBUTES = ('http_url', 'file_path')
+
+    def __init__(self, task):
+        batch_task = copy.copy(task)
+        batch_task.resource_files = []
+        self.file_resources = []
+        for resource_file in task.resource_files or []:
+            formats = {key: _PlaceholderFormat(getattr(resource_file, key), _FilePlaceholder)
+                       for key in self._FILE_ATTRIBUTES
+                       if _FilePlaceholder.pattern.search(getattr(resource_file, key, None) or '')}
+            if formats:
+                self.file_resources.append((resource_file, formats))
+            else:
+                batch_task.resource_files.append(resource_file)
+        batch_task.resource_files = batch_task.resource_files or None
+        super(_FileBatchSkeleton, self).__init__(batch_task, _FileBatchPlaceholder)
+
+    def render(self, context, index):
+        task = super(_FileBatchSkeleton, self).render(context, index)
+        if self.file_resources:
+            task.resource_files = list(task.resource_files or [])
+            for file_ref in context:
+                for resource_file, formats in self.file_resources:
+                    resource_file = copy.copy(resource_file)
+                    for key, string_format in formats.items():
+                        setattr(resource_file, key, string_format.format(file_ref))
+                    task.resource_files.append(resource_file)
+        return task
+
+
+def _pack_files(files, max_bytes, max_files=None):
+    """Pack files into batches of at most max_bytes in total, and at most max_files
+    each. The files are packed largest first, each into the batch with the most room
+    left if it fits, which keeps the number of batches low and their sizes even.
+    :param files: The file references, with their size as 'contentLength'.
+    :returns: The batches, each a list of file references.
+    """
+    batches = []
+    # Negated room left in each batch that can take more files, most room first
+    room_left = []
+    for file_ref in sorted(files, key=lambda f: f['contentLength'], reverse=True):
+        size = file_ref['contentLength']
+        if room_left and -room_left[0][0] >= size:
+            room, index = heapq.heappop(room_left)
+            batches[index].append(file_ref)
+            room += size
+        else:
+            batches.append([file_ref])
+            room, index = size - max_bytes, len(batches) - 1
+        if room < 0 and (not max_files or len(batches[index]) < max_files):
+            heapq.heappush(room_left, (room, index))
+    return batches
 
 
 def _transform_merge_task(task):
-    new_task = models.ExtendedTaskParameter(**copy.deepcopy(task.__dict__))
+    attributes = copy.deepcopy(task.__dict__)
+    # Neither is a task property, and leaving them in logs a warning for every task
+    attributes.pop('fan_in', None)
+    attributes.pop('additional_properties', None)
+    new_task = models.ExtendedTaskParameter(**attributes)
     return new_task
 
 
-def _parse_parameter_sets(parameter_sets):
-    """Parse parametric sweep set, and return all possible values in array.
+class _MergeTree(object):
+    """The merge tasks of a task factory, each generated only when it is requested.
+    Without a fan-in, or if the factory generates no more tasks than the fan-in, the
+    merge task depends on every task. Otherwise each level of intermediate merge tasks
+    depends on contiguous ranges of at most fan-in tasks of the level below, starting
+    from the tasks of the factory, and the merge task depends on the last level. The
+    intermediate merge tasks are numbered on from the tasks of the factory so that
+    every dependency is a single task ID range.
+    :param merge_task: The merge task of the task factory.
+    :type merge_task: :class:`MergeTask <azext.batch.models.MergeTask>`
+    :param int count: The number of tasks generated by the task factory.
+    :param int first: The task ID of the first task generated by the task factory.
+    """
+
+    def __init__(self, merge_task, count, first=0):
+        if merge_task.fan_in is not None and merge_task.fan_in < 2:
+            raise ValueError("The 'fanIn' of a merge task must be at least 2.")
+        self._merge_task = merge_task
+        self._fan_in = merge_task.fan_in
+        self._offset = first + count
+        # The first task ID of each level, the tasks of the factory being the first level
+        self._starts = [first]
+        self._sizes = [count]
+        while self._fan_in and self._sizes[-1] > self._fan_in:
+            self._starts.append(self._starts[-1] + self._sizes[-1])
+            self._sizes.append(-(-self._sizes[-1] // self._fan_in))
+
+    def __len__(self):
+        return sum(self._sizes[1:]) + 1
+
+    def task(self, index):
+        """Return a merge task, the last being the final merge task.
+        :param int index: The index of the merge task.
+        """
+        if index == len(self) - 1:
+            return self._render('merge', len(self._starts), self._starts[-1],
+                                self._starts[-1] + self._sizes[-1] - 1)
+        task_id = self._offset + index
+        level = bisect.bisect_right(self._starts, task_id) - 1
+        start = self._starts[level - 1] + (task_id - self._starts[level]) * self._fan_in
+        end = min(start + self._fan_in, self._starts[level - 1] + self._sizes[level - 1]) - 1
+        return self._render(str(task_id), level, start, end)
+
+    def _render(self, task_id, level, start, end):
+        task = _transform_merge_task(self._merge_task)
+        task.id = task_id
+        task.depends_on = models.TaskDependencies(
+            task_id_ranges=[models.TaskIdRange(start=start, end=end)])
+        if self._fan_in:
+            # Tell each merge task which level it is on and which tasks it merges
+            task.environment_settings = (task.environment_settings or []) + [
+                models.EnvironmentSetting(name='BATCH_MERGE_LEVEL', value=str(level)),
+                models.EnvironmentSetting(name='BATCH_MERGE_START_TASK_ID', value=str(start)),
+                models.EnvironmentSetting(name='BATCH_MERGE_END_TASK_ID', value=str(end))]
+        return task
+
+
+def _parameter_ranges(parameter_sets):
+    """Parse parametric sweep sets into the range of values of each.
     :param list parameter_sets: An array of parameter sets.
     """
     if not parameter_sets:
@@ -911,72 +886,587 @@ def _parse_parameter_sets(parameter_sets):
     for params in parameter_sets:
         valid_params = models.ParameterSet(start=params.start, end=params.end, step=params.step)
         end = valid_params.end + 1 if valid_params.end >= valid_params.start else valid_params.end - 1
-        iterations.append(range(valid_params.start, end, valid_params.step))
-    return itertools.product(*iterations)
+        iterations.append(_range(valid_params.start, end, valid_params.step))
+    return iterations
+
+
+def _parse_parameter_sets(parameter_sets):
+    """Parse parametric sweep set, and return all possible values in array.
+    :param list parameter_sets: An array of parameter sets.
+    """
+    return itertools.product(*_parameter_ranges(parameter_sets))
+
+
+def _sweep_columns(ranges, indices):
+    """Return the values of each parameter set for a NumPy array of sweep indices.
+    The index of a task is a mixed-radix number with one digit per parameter set.
+    :param list ranges: The range of values of each parameter set.
+    """
+    remainder = indices
+    columns = []
+    for iteration in reversed(ranges):
+        remainder, position = numpy.divmod(remainder, len(iteration))
+        step = iteration[1] - iteration[0] if len(iteration) > 1 else 1
+        columns.append(iteration[0] + position * step)
+    columns.reverse()
+    return columns
+
+
+def _sweep_positions(ranges, index):
+    """Return the position in the range of each parameter set of a sweep index."""
+    positions = []
+    for iteration in reversed(ranges):
+        index, position = divmod(index, len(iteration))
+        positions.append(position)
+    positions.reverse()
+    return positions
+
+
+def _sweep_values(ranges, start, stop, order=None):
+    """Return the parameter values of the tasks of a sweep from index start up to stop.
+    :param list ranges: The range of values of each parameter set.
+    :param order: The sweep index of the task at each index, if not in sweep order.
+    """
+    if order is not None:
+        indices = order[start:stop]
+        if numpy is not None and stop - start >= _VECTORIZED_SWEEP_SIZE:
+            columns = _sweep_columns(ranges, numpy.asarray(indices, dtype=numpy.int64))
+            return list(zip(*[c.tolist() for c in columns]))
+        return [tuple(iteration[p] for iteration, p in zip(ranges, _sweep_positions(ranges, i)))
+                for i in indices]
+    if numpy is not None and stop - start >= _VECTORIZED_SWEEP_SIZE:
+        columns = _sweep_columns(ranges, numpy.arange(start, stop, dtype=numpy.int64))
+        return list(zip(*[c.tolist() for c in columns]))
+    positions = _sweep_positions(ranges, start)
+    values = [iteration[p] for iteration, p in zip(ranges, positions)]
+    result = []
+    for _ in _range(start, stop):
+        result.append(tuple(values))
+        # Increment the index one digit at a time, starting from the last parameter set
+        for digit in _range(len(ranges) - 1, -1, -1):
+            positions[digit] += 1
+            if positions[digit] < len(ranges[digit]):
+                values[digit] = ranges[digit][positions[digit]]
+                break
+            positions[digit] = 0
+            values[digit] = ranges[digit][0]
+    return result
+
+
+class _CostExpression(object):
+    """An arithmetic expression of parametric sweep placeholders, such as '{0} * {1}',
+    estimating the cost of a task. It is evaluated either for the values of one task,
+    or for NumPy arrays of the values of many tasks at once.
+    :param str expression: The expression, of numbers, placeholders, parentheses and
+     the operators +, -, *, /, //, % and **.
+    """
+    _OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+                  ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv,
+                  ast.Mod: operator.mod, ast.Pow: operator.pow,
+                  ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.indices = set()
+        source = _SweepPlaceholder.pattern.sub(lambda m: ' _p{} '.format(m.group(1)), expression)
+        try:
+            self._tree = ast.parse(source.strip(), mode='eval').body
+        except SyntaxError:
+            raise ValueError("The cost expression '{}' is not valid.".format(expression))
+        self._check(self._tree)
+
+    def _check(self, node):
+        if isinstance(node, ast.BinOp) and type(node.op) in self._OPERATORS:
+            self._check(node.left)
+            self._check(node.right)
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in self._OPERATORS:
+            self._check(node.operand)
+        elif isinstance(node, ast.Name) and re.match(r'^_p\d+$', node.id):
+            self.indices.add(int(node.id[2:]))
+        elif not isinstance(self._number(node), (int, float)) or \
+                isinstance(self._number(node), bool):
+            raise ValueError("The cost expression '{}' may only contain numbers, parameter "
+                             "placeholders and arithmetic operators.".format(self.expression))
+
+    @staticmethod
+    def _number(node):
+        return getattr(node, 'value', getattr(node, 'n', None))
+
+    def evaluate(self, values):
+        """Return the cost for the values of each parameter set.
+        :param values: The value, or array of values, of each parameter set.
+        """
+        return self._evaluate(self._tree, values)
+
+    def _evaluate(self, node, values):
+        if isinstance(node, ast.BinOp):
+            return self._OPERATORS[type(node.op)](
+                self._evaluate(node.left, values), self._evaluate(node.right, values))
+        if isinstance(node, ast.UnaryOp):
+            return self._OPERATORS[type(node.op)](self._evaluate(node.operand, values))
+        if isinstance(node, ast.Name):
+            return values[int(node.id[2:])]
+        return self._number(node)
+
+
+def _sweep_costs(expression, ranges, count):
+    """Return the cost of each task of a sweep as a float, or NaN where the cost could
+    not be calculated. Both with and without NumPy, costs are calculated in double
+    precision from the parameter values converted to floats.
+    :param expression: The cost of a task.
+    :type expression: :class:`_CostExpression`
+    :param list ranges: The range of values of each parameter set.
+    :param int count: The number of tasks in the sweep.
+    """
+    if numpy is not None and count >= _VECTORIZED_SWEEP_SIZE:
+        columns = [c.astype(numpy.float64) for c in
+                   _sweep_columns(ranges, numpy.arange(count, dtype=numpy.int64))]
+        with numpy.errstate(all='ignore'):
+            try:
+                costs = numpy.asarray(expression.evaluate(columns), dtype=numpy.float64)
+                return numpy.broadcast_to(costs, (count,))
+            except (ArithmeticError, TypeError, ValueError):
+                pass  # Evaluated task by task below, to find the first task that fails
+    costs = []
+    for values in _sweep_values(ranges, 0, count):
+        try:
+            cost = expression.evaluate([float(v) for v in values])
+            # A negative number raised to a fractional power is complex
+            costs.append(float('nan') if isinstance(cost, complex) else float(cost))
+        except (ArithmeticError, TypeError, ValueError):
+            costs.append(float('nan'))
+    return costs
+
+
+def _order_by_cost(expression, ranges, count):
+    """Return the sweep indices of the tasks of a sweep in decreasing order of cost,
+    tasks of equal cost staying in sweep order.
+    :param expression: The cost of a task.
+    :type expression: :class:`_CostExpression`
+    :param list ranges: The range of values of each parameter set.
+    :param int count: The number of tasks in the sweep.
+    :raises: ValueError if the cost of any task is not a finite number.
+    """
+    costs = _sweep_costs(expression, ranges, count)
+    if isinstance(costs, list):
+        invalid = next((i for i, c in enumerate(costs) if math.isinf(c) or math.isnan(c)), None)
+    else:
+        finite = numpy.isfinite(costs)
+        invalid = None if finite.all() else int(numpy.argmin(finite))
+    if invalid is not None:
+        raise ValueError("The cost expression '{}' is not a finite number for the parameter "
+                         "values {}.".format(expression.expression, ', '.join(
+                             str(v) for v in _sweep_values(ranges, invalid, invalid + 1)[0])))
+    if isinstance(costs, list):
+        return sorted(_range(count), key=lambda i: -costs[i])
+    return numpy.argsort(-costs, kind='stable')
+
+
+class ParametricSweepTasks(object):
+    """The tasks of a parametric sweep, each generated only when it is requested.
+    The number of tasks, the parameter values of any task and the dependencies of the
+    merge tasks, which come last, are calculated from the parameter sets. Iterating
+    over the sweep therefore holds no more than a block of tasks in memory, and any
+    contiguous part of it can be generated on its own with the same task IDs.
+    :param factory: The parametric sweep task factory.
+    :type factory: :class:`ParametricSweepTaskFactory
+     <azext.batch.models.ParametricSweepTaskFactory>`
+    """
+
+    def __init__(self, factory):
+        self._ranges = _parameter_ranges(factory.parameter_sets)
+        self._skeleton = _TaskSkeleton(factory.repeat_task, _SweepPlaceholder)
+        self.count = 1
+        for values in self._ranges:
+            self.count *= len(values)
+        self._order = None
+        if getattr(factory, 'cost', None):
+            cost = _CostExpression(factory.cost)
+            if cost.indices and max(cost.indices) >= len(self._ranges):
+                raise ValueError("The cost expression '{}' is out of bound.".format(factory.cost))
+            self._order = _order_by_cost(cost, self._ranges, self.count)
+        self._merge_tree = None
+        if getattr(factory, 'merge_task', None):
+            self._merge_tree = _MergeTree(factory.merge_task, self.count)
+        self.start = 0
+        self.stop = self.count + (len(self._merge_tree) if self._merge_tree else 0)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in _range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("task index out of range")
+        return self._tasks(self.start + index, self.start + index + 1)[0]
+
+    def __iter__(self):
+        for block in _range(self.start, self.stop, _SWEEP_BLOCK_SIZE):
+            for task in self._tasks(block, min(block + _SWEEP_BLOCK_SIZE, self.stop)):
+                yield task
+
+    def _tasks(self, start, stop):
+        """Return the tasks from index start up to stop of the whole sweep."""
+        tasks = [self._skeleton.render(values, index) for index, values in enumerate(
+            _sweep_values(self._ranges, start, min(stop, self.count), self._order), start)]
+        if self._merge_tree:
+            tasks.extend(self._merge_tree.task(index - self.count)
+                         for index in _range(max(start, self.count), stop))
+        return tasks
+
+    def shard(self, index, count):
+        """Return one of a number of contiguous, disjoint parts of the sweep that together
+        hold all its tasks, with the same task IDs as in the whole sweep. The merge tasks
+        are part of the last shards.
+        :param int index: The zero-based index of the shard.
+        :param int count: The number of shards.
+        :rtype: :class:`ParametricSweepTasks`
+        """
+        if count < 1 or not 0 <= index < count:
+            raise ValueError("Shard {} of {} does not exist.".format(index, count))
+        total = len(self)
+        shard = copy.copy(self)
+        shard.start = self.start + total * index // count
+        shard.stop = self.start + total * (index + 1) // count
+        return shard
+
+    def sample(self):
+        """Return the first task and the merge task of the whole sweep, which share the
+        package references and command line prefix of every task in the sweep."""
+        if not self._merge_tree:
+            return self._tasks(0, 1)
+        return self._tasks(0, 1) + [self._merge_tree.task(len(self._merge_tree) - 1)]
+
+    def chunks(self, size):
+        """Yield the tasks in lists of at most the given size."""
+        for start in _range(self.start, self.stop, size):
+            yield self._tasks(start, min(start + size, self.stop))
 
 
 def _expand_parametric_sweep(factory):
-    """Parse parametric sweep task factory object, and return task list.
+    """Parse parametric sweep task factory object, and return the tasks it generates.
     :param dict factory: A loaded JSON task factory object.
+    :rtype: :class:`ParametricSweepTasks`
     """
-    permutations = _parse_parameter_sets(factory.parameter_sets)
-    task_objs = [_transform_repeat_task(factory.repeat_task, p, i, _transform_sweep_str)
-                 for i, p in enumerate(permutations)]
-    try:
-        factory.merge_task.id = 'merge'
-        factory.merge_task.depends_on = models.TaskDependencies(
-            task_id_ranges=[models.TaskIdRange(start=0, end=len(task_objs) - 1)])
-        task_objs.append(_transform_merge_task(factory.merge_task))
-    except AttributeError:  # No merge task
-        pass
-    return task_objs
+    return ParametricSweepTasks(factory)
 
 
 def _expand_task_collection(factory):
     """Parse task collection task factory object, and return task list.
     :param dict factory: A loaded JSON task factory object.
     """
+    if isinstance(factory.tasks, LazyTaskCollection):
+        # Tasks generated by a template copy loop are only created now
+        return list(factory.tasks)
     return factory.tasks
 
 
-def _expand_task_per_file(factory, fileutils):
-    """Parse file iteration task factory object, and return task list.
+def _prefetch(iterable, size):
+    """Iterate over an iterable consumed by a background thread, which stays at most
+    size items ahead, so that slow iteration such as listing pages of blobs overlaps
+    with the processing of the items already produced.
+    """
+    items = queue.Queue(size)
+    stopped = threading.Event()
+    done = object()
+
+    def put(entry):
+        # Give up once the consumer has stopped, rather than block on a full queue
+        while not stopped.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as error:  # pylint: disable=broad-except
+            put((done, error))
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+class TaskPerFileTasks(object):
+    """The tasks of a task per file factory, generated as the pages of the listing of
+    its files arrive. The files are listed in the background, ahead of the tasks being
+    requested, and the merge tasks come last, once the number of files is known. The
+    tasks can only be iterated over once.
+    :param factory: The task per file task factory.
+    :type factory: :class:`FileCollectionTaskFactory
+     <azext.batch.models.FileCollectionTaskFactory>`
+    :param manifest: If given, only generate tasks for the files that are not in the
+     manifest, numbered on from the tasks of earlier runs. No merge task is generated
+     if there are no new files.
+    :type manifest: :class:`FileManifest <azext.batch._file_utils.FileManifest>`
+    """
+
+    def __init__(self, factory, fileutils, manifest=None):
+        self._skeleton = self._compile(factory.repeat_task)
+        order = getattr(factory, 'order', None) or 'listing'
+        if order not in ('listing', 'largestFirst'):
+            raise ValueError("'{}' is not a valid task order. It can be 'listing' or "
+                             "'largestFirst'.".format(order))
+        self._largest_first = order == 'largestFirst'
+        self._merge_task = getattr(factory, 'merge_task', None)
+        if self._merge_task:
+            _MergeTree(self._merge_task, 0)  # Validate the merge task before listing
+        self._manifest = manifest
+        self._files = _prefetch(fileutils.iter_container_list(factory.source, manifest),
+                                _LISTING_PREFETCH_SIZE)
+        self._first = []
+        self.first_id = manifest.next_task_id if manifest else 0
+        self.count = 0
+
+    @staticmethod
+    def _compile(repeat_task):
+        return _TaskSkeleton(repeat_task, _FilePlaceholder)
+
+    def _contexts(self, files):
+        """Return the context of each task, which is the file it is generated for."""
+        return files
+
+    @staticmethod
+    def _size(context):
+        """Return the total size of the input files of a task."""
+        return context['contentLength']
+
+    def __iter__(self):
+        files = itertools.chain(self._first, self._files)
+        self._first = []
+        contexts = self._contexts(files)
+        if self._largest_first:
+            contexts = sorted(contexts, key=self._size, reverse=True)
+        for context in contexts:
+            yield self._skeleton.render(context, self.first_id + self.count)
+            self.count += 1
+        stop = self.first_id + self.count
+        if self._merge_task and (self.count or not self._manifest):
+            merge_tree = _MergeTree(self._merge_task, self.count, self.first_id)
+            stop += len(merge_tree) - 1
+            for index in _range(len(merge_tree)):
+                yield merge_tree.task(index)
+        if self._manifest:
+            self._manifest.use_task_ids(stop)
+
+    def sample(self):
+        """Return the first task and a merge task, which share the package references
+        and command line prefix of every task, listing only the first page of files."""
+        if not self._first:
+            self._first = list(itertools.islice(self._files, 1))
+        tasks = [self._skeleton.render(c, self.first_id) for c in self._contexts(self._first)]
+        if self._merge_task:
+            tasks.append(_MergeTree(self._merge_task, 1, self.first_id).task(0))
+        return tasks
+
+    def chunks(self, size):
+        """Yield the tasks in lists of at most the given size."""
+        tasks = iter(self)
+        chunk = list(itertools.islice(tasks, size))
+        while chunk:
+            yield chunk
+            chunk = list(itertools.islice(tasks, size))
+
+
+class FileBatchTasks(TaskPerFileTasks):
+    """The tasks of a task per file batch factory, each generated for a batch of files.
+    With only a maximum number of files per batch, consecutive files are batched as
+    they are listed. With a maximum total size, every file is listed before the files
+    are packed into batches, see `_pack_files`.
+    :param factory: The task per file batch task factory.
+    :type factory: :class:`FileBatchTaskFactory
+     <azext.batch.models.FileBatchTaskFactory>`
+    :param manifest: If given, only batch the files that are not in the manifest.
+    :type manifest: :class:`FileManifest <azext.batch._file_utils.FileManifest>`
+    """
+
+    def __init__(self, factory, fileutils, manifest=None):
+        if not factory.max_files and not factory.max_bytes:
+            raise ValueError("A taskPerFileBatch task factory requires maxFiles or maxBytes.")
+        if (factory.max_files or 1) < 1 or (factory.max_bytes or 1) < 1:
+            raise ValueError("The maxFiles and maxBytes of a taskPerFileBatch task factory "
+                             "must be positive.")
+        self._max_files = factory.max_files
+        self._max_bytes = factory.max_bytes
+        super(FileBatchTasks, self).__init__(factory, fileutils, manifest)
+
+    @staticmethod
+    def _compile(repeat_task):
+        if not repeat_task or not repeat_task.command_line:
+            raise ValueError("RepeatTask and it's command line must be defined.")
+        return _FileBatchSkeleton(repeat_task)
+
+    @staticmethod
+    def _size(context):
+        return sum(f['contentLength'] for f in context)
+
+    def _contexts(self, files):
+        """Return the context of each task, which is the batch of files it is generated for."""
+        if self._max_bytes:
+            for batch in _pack_files(files, self._max_bytes, self._max_files):
+                yield batch
+            return
+        files = iter(files)
+        batch = list(itertools.islice(files, self._max_files))
+        while batch:
+            yield batch
+            batch = list(itertools.islice(files, self._max_files))
+
+
+def _expand_task_per_file(factory, fileutils, manifest=None):
+    """Parse file iteration task factory object, and return the tasks it generates.
     :param dict factory: A loaded JSON task factory object.
+    :param manifest: The files to skip, see `TaskPerFileTasks`.
+    :rtype: :class:`TaskPerFileTasks`
+    """
+    return TaskPerFileTasks(factory, fileutils, manifest)
+
+
+def _expand_task_per_file_batch(factory, fileutils, manifest=None):
+    """Parse file batch task factory object, and return the tasks it generates.
+    :param dict factory: A loaded JSON task factory object.
+    :param manifest: The files to skip, see `TaskPerFileTasks`.
+    :rtype: :class:`FileBatchTasks`
+    """
+    return FileBatchTasks(factory, fileutils, manifest)
+
+
+def _read_application_template(file_path, signature_only=False):
+    """Return the (modification time, size) signature and content of a template file.
+    :param bool signature_only: Whether to skip reading the content.
     """
-    files = fileutils.get_container_list(factory.source)
-    task_objs = [_transform_repeat_task(factory.repeat_task, f, i, _transform_file_str)
-                 for i, f in enumerate(files)]
     try:
-        factory.merge_task.id = 'merge'
-        factory.merge_task.depends_on = models.TaskDependencies(
-            task_id_ranges=[models.TaskIdRange(start=0, end=len(task_objs) - 1)])
-        task_objs.append(_transform_merge_task(factory.merge_task))
-    except AttributeError:  # No merge task
-        pass
-    return task_objs
+        stat = os.stat(file_path)
+        if signature_only:
+            return (stat.st_mtime, stat.st_size), None
+        with open(file_path, 'rb') as file_handle:
+            return (stat.st_mtime, stat.st_size), file_handle.read()
+    except (EnvironmentError, TypeError) as error:
+        raise ValueError("Failed to load application template from '{}': {}".
+                         format(file_path, error))
+
+
+class ApplicationTemplate(object):
+    """An application template file that has been loaded, validated and compiled
+    once, for expanding against the parameters of any number of jobs.
+    :param str file_path: The path of the application template file.
+    :param tuple signature: The modification time and size of the file, if read.
+    :param bytes content: The content of the file, if read.
+    """
 
+    def __init__(self, file_path, signature=None, content=None):
+        self.file_path = file_path
+        if content is None:
+            signature, content = _read_application_template(file_path)
+        self.signature = signature
+        self.content_hash = hashlib.sha256(content).hexdigest()
+        try:
+            template_json = json.loads(content.decode('utf-8-sig'))
+        except ValueError as error:
+            raise ValueError("Failed to load application template from '{}': {}".
+                             format(file_path, error))
+        self.definitions = template_json.get('parameters')
+        self.validators = compile_parameter_validators(self.definitions)
+        self.compiled = engine.CompiledTemplate(template_json)
+        self.compiled.validators.update(self.validators)
+        # The properties generated are known up front unless their names are expressions
+        root = self.compiled.root
+        self.generated_keys = None
+        if root.static and isinstance(root.value, dict):
+            self.generated_keys = list(root.value)
+        elif isinstance(root, engine._ObjectNode) and root.members is not None:  # pylint: disable=protected-access
+            self.generated_keys = list(root.members)
+        if self.generated_keys is not None:
+            _validate_generated_job(self.generated_keys)
+
+    def expand(self, parameters):
+        """Return the partial job generated by the template for a job's parameters.
+        :param dict parameters: The parameters supplied by the job.
+        """
+        _validate_parameter_usage(parameters, self.definitions, self.validators)
+        job_from_template = self.compiled.expand(parameters)
+        if self.generated_keys is None:
+            _validate_generated_job(job_from_template)
+        return job_from_template
+
+
+class ApplicationTemplateRegistry(object):
+    """A thread-safe registry of application templates, each loaded, validated and
+    compiled once. A template is loaded again when its file's modification time or
+    size changes and its content is no longer the same.
+    """
 
-def expand_application_template(job, deserialize):
+    def __init__(self):
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._templates)
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+    def get(self, file_path):
+        """Return the application template loaded from a file.
+        :param str file_path: The path of the application template file.
+        :rtype: :class:`ApplicationTemplate`
+        """
+        signature, _ = _read_application_template(file_path, signature_only=True)
+        key = os.path.normcase(os.path.abspath(file_path))
+        with self._lock:
+            template = self._templates.get(key)
+        if template is not None and template.signature == signature:
+            return template
+        signature, content = _read_application_template(file_path)
+        if template is not None and template.content_hash == hashlib.sha256(content).hexdigest():
+            template.signature = signature
+            return template
+        template = ApplicationTemplate(file_path, signature, content)
+        with self._lock:
+            self._templates[key] = template
+        return template
+
+
+def expand_application_template(job, deserialize, registry=None):
     """Expand an application template reference on a job, returning the modified job.
     :param dict job: A job specification that may contain an application template reference.
-    :param string working_dir: Base folder for evaluation of relative paths (is required).
+    :param deserialize: The deserializer for the generated job properties.
+    :param registry: The registry holding the loaded application templates. If not
+     supplied the template is loaded for this job only.
+    :type registry: :class:`ApplicationTemplateRegistry`
     """
-    try:
-        with open(job.application_template_info.file_path, 'r') as file_handle:
-            template_json = json.load(file_handle)
-    except (EnvironmentError, ValueError, TypeError) as error:
-        raise ValueError("Failed to load application template from '{}': {}".
-                         format(job.application_template_info.file_path, error))
-    _validate_parameter_usage(job.application_template_info.parameters,
-                              template_json.get('parameters'))
-    job_from_template = _parse_template(json.dumps(template_json), template_json,
-                                        job.application_template_info.parameters)
-    _validate_generated_job(job_from_template)
+    file_path = job.application_template_info.file_path
+    if registry is not None:
+        template = registry.get(file_path)
+    else:
+        template = ApplicationTemplate(file_path)
+    job_from_template = template.expand(job.application_template_info.parameters)
     metadata = _merge_metadata(job_from_template.get('metadata'), job.metadata)
     env_settings = _merge_environment_settings(job_from_template.get('commonEnvironmentSettings'),
                                                job.common_environment_settings)
     _validate_metadata(metadata)
-    metadata.append({'name': 'az_batch:template_filepath', 'value': job.application_template_info.file_path})
+    metadata.append({'name': 'az_batch:template_filepath', 'value': file_path})
     job_from_template['metadata'] = metadata
     job_from_template['commonEnvironmentSettings'] = env_settings
 
@@ -986,38 +1476,257 @@ def expand_application_template(job, deserialize):
     job.application_template_info = None
 
 
-def expand_template(template_json, parameter_json=None):
+def expand_template(template_json, parameter_json=None, lazy=False, session=None, pointer=None):
     """Return JSON object with with the parameters replaced.
+    The result may be modified freely, except where it is shared with the previous
+    expansion of a session.
     :param str template_file: Input template file name.
     :param str parameter_file: Input parameter file name.
+    :param bool lazy: Return the items of 'copy' loops as sequences that expand each
+     item on demand instead of lists.
+    :param session: A session from `expansion_session` for the same template. Only the
+     parts of the template affected by parameters changed since the session's previous
+     expansion are evaluated again.
+    :param str pointer: A JSON pointer (e.g. '/job') to the only part of the template
+     to expand, along with the variables and parameters it references.
+    :raises: KeyError if the template has no part at the pointer.
     """
     parameters = _get_template_params(template_json, parameter_json)
-    return _parse_template(json.dumps(template_json), template_json, parameters)
+    if session is not None:
+        return session.expand(parameters, lazy, pointer)
+    compiled = engine.compile_template(template_json)
+    if expansion_results is not None:
+        return expansion_results.expand(compiled, parameters, lazy, pointer)
+    return compiled.expand(parameters, lazy, pointer)
+
+
+def enable_expansion_cache(max_size=engine.DEFAULT_RESULT_CACHE_SIZE):
+    """Cache the results of `expand_template`, for services that expand the same
+    template with the same parameter values repeatedly. Repeated expansions return
+    a copy of the cached result.
+    :param int max_size: The maximum number of expanded templates to keep.
+    :rtype: :class:`ExpansionResultCache<azext.batch._template_engine.ExpansionResultCache>`
+    :returns: The cache, whose `hits` and `misses` attributes count its use.
+    """
+    global expansion_results  # pylint: disable=global-statement
+    expansion_results = engine.ExpansionResultCache(max_size)
+    return expansion_results
+
+
+def disable_expansion_cache():
+    """Stop caching the results of `expand_template` and discard the cached results."""
+    global expansion_results  # pylint: disable=global-statement
+    expansion_results = None
+
+
+def missing_parameters(template_json, parameter_json=None, compiled=None, pointer=None):
+    """Return the parameters referenced by a template that have neither a supplied
+    value nor a default, found without expanding the template.
+    :param dict template_json: The template.
+    :param dict parameter_json: Input parameter values.
+    :param compiled: The compiled form of the template, if already available.
+    :param str pointer: A JSON pointer to the only part of the template to check.
+    :returns: A list of :class:`MissingParameterValue<azext.batch.errors.MissingParameterValue>`
+     errors, one for each parameter.
+    """
+    compiled = compiled or engine.compile_template(template_json)
+    parameters = _get_template_params(template_json, parameter_json or {})
+    return [_missing_parameter_error(template_json, name)
+            for name in compiled.missing_parameters(parameters, pointer)]
+
+
+def _missing_parameter_error(template_json, name):
+    definition = template_json['parameters'][name]
+    return errors.MissingParameterValue(
+        "No value supplied for parameter '{}' and no default value".format(name),
+        parameter_name=name,
+        parameter_description=definition.get('metadata', {}).get('description'))
+
+
+def expansion_session(template_json, compiled=None):
+    """Return a session for expanding a template repeatedly with changing parameters.
+    :param dict template_json: The template.
+    :param compiled: The compiled form of the template, if already available.
+    :rtype: :class:`ExpansionSession<azext.batch._template_engine.ExpansionSession>`
+    """
+    return engine.ExpansionSession(compiled or engine.compile_template(template_json))
+
+
+def load_template_file(file_path, cache_dir=None):
+    """Load a JSON template file along with its compiled form.
+    :param str file_path: The path of the template file.
+    :param str cache_dir: A directory in which compiled templates are kept between
+     processes. Unchanged template files are then not read or compiled again.
+    :returns: A (template, compiled template) pair.
+    """
+    if cache_dir:
+        return template_cache.TemplateFileCache(cache_dir).load(file_path)
+    with open(file_path, 'rb') as template_file:
+        template = json.loads(template_file.read().decode('utf-8-sig'))
+    return template, engine.compile_template(template)
+
+
+class LazyTaskCollection(object):
+    """The tasks of a task collection generated by a template 'copy' loop. Each task
+    is expanded and deserialized only when it is requested.
+    :param loop: The lazily expanded task specifications.
+    :type loop: :class:`CopyLoop<azext.batch._template_engine.CopyLoop>`
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+
+    def __len__(self):
+        return len(self._loop)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._task(t) for t in self._loop[index]]
+        return self._task(self._loop[index])
+
+    def __iter__(self):
+        for task in self._loop:
+            yield self._task(task)
+
+    @staticmethod
+    def _task(task_json):
+        task_json = convert_blob_source_to_http_url(engine.materialize(task_json))
+        return models.ExtendedTaskParameter.from_dict(task_json)
+
+
+def _member_key(obj, name):
+    """Find the key of a JSON object member, ignoring case."""
+    if isinstance(obj, dict):
+        for key in obj:
+            if key.lower() == name.lower():
+                return key
+    return None
 
 
-def expand_task_factory(job, fileutils):
+def split_lazy_task_collection(json_data):
+    """Separate a task collection generated by a lazily expanded 'copy' loop from
+    a job specification. Any other copy loops are replaced by lists.
+    :param dict json_data: A job specification from a lazily expanded template.
+    :returns: A tuple of the job specification, with an empty task collection, and
+     a :class:`LazyTaskCollection` (or None if the tasks are not generated).
+    """
+    path = []
+    value = json_data
+    names = ['taskFactory', 'tasks']
+    if _member_key(json_data, 'properties'):
+        names.insert(0, 'properties')
+    for name in names:
+        key = _member_key(value, name)
+        if key is None:
+            break
+        path.append(key)
+        value = value[key]
+    if not isinstance(value, engine.CopyLoop):
+        return engine.materialize(json_data), None
+
+    def replace(obj, keys):
+        obj = dict(obj)
+        obj[keys[0]] = replace(obj[keys[0]], keys[1:]) if keys[1:] else []
+        return obj
+    return engine.materialize(replace(json_data, path)), LazyTaskCollection(value)
+
+
+def expand_template_many(template_json, parameter_sets, workers=None, pointer=None, compiled=None):
+    """Expand one template against many sets of parameter values in parallel.
+    The template is compiled once and shared with a pool of worker processes.
+    Every set of parameter values is checked for missing and invalid values before
+    any worker process is started.
+    :param dict template_json: The template.
+    :param parameter_sets: An iterable of parameter value dictionaries.
+    :param int workers: The number of worker processes, defaults to the CPU count.
+    :param str pointer: A JSON pointer to the only part of the template to expand.
+    :param compiled: The compiled form of the template, if already available.
+    :returns: A generator of (index, expanded template) pairs in order of completion,
+     where index is the position of the parameter values in parameter_sets.
+    :raises: MissingParameterValue, TypeError or ValueError if any set of parameter
+     values is not valid for the template.
+    """
+    compiled = compiled or engine.compile_template(template_json)
+    definitions = compiled.parameters if isinstance(compiled.parameters, dict) else {}
+    referenced = compiled.referenced_parameters(pointer)
+    normalized = []
+    for parameters in parameter_sets:
+        if parameters and not isinstance(parameters, dict):
+            raise ValueError("parameters isn't a JSON dictionary")
+        parameters = _get_template_params(template_json, parameters or {})
+        for name in compiled.missing_parameters(parameters, pointer):
+            raise _missing_parameter_error(template_json, name)
+        for name in referenced:
+            if parameters.get(name) is not None and isinstance(definitions.get(name), dict):
+                compiled.validator(name, definitions[name]).validate(parameters[name])
+        normalized.append(parameters)
+    return engine.expand_many(compiled, normalized, workers, pointer=pointer)
+
+
+def expand_template_to_stream(template_stream, output_stream, parameter_json=None, member=None):
+    """Expand a JSON template read from a file-like object, writing the resulting JSON
+    to another as it goes. Memory use does not depend on the size of the template
+    beyond its 'parameters' and 'variables' sections.
+    :param template_stream: A readable file-like object with the template.
+    :param output_stream: A writable text file-like object for the expanded JSON.
+    :param dict parameter_json: Input parameter values.
+    :param str member: The name of a top level element (e.g. 'job') to write instead
+     of the whole template.
+    """
+    template = engine.StreamedTemplate(template_stream)
+    parameters = _get_template_params(template.sections, parameter_json or {})
+    template.expand(output_stream, parameters, member)
+
+
+def expand_task_factory(job, fileutils, manifest=None):
     """Parse a task factory object and expand to a list of tasks.
     :param dict job_obj: The JSON job entity loaded from a template.
+    :param manifest: The files a taskPerFile factory has already generated tasks for.
+    :type manifest: :class:`FileManifest <azext.batch._file_utils.FileManifest>`
     :returns: a list of task entities.
     """
+    if manifest is not None and job.task_factory.type not in FILE_TASK_FACTORIES:
+        raise ValueError("A file manifest can only be used with a taskPerFile or "
+                         "taskPerFileBatch task factory.")
     if job.task_factory.type == 'parametricSweep':
         tasks = _expand_parametric_sweep(job.task_factory)
     elif job.task_factory.type == 'taskCollection':
         tasks = _expand_task_collection(job.task_factory)
     elif job.task_factory.type == 'taskPerFile':
-        tasks = _expand_task_per_file(job.task_factory, fileutils)
+        tasks = _expand_task_per_file(job.task_factory, fileutils, manifest)
+    elif job.task_factory.type == 'taskPerFileBatch':
+        tasks = _expand_task_per_file_batch(job.task_factory, fileutils, manifest)
     else:
         raise TypeError("'{}' is not a valid Task Factory type.".format(job.task_factory.type))
     job.task_factory = None
     return tasks
 
 
+def shard_tasks(tasks, index, count):
+    """Return one of a number of contiguous, disjoint parts of the tasks generated by a
+    task factory. The tasks keep the IDs they have in the whole collection.
+    :param tasks: The tasks returned by `expand_task_factory`.
+    :param int index: The zero-based index of the shard.
+    :param int count: The number of shards.
+    """
+    if isinstance(tasks, ParametricSweepTasks):
+        return tasks.shard(index, count)
+    if isinstance(tasks, TaskPerFileTasks):
+        # The number of files is only known once they have all been listed
+        tasks = list(tasks)
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("Shard {} of {} does not exist.".format(index, count))
+    total = len(tasks)
+    return tasks[total * index // count:total * (index + 1) // count]
+
+
 def has_merge_task(job):
     """ Check if user has specified a mergeTask on the task factory
     :param job_obj: The JSON job entity loaded from a template.:
     :return: true if merge task present
     """
-    if job.task_factory.type in ['parametricSweep', 'taskPerFile'] and job.task_factory.merge_task:
+    if job.task_factory.type in ['parametricSweep', 'taskPerFile', 'taskPerFileBatch'] \
+            and job.task_factory.merge_task:
         return True
     return False
 
@@ -1090,6 +1799,14 @@ def process_job_for_output_files(job, tasks, file_utils):
     """
     if job.job_manager_task:
         _parse_task_output_files(job.job_manager_task, file_utils)
+    process_tasks_for_output_files(tasks, file_utils)
+
+
+def process_tasks_for_output_files(tasks, file_utils):
+    """Process a collection of tasks for any tasks which use outputFiles.
+    NOTE: This edits the tasks in-line!
+    :param list tasks: A list of task specifications.
+    """
     for task in tasks:
         _parse_task_output_files(task, file_utils)
 
@@ -1152,6 +1869,134 @@ def post_processing(request, fileutils, os_flavor):
     return _process_resource_files(request, fileutils)
 
 
+def compress_task_dependencies(tasks):
+    """Replace runs of consecutive numeric task IDs that tasks depend on with task ID
+    ranges, so that requests to add tasks with many dependencies stay small.
+    :param list tasks: The tasks, whose dependencies are replaced in place.
+    """
+    for task in tasks:
+        depends_on = getattr(task, 'depends_on', None)
+        if not depends_on or not depends_on.task_ids:
+            continue
+        numbers = sorted(set(int(i) for i in depends_on.task_ids if _NUMERIC_TASK_ID.match(i)))
+        task_ids = [i for i in depends_on.task_ids if not _NUMERIC_TASK_ID.match(i)]
+        ranges = list(depends_on.task_id_ranges or [])
+        compressed = False
+        run_start = 0
+        for position in _range(1, len(numbers) + 1):
+            if position < len(numbers) and numbers[position] == numbers[position - 1] + 1:
+                continue
+            if position - run_start >= MIN_TASK_ID_RANGE:
+                ranges.append(models.TaskIdRange(start=numbers[run_start], end=numbers[position - 1]))
+                compressed = True
+            else:
+                task_ids.extend(str(n) for n in numbers[run_start:position])
+            run_start = position
+        if compressed:
+            task.depends_on = models.TaskDependencies(task_ids=task_ids or None,
+                                                      task_id_ranges=ranges)
+
+
+def _range_segments(start, stop, count):
+    """Return the nodes of a bottom-up segment tree over count items, whose leaves
+    are the nodes count to 2 * count - 1, that together cover the items start to stop.
+    """
+    segments = []
+    start += count
+    stop += count
+    while start < stop:
+        if start & 1:
+            segments.append(start)
+            start += 1
+        if stop & 1:
+            stop -= 1
+            segments.append(stop)
+        start >>= 1
+        stop >>= 1
+    return segments
+
+
+def validate_task_dependencies(tasks):
+    """Check that task IDs are unique, that every task ID a task depends on is one of
+    the tasks, and that no task depends on itself, directly or through other tasks.
+    Task ID ranges are checked as intervals, through a segment tree over the numeric
+    task IDs, so the check takes time proportional to the number of tasks and
+    dependencies up to a logarithmic factor, however many tasks a range covers.
+    :param list tasks: All the tasks to be added to a job.
+    :raises: ValueError if the dependencies are not valid.
+    """
+    positions = {}
+    for position, task in enumerate(tasks):
+        if task.id in positions:
+            raise ValueError("Task ID '{}' is used by more than one task.".format(task.id))
+        positions[task.id] = position
+    numbered = sorted((int(i), p) for i, p in positions.items() if _NUMERIC_TASK_ID.match(i))
+    numbers = [n for n, _ in numbered]
+
+    # The graph holds the tasks followed by the inner nodes of the segment tree,
+    # each of which depends on the two nodes below it
+    count = len(numbered)
+
+    def node(segment):
+        return numbered[segment - count][1] if segment >= count else len(tasks) + segment
+    dependencies = []
+    missing = []
+    for task in tasks:
+        depends_on = getattr(task, 'depends_on', None)
+        found = []
+        if depends_on:
+            for task_id in depends_on.task_ids or []:
+                if task_id in positions:
+                    found.append(positions[task_id])
+                else:
+                    missing.append("'{}' depends on '{}'".format(task.id, task_id))
+            for id_range in depends_on.task_id_ranges or []:
+                found.extend(node(s) for s in _range_segments(
+                    bisect.bisect_left(numbers, id_range.start),
+                    bisect.bisect_right(numbers, id_range.end), count))
+        dependencies.append(found)
+    dependencies.extend([node(2 * s), node(2 * s + 1)] if s else []
+                        for s in _range(count))
+    if missing:
+        raise ValueError("Tasks depend on tasks that are not being added: {}{}".format(
+            ', '.join(missing[:10]), ' and {} more'.format(len(missing) - 10)
+            if len(missing) > 10 else ''))
+
+    # Depth-first search without recursion, marking the nodes on the current path
+    visiting, visited = 1, 2
+    states = [0] * len(dependencies)
+    for root in _range(len(tasks)):
+        if states[root]:
+            continue
+        states[root] = visiting
+        path = [[root, 0]]
+        while path:
+            position, next_dependency = path[-1]
+            if next_dependency == len(dependencies[position]):
+                states[position] = visited
+                path.pop()
+                continue
+            path[-1][1] += 1
+            dependency = dependencies[position][next_dependency]
+            if states[dependency] == visiting:
+                cycle = [p for p, _ in path]
+                cycle = [p for p in cycle[cycle.index(dependency):] if p < len(tasks)]
+                raise ValueError("Tasks depend on each other in a cycle: {}".format(
+                    ' -> '.join(tasks[p].id for p in cycle + cycle[:1])))
+            if not states[dependency]:
+                states[dependency] = visiting
+                path.append([dependency, 0])
+
+
+def process_task_dependencies(tasks):
+    """Validate the dependencies of all the tasks to be added to a job, and compress
+    them into task ID ranges, before any task is submitted.
+    :param list tasks: The tasks, whose dependencies are replaced in place.
+    """
+    validate_task_dependencies(tasks)
+    compress_task_dependencies(tasks)
+
+
 def should_get_pool(job, tasks):
     """Determines if the pool (or auto pool specification) needs to be
     reviewed to determine the target operating system.
@@ -1205,28 +2050,45 @@ def validate_json_object(json_obj, obj):
         if t[0].islower() or (t[0] == '[' and t[1].islower()):
             continue
         if t[0] == '[':
-            if not isinstance(json_obj[item], list):
+            items = json_obj[item]
+            if isinstance(items, engine.CopyLoop):
+                # Every item of a copy loop comes from the same input, check the first
+                items = items[:1]
+            if not isinstance(items, list):
                 raise ValueError('Expect element {} is list in template'.format(item))
-            for index in range(len(json_obj[item])):
+            for index in range(len(items)):
                 inner_type = getattr(obj, key_attr_map[item.lower()])
-                validate_json_object(json_obj[item][index], inner_type[index])
+                validate_json_object(items[index], inner_type[index])
         else:
             inner_type = getattr(obj, key_attr_map[item.lower()])
             validate_json_object(json_obj[item], inner_type)
 
 
 def convert_blob_source_to_http_url(obj):
+    """Return the JSON specification with resource file 'blobSource' properties renamed
+    to 'httpUrl'. Containers are copied only where something changes, the original
+    specification is not modified.
+    :param obj: A JSON job or pool specification (or part thereof).
+    """
     if isinstance(obj, list):
-        out = []
-        for i in obj:
-            out.append(convert_blob_source_to_http_url(i))
-        return out
+        converted = [convert_blob_source_to_http_url(i) for i in obj]
+        if all(new is old for new, old in zip(converted, obj)):
+            return obj
+        return converted
     if isinstance(obj, dict):
-        for key in obj:
-            if key in ['resourceFiles', 'commonResourceFiles']:
-                obj[key] = \
-                    [_convert_blob_source_to_http_url(resource_file) for resource_file in obj[key]]
-            obj[key] = convert_blob_source_to_http_url(obj[key])
+        changes = {}
+        for key, value in obj.items():
+            converted = value
+            if key in ['resourceFiles', 'commonResourceFiles'] and isinstance(value, list):
+                converted = [_convert_blob_source_to_http_url(r) for r in value]
+                if all(new is old for new, old in zip(converted, value)):
+                    converted = value
+            converted = convert_blob_source_to_http_url(converted)
+            if converted is not value:
+                changes[key] = converted
+        if changes:
+            obj = dict(obj)
+            obj.update(changes)
     return obj
 
 
@@ -1235,6 +2097,7 @@ def _convert_blob_source_to_http_url(resource_file):
         if 'filePath' not in resource_file:
             raise ValueError('Malformed ResourceFile: \'blobSource\' must '
                              'also have \'file_path\' attribute')
+        resource_file = dict(resource_file)
         resource_file['httpUrl'] = resource_file.pop('blobSource', None)
         logger.warning('BlobSource has been updated to HttpUrl to reflect new '
                        'functionality of accepting any http url instead of just'
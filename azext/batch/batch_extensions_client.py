@@ -18,6 +18,7 @@ from .version import VERSION
 from .operations.pool_operations import ExtendedPoolOperations
 from .operations.job_operations import ExtendedJobOperations
 from .operations.file_operations import ExtendedFileOperations
+from ._template_utils import ApplicationTemplateRegistry
 from . import models
 
 # pylint: disable=protected-access
@@ -39,6 +40,9 @@ class BatchExtensionsClient(BatchServiceClient):
     :vartype file: .operations.FileOperations
     :ivar task: Task operations
     :vartype task: .operations.TaskOperations
+    :ivar application_templates: The application templates loaded by this client,
+     each compiled once and reused for every job referencing it.
+    :vartype application_templates: ._template_utils.ApplicationTemplateRegistry
 
     :param credentials: Credentials needed for the client to connect to Azure.
     :type credentials: :mod:`A msrestazure Credentials
@@ -71,6 +75,7 @@ class BatchExtensionsClient(BatchServiceClient):
 
         self.batch_account = batch_account
         self.resource_group = resource_group
+        self.application_templates = ApplicationTemplateRegistry()
 
         client_models = {k: v for k, v in models.__dict__.items() if isinstance(v, type)}
         self._serialize = Serializer(client_models)
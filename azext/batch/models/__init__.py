@@ -25,6 +25,7 @@ try:
     from ._models_py3 import TaskCollectionTaskFactory
     from ._models_py3 import ParametricSweepTaskFactory
     from ._models_py3 import FileCollectionTaskFactory
+    from ._models_py3 import FileBatchTaskFactory
     from ._models_py3 import ParameterSet
     from ._models_py3 import RepeatTask
     from ._models_py3 import PackageReferenceBase
@@ -56,6 +57,7 @@ except (SyntaxError, ImportError):
     from ._models import TaskCollectionTaskFactory
     from ._models import ParametricSweepTaskFactory
     from ._models import FileCollectionTaskFactory
+    from ._models import FileBatchTaskFactory
     from ._models import ParameterSet
     from ._models import RepeatTask
     from ._models import PackageReferenceBase
@@ -92,6 +94,7 @@ __all__ = [
     'TaskCollectionTaskFactory',
     'ParametricSweepTaskFactory',
     'FileCollectionTaskFactory',
+    'FileBatchTaskFactory',
     'ParameterSet',
     'RepeatTask',
     'PackageReferenceBase',
@@ -32,6 +32,7 @@ class TaskFactoryBase(Model):
     _subtype_map = {
         'type': {'parametricSweep': 'ParametricSweepTaskFactory',
                  'taskPerFile': 'FileCollectionTaskFactory',
+                 'taskPerFileBatch': 'FileBatchTaskFactory',
                  'taskCollection': 'TaskCollectionTaskFactory'}
     }
 
@@ -1047,6 +1048,10 @@ class FileCollectionTaskFactory(TaskFactoryBase):
     :type source: :class:`FileSource <azext.batch.models.FileSource>`
     :param repeat_task: The task template the will be used to generate each task.
     :type repeat_task: :class:`RepeatTask <azext.batch.models.RepeatTask>`
+    :param str order: The order in which tasks are generated, numbered and
+     submitted: 'listing' (the default) in the order the files are listed, or
+     'largestFirst' in decreasing order of input size, so that the longest tasks
+     start first. Ordering by size lists every file before generating any task.
     :param merge_task: An optional additional task to be run after all the other
      generated tasks have completed successfully.
     :type merge_task: :class:`MergeTask <azext.batch.models.MergeTask>`
@@ -1062,6 +1067,7 @@ class FileCollectionTaskFactory(TaskFactoryBase):
         'type': {'key': 'type', 'type': 'str'},
         'source': {'key': 'source', 'type': 'FileSource'},
         'repeat_task': {'key': 'repeatTask', 'type': 'RepeatTask'},
+        'order': {'key': 'order', 'type': 'str'},
         'merge_task': {'key': 'mergeTask', 'type': 'MergeTask'}
     }
 
@@ -1069,9 +1075,58 @@ class FileCollectionTaskFactory(TaskFactoryBase):
         super(FileCollectionTaskFactory, self).__init__(**kwargs)
         self.source = kwargs.get('source', None)
         self.repeat_task = kwargs.get('repeat_task', None)
+        self.order = kwargs.get('order', None)
         self.type = 'taskPerFile'
 
 
+class FileBatchTaskFactory(TaskFactoryBase):
+    """A Task Factory for generating a set of tasks based on the contents
+    of an Azure Storage container or auto-storage file group. The input files
+    are grouped into batches by number of files, total size, or both, and one
+    task will be generated per batch, and automatically added to the job.
+
+    :param source: The input file source from which the tasks will be generated.
+    :type source: :class:`FileSource <azext.batch.models.FileSource>`
+    :param repeat_task: The task template the will be used to generate each task.
+    :type repeat_task: :class:`RepeatTask <azext.batch.models.RepeatTask>`
+    :param int max_files: The maximum number of files in each batch.
+    :param int max_bytes: The maximum total size in bytes of the files in each
+     batch. A file larger than this is given a batch of its own.
+    :param str order: The order in which tasks are generated, numbered and
+     submitted: 'listing' (the default) in the order the files are listed, or
+     'largestFirst' in decreasing order of input size, so that the longest tasks
+     start first. Ordering by size lists every file before generating any task.
+    :param merge_task: An optional additional task to be run after all the other
+     generated tasks have completed successfully.
+    :type merge_task: :class:`MergeTask <azext.batch.models.MergeTask>`
+    """
+
+    _validation = {
+        'type': {'required': True},
+        'source': {'required': True},
+        'repeat_task': {'required': True}
+    }
+
+    _attribute_map = {
+        'type': {'key': 'type', 'type': 'str'},
+        'source': {'key': 'source', 'type': 'FileSource'},
+        'repeat_task': {'key': 'repeatTask', 'type': 'RepeatTask'},
+        'max_files': {'key': 'maxFiles', 'type': 'int'},
+        'max_bytes': {'key': 'maxBytes', 'type': 'long'},
+        'order': {'key': 'order', 'type': 'str'},
+        'merge_task': {'key': 'mergeTask', 'type': 'MergeTask'}
+    }
+
+    def __init__(self, **kwargs):
+        super(FileBatchTaskFactory, self).__init__(**kwargs)
+        self.source = kwargs.get('source', None)
+        self.repeat_task = kwargs.get('repeat_task', None)
+        self.order = kwargs.get('order', None)
+        self.max_files = kwargs.get('max_files', None)
+        self.max_bytes = kwargs.get('max_bytes', None)
+        self.type = 'taskPerFileBatch'
+
+
 class FileSource(Model):
     """A source of input files to be downloaded onto a compute node.
 
@@ -1597,6 +1652,10 @@ class MergeTask(Model):
      operating system.
     :type package_references: list of :class:`PackageReferenceBase
      <azext.batch.models.PackageReferenceBase>`
+    :param int fan_in: The maximum number of tasks each merge task depends on. If
+     the task factory generates more tasks than this, they are merged by a tree of
+     intermediate merge tasks running the same command line, so that merging runs
+     in parallel over several levels rather than in one task.
     """
 
     _validation = {
@@ -1620,6 +1679,7 @@ class MergeTask(Model):
                                           'type': 'AuthenticationTokenSettings'},
         'output_files': {'key': 'outputFiles', 'type': '[OutputFile]'},
         'package_references': {'key': 'packageReferences', 'type': '[PackageReferenceBase]'},
+        'fan_in': {'key': 'fanIn', 'type': 'int'},
     }
 
     def __init__(self, **kwargs):
@@ -1638,6 +1698,7 @@ class MergeTask(Model):
         self.authentication_token_settings = kwargs.get('authentication_token_settings', None)
         self.output_files = kwargs.get('output_files', None)
         self.package_references = kwargs.get('package_references', None)
+        self.fan_in = kwargs.get('fan_in', None)
 
 
 class MultiInstanceSettings(Model):
@@ -1809,6 +1870,10 @@ class ParametricSweepTaskFactory(TaskFactoryBase):
     :type parameter_sets: A list of :class:`ParameterSet<azext.batch.models.ParameterSet>`
     :param repeat_task: The task template the will be used to generate each task.
     :type repeat_task: :class:`RepeatTask <azext.batch.models.RepeatTask>`
+    :param str cost: An arithmetic expression of the parameter placeholders,
+     such as '{0} * {1}', estimating the cost of each task. If given, tasks are
+     generated, numbered and submitted in decreasing order of cost, so that the
+     longest tasks start first.
     :param merge_task: An optional additional task to be run after all the other
      generated tasks have completed successfully.
     :type merge_task: :class:`MergeTask <azext.batch.models.MergeTask>`
@@ -1824,6 +1889,7 @@ class ParametricSweepTaskFactory(TaskFactoryBase):
         'type': {'key': 'type', 'type': 'str'},
         'parameter_sets': {'key': 'parameterSets', 'type': '[ParameterSet]'},
         'repeat_task': {'key': 'repeatTask', 'type': 'RepeatTask'},
+        'cost': {'key': 'cost', 'type': 'str'},
         'merge_task': {'key': 'mergeTask', 'type': 'MergeTask'}
     }
 
@@ -1831,6 +1897,7 @@ class ParametricSweepTaskFactory(TaskFactoryBase):
         super(ParametricSweepTaskFactory, self).__init__(**kwargs)
         self.parameter_sets = kwargs.get('parameter_sets', None)
         self.repeat_task = kwargs.get('repeat_task', None)
+        self.cost = kwargs.get('cost', None)
         self.type = 'parametricSweep'
         if not self.parameter_sets:
             raise ValueError("Parametric Sweep task factory requires at least one parameter set.")
@@ -32,6 +32,7 @@ class TaskFactoryBase(Model):
     _subtype_map = {
         'type': {'parametricSweep': 'ParametricSweepTaskFactory',
                  'taskPerFile': 'FileCollectionTaskFactory',
+                 'taskPerFileBatch': 'FileBatchTaskFactory',
                  'taskCollection': 'TaskCollectionTaskFactory'}
     }
 
@@ -1148,6 +1149,10 @@ class FileCollectionTaskFactory(TaskFactoryBase):
     :type source: :class:`FileSource <azext.batch.models.FileSource>`
     :param repeat_task: The task template the will be used to generate each task.
     :type repeat_task: :class:`RepeatTask <azext.batch.models.RepeatTask>`
+    :param str order: The order in which tasks are generated, numbered and
+     submitted: 'listing' (the default) in the order the files are listed, or
+     'largestFirst' in decreasing order of input size, so that the longest tasks
+     start first. Ordering by size lists every file before generating any task.
     :param merge_task: An optional additional task to be run after all the other
      generated tasks have completed successfully.
     :type merge_task: :class:`MergeTask <azext.batch.models.MergeTask>`
@@ -1163,17 +1168,70 @@ class FileCollectionTaskFactory(TaskFactoryBase):
         'type': {'key': 'type', 'type': 'str'},
         'source': {'key': 'source', 'type': 'FileSource'},
         'repeat_task': {'key': 'repeatTask', 'type': 'RepeatTask'},
+        'order': {'key': 'order', 'type': 'str'},
         'merge_task': {'key': 'mergeTask', 'type': 'MergeTask'}
     }
 
-    def __init__(self, *, source: str, repeat_task, merge_task=None, **kwargs) -> None:
+    def __init__(self, *, source: str, repeat_task, order: str=None, merge_task=None,
+                 **kwargs) -> None:
         super(FileCollectionTaskFactory, self).__init__(
             merge_task=merge_task, **kwargs)
         self.source = source
         self.repeat_task = repeat_task
+        self.order = order
         self.type = 'taskPerFile'
 
 
+class FileBatchTaskFactory(TaskFactoryBase):
+    """A Task Factory for generating a set of tasks based on the contents
+    of an Azure Storage container or auto-storage file group. The input files
+    are grouped into batches by number of files, total size, or both, and one
+    task will be generated per batch, and automatically added to the job.
+
+    :param source: The input file source from which the tasks will be generated.
+    :type source: :class:`FileSource <azext.batch.models.FileSource>`
+    :param repeat_task: The task template the will be used to generate each task.
+    :type repeat_task: :class:`RepeatTask <azext.batch.models.RepeatTask>`
+    :param int max_files: The maximum number of files in each batch.
+    :param int max_bytes: The maximum total size in bytes of the files in each
+     batch. A file larger than this is given a batch of its own.
+    :param str order: The order in which tasks are generated, numbered and
+     submitted: 'listing' (the default) in the order the files are listed, or
+     'largestFirst' in decreasing order of input size, so that the longest tasks
+     start first. Ordering by size lists every file before generating any task.
+    :param merge_task: An optional additional task to be run after all the other
+     generated tasks have completed successfully.
+    :type merge_task: :class:`MergeTask <azext.batch.models.MergeTask>`
+    """
+
+    _validation = {
+        'type': {'required': True},
+        'source': {'required': True},
+        'repeat_task': {'required': True}
+    }
+
+    _attribute_map = {
+        'type': {'key': 'type', 'type': 'str'},
+        'source': {'key': 'source', 'type': 'FileSource'},
+        'repeat_task': {'key': 'repeatTask', 'type': 'RepeatTask'},
+        'max_files': {'key': 'maxFiles', 'type': 'int'},
+        'max_bytes': {'key': 'maxBytes', 'type': 'long'},
+        'order': {'key': 'order', 'type': 'str'},
+        'merge_task': {'key': 'mergeTask', 'type': 'MergeTask'}
+    }
+
+    def __init__(self, *, source, repeat_task, max_files: int=None, max_bytes: int=None,
+                 order: str=None, merge_task=None, **kwargs) -> None:
+        super(FileBatchTaskFactory, self).__init__(
+            merge_task=merge_task, **kwargs)
+        self.source = source
+        self.repeat_task = repeat_task
+        self.order = order
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.type = 'taskPerFileBatch'
+
+
 class FileSource(Model):
     """A source of input files to be downloaded onto a compute node.
 
@@ -1710,6 +1768,10 @@ class MergeTask(Model):
      operating system.
     :type package_references: list of :class:`PackageReferenceBase
      <azext.batch.models.PackageReferenceBase>`
+    :param int fan_in: The maximum number of tasks each merge task depends on. If
+     the task factory generates more tasks than this, they are merged by a tree of
+     intermediate merge tasks running the same command line, so that merging runs
+     in parallel over several levels rather than in one task.
     """
 
     _validation = {
@@ -1733,12 +1795,14 @@ class MergeTask(Model):
                                           'type': 'AuthenticationTokenSettings'},
         'output_files': {'key': 'outputFiles', 'type': '[OutputFile]'},
         'package_references': {'key': 'packageReferences', 'type': '[PackageReferenceBase]'},
+        'fan_in': {'key': 'fanIn', 'type': 'int'},
     }
 
     def __init__(self, *, command_line: str, id: str=None, display_name: str=None, exit_conditions=None,
                  resource_files=None, environment_settings=None, affinity_info=None, constraints=None,
                  user_identity=None, depends_on=None, application_package_references=None,
-                 authentication_token_settings=None, output_files=None, package_references=None, **kwargs) -> None:
+                 authentication_token_settings=None, output_files=None, package_references=None,
+                 fan_in: int=None, **kwargs) -> None:
         super(MergeTask, self).__init__(**kwargs)
         self.id = id
         self.display_name = display_name
@@ -1754,6 +1818,7 @@ class MergeTask(Model):
         self.authentication_token_settings = authentication_token_settings
         self.output_files = output_files
         self.package_references = package_references
+        self.fan_in = fan_in
 
 
 class MultiInstanceSettings(Model):
@@ -1926,6 +1991,10 @@ class ParametricSweepTaskFactory(TaskFactoryBase):
     :type parameter_sets: A list of :class:`ParameterSet<azext.batch.models.ParameterSet>`	
     :param repeat_task: The task template the will be used to generate each task.	
     :type repeat_task: :class:`RepeatTask <azext.batch.models.RepeatTask>`	
+    :param str cost: An arithmetic expression of the parameter placeholders,
+     such as '{0} * {1}', estimating the cost of each task. If given, tasks are
+     generated, numbered and submitted in decreasing order of cost, so that the
+     longest tasks start first.
     :param merge_task: An optional additional task to be run after all the other	
      generated tasks have completed successfully.	
     :type merge_task: :class:`MergeTask <azext.batch.models.MergeTask>`	
@@ -1941,10 +2010,12 @@ class ParametricSweepTaskFactory(TaskFactoryBase):
         'type': {'key': 'type', 'type': 'str'},
         'parameter_sets': {'key': 'parameterSets', 'type': '[ParameterSet]'},
         'repeat_task': {'key': 'repeatTask', 'type': 'RepeatTask'},
+        'cost': {'key': 'cost', 'type': 'str'},
         'merge_task': {'key': 'mergeTask', 'type': 'MergeTask'}
     }
 
-    def __init__(self, *, parameter_sets, repeat_task, merge_task=None, **kwargs) -> None:
+    def __init__(self, *, parameter_sets, repeat_task, cost: str=None, merge_task=None,
+                 **kwargs) -> None:
         super(ParametricSweepTaskFactory, self).__init__(
             merge_task=merge_task, **kwargs)
         if not parameter_sets:
@@ -1952,6 +2023,7 @@ class ParametricSweepTaskFactory(TaskFactoryBase):
                 "Parametric Sweep task factory requires at least one parameter set.")
         self.parameter_sets = parameter_sets
         self.repeat_task = repeat_task
+        self.cost = cost
         self.type = 'parametricSweep'
 
 
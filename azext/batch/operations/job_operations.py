@@ -4,6 +4,8 @@
 # --------------------------------------------------------------------------------------------
 from __future__ import unicode_literals
 
+import copy
+import time
 from datetime import datetime as dt
 from msrest.exceptions import DeserializationError
 from azure.batch.operations._job_operations import JobOperations
@@ -11,7 +13,7 @@ from azure.batch.operations._job_operations import JobOperations
 from .. import models
 from .. import _template_utils as templates
 from .. import _pool_utils as pool_utils
-from .._file_utils import FileUtils
+from .._file_utils import FileUtils, FileManifest
 from ..models.constants import KnownTemplateVersion
 
 class ExtendedJobOperations(JobOperations):
@@ -48,11 +50,16 @@ class ExtendedJobOperations(JobOperations):
         raise ValueError('Missing required poolId or autoPoolSpecification.pool.')
 
     @staticmethod
-    def expand_template(template, parameters=None):
+    def expand_template(template, parameters=None, lazy=False, session=None):
         """Expand a JSON template, substituting in optional parameters.
         :param template: The template data. Must be a dictionary.
         :param parameters: The values of parameters to be substituted into
          the template. Must be a dictionary.
+        :param bool lazy: Whether the items of 'copy' loops are expanded on demand.
+         A lazily expanded specification must be passed to `jobparameter_from_json`
+         before it can be serialized.
+        :param session: A session from `expansion_session` for the same template,
+         which only re-evaluates the parts affected by changed parameters.
         :returns: The pool specification JSON dictionary.
         """
         if not isinstance(template, dict):
@@ -61,12 +68,81 @@ class ExtendedJobOperations(JobOperations):
             raise ValueError("parameters isn't a JSON dictionary")
         elif not parameters:
             parameters = {}
-        expanded_job_object = templates.expand_template(template, parameters)
         try:
-            return expanded_job_object['job']
+            return templates.expand_template(template, parameters, lazy, session, pointer='/job')
         except KeyError:
             raise ValueError("Template missing required 'job' element")
 
+    @staticmethod
+    def expand_template_many(template, parameter_sets, workers=None, compiled=None):
+        """Expand a JSON template against many sets of parameter values, using a
+        pool of worker processes. The template is only parsed once.
+        :param template: The template data. Must be a dictionary.
+        :param parameter_sets: An iterable of parameter value dictionaries. Each is
+         validated before this returns, and before any worker process starts.
+        :param int workers: The number of worker processes. Defaults to the CPU count.
+        :param compiled: The compiled template, e.g. from `load_template_file`.
+        :returns: A generator of (index, job specification JSON dictionary) pairs,
+         yielded as each expansion completes. The index is the position of the
+         parameter values in parameter_sets.
+        :raises: MissingParameterValue, TypeError or ValueError if any set of
+         parameter values is not valid for the template.
+        """
+        if not isinstance(template, dict):
+            raise ValueError("template isn't a JSON dictionary")
+        if 'job' not in template:
+            raise ValueError("Template missing required 'job' element")
+        return templates.expand_template_many(template, parameter_sets, workers, pointer='/job',
+                                              compiled=compiled)
+
+    @staticmethod
+    def expansion_session(template, compiled=None):
+        """Create a session for expanding a JSON template repeatedly, for example
+        as missing parameter values are supplied one at a time.
+        :param template: The template data. Must be a dictionary.
+        :param compiled: The compiled template, e.g. from `load_template_file`.
+        """
+        if not isinstance(template, dict):
+            raise ValueError("template isn't a JSON dictionary")
+        return templates.expansion_session(template, compiled)
+
+    @staticmethod
+    def missing_parameters(template, parameters=None, compiled=None):
+        """Find every parameter the template needs a value for that has not been
+        supplied, without expanding the template.
+        :param template: The template data. Must be a dictionary.
+        :param parameters: The values of parameters to be substituted into
+         the template. Must be a dictionary.
+        :param compiled: The compiled template, e.g. from `load_template_file`.
+        :returns: A list of MissingParameterValue errors.
+        """
+        if not isinstance(template, dict):
+            raise ValueError("template isn't a JSON dictionary")
+        return templates.missing_parameters(template, parameters, compiled, '/job')
+
+    @staticmethod
+    def load_template_file(file_path, cache_dir=None):
+        """Load a JSON template file and compile it, reusing the compiled form
+        kept in a cache directory while the file is unchanged.
+        :param str file_path: The path of the template file.
+        :param str cache_dir: The directory of the on-disk template cache.
+        :returns: A (template, compiled template) pair.
+        """
+        return templates.load_template_file(file_path, cache_dir)
+
+    @staticmethod
+    def expand_template_to_stream(template, output, parameters=None):
+        """Expand a JSON template read from a file-like object, writing the job
+        specification to another file-like object as it is expanded.
+        :param template: A readable file-like object with the template data.
+        :param output: A writable text file-like object for the job specification JSON.
+        :param parameters: The values of parameters to be substituted into
+         the template. Must be a dictionary.
+        """
+        if parameters and not isinstance(parameters, dict):
+            raise ValueError("parameters isn't a JSON dictionary")
+        templates.expand_template_to_stream(template, output, parameters, member='job')
+
     @staticmethod
     def jobparameter_from_json(json_data):
         """Create an ExtendedJobParameter object from a JSON specification.
@@ -74,6 +150,7 @@ class ExtendedJobOperations(JobOperations):
          ExtendedJobParameter or a JobTemplate
         """
         result = 'JobTemplate' if json_data.get('properties') else 'ExtendedJobParameter'
+        json_data, lazy_tasks = templates.split_lazy_task_collection(json_data)
         json_data = templates.convert_blob_source_to_http_url(json_data)
         try:
             if result == 'JobTemplate':
@@ -89,6 +166,9 @@ class ExtendedJobOperations(JobOperations):
                 job = models.ExtendedJobParameter.from_dict(json_data)
             if job is None:
                 raise ValueError("JSON file is not in correct format.")
+            if lazy_tasks is not None:
+                properties = job.properties if result == 'JobTemplate' else job
+                properties.task_factory.tasks = lazy_tasks
             return job
         except NotImplementedError:
             raise
@@ -97,7 +177,7 @@ class ExtendedJobOperations(JobOperations):
 
     # pylint: disable=arguments-differ
     def add(self, job, job_add_options=None, custom_headers=None, raw=False,
-            threads=None, **operation_config):
+            threads=None, shard=None, manifest=None, **operation_config):
         """Adds a job to the specified account.
 
         The Batch service supports two ways to control the work done as part of
@@ -124,6 +204,18 @@ class ExtendedJobOperations(JobOperations):
         :param int threads: number of threads to use in parallel when adding tasks.
          If specified will start additional threads to submit requests and
          wait for them to finish. Defaults to half of cpu count(floor)
+        :param tuple shard: A (index, count) pair to only generate and submit the tasks
+         in one of count contiguous, disjoint parts of the task factory, for example
+         from several processes at once. Task IDs are the same as when submitting all
+         the tasks at once. The job is created by whichever shard is submitted first,
+         and is not deleted if submitting the tasks of a shard fails.
+        :param manifest: The path of a file recording the files of a taskPerFile or
+         taskPerFileBatch task factory that tasks have been submitted for, or a :class:`FileManifest
+         <azext.batch._file_utils.FileManifest>` loaded from one. Only files that are new
+         or changed since the manifest was saved get tasks, with task IDs carrying on
+         from earlier runs. If the job already exists the tasks are added to it, and it
+         is not deleted if submitting them fails. The manifest is saved once the tasks
+         have been submitted.
         :param operation_config: :ref:`Operation configuration
          overrides<msrest:optionsforoperations>`.
         :return: :class:`TaskAddCollectionResult
@@ -147,7 +239,8 @@ class ExtendedJobOperations(JobOperations):
         # Process an application template reference.
         if hasattr(job, 'application_template_info') and job.application_template_info:
             try:
-                templates.expand_application_template(job, self._deserialize)
+                templates.expand_application_template(
+                    job, self._deserialize, getattr(self._parent, 'application_templates', None))
             except DeserializationError as error:
                 raise ValueError("Failed to load application template from '{}': {}".
                                  format(job.application_template_info.file_path, error))
@@ -156,10 +249,27 @@ class ExtendedJobOperations(JobOperations):
         auto_complete = False
         task_collection = []
         file_utils = FileUtils(self.get_storage_client)
+        if manifest is not None and not isinstance(manifest, FileManifest):
+            manifest = FileManifest(manifest)
+        # The job is shared with other shards, or earlier runs using the manifest
+        shared_job = shard is not None or manifest is not None
         if hasattr(job, 'task_factory') and job.task_factory:
+            if manifest is not None and getattr(job.task_factory, 'merge_task', None):
+                raise ValueError("A merge task cannot be used with a file manifest, as each "
+                                 "submission only adds tasks for the files that are new.")
             if templates.has_merge_task(job):
                 job.uses_task_dependencies = True
-            task_collection = templates.expand_task_factory(job, file_utils)
+            task_collection = templates.expand_task_factory(job, file_utils, manifest)
+            if isinstance(task_collection, list):
+                # Checked before sharding, as tasks may depend on tasks in other shards.
+                # Tasks generated on demand only depend on the tasks generated before
+                # them, through the merge tasks of the factory, so are not checked.
+                templates.process_task_dependencies(task_collection)
+            if shard is not None:
+                if job.on_all_tasks_complete and job.on_all_tasks_complete != 'noAction':
+                    raise ValueError("onAllTasksComplete cannot be set when submitting a shard "
+                                     "of the tasks, as other shards may not have been submitted.")
+                task_collection = templates.shard_tasks(task_collection, *shard)
 
             # If job has a task factory and terminate job on all tasks complete is set, the job will
             # already be terminated when we add the tasks, so we need to set to noAction, then patch
@@ -167,8 +277,17 @@ class ExtendedJobOperations(JobOperations):
             if job.on_all_tasks_complete and job.on_all_tasks_complete != 'noAction':
                 auto_complete = job.on_all_tasks_complete
                 job.on_all_tasks_complete = 'noaction'
+        elif shard is not None:
+            raise ValueError("Only the tasks of a task factory can be submitted in shards.")
+        elif manifest is not None:
+            raise ValueError("A file manifest can only be used with a taskPerFile or "
+                             "taskPerFileBatch task factory.")
 
-        should_get_pool = templates.should_get_pool(job, task_collection)
+        # Tasks generated on demand are only processed as they are submitted
+        streamed = isinstance(task_collection,
+                              (templates.ParametricSweepTasks, templates.TaskPerFileTasks))
+        sample_tasks = task_collection.sample() if streamed else task_collection
+        should_get_pool = templates.should_get_pool(job, sample_tasks)
         pool_os_flavor = None
         if should_get_pool:
             pool = self._get_target_pool(job)
@@ -187,7 +306,7 @@ class ExtendedJobOperations(JobOperations):
         commands = []
         # Handle package management on tasks.
         commands.append(templates.process_task_package_references(
-            task_collection, pool_os_flavor))
+            sample_tasks, pool_os_flavor))
         job_prep_task_parameters = templates.construct_setup_task(
             job.job_preparation_task, commands, pool_os_flavor)
         if job_prep_task_parameters:
@@ -195,26 +314,39 @@ class ExtendedJobOperations(JobOperations):
 
         # Handle any extended resource file references.
         templates.post_processing(job, file_utils, pool_os_flavor)
-        if task_collection:
+        if task_collection and not streamed:
             templates.post_processing(task_collection, file_utils, pool_os_flavor)
-        templates.process_job_for_output_files(job, task_collection, file_utils)
+        templates.process_job_for_output_files(
+            job, [] if streamed else task_collection, file_utils)
 
         # Begin original job add process
-        result = super(ExtendedJobOperations, self).add(
-            job, job_add_options, custom_headers, raw, **operation_config)
+        try:
+            result = super(ExtendedJobOperations, self).add(
+                job, job_add_options, custom_headers, raw, **operation_config)
+        except models.BatchErrorException as error:
+            if not shared_job or error.error.code != 'JobExists':
+                raise
+            result = None  # Created by another shard or an earlier run
         if task_collection:
             try:
-                tasks = self._parent.task.add_collection(
-                    job.id,
-                    task_collection,
-                    None,
-                    None,
-                    raw,
-                    threads)
+                if streamed:
+                    tasks = self._add_streamed_tasks(
+                        job.id, task_collection, file_utils, pool_os_flavor, raw, threads)
+                else:
+                    tasks = self._parent.task.add_collection(
+                        job.id,
+                        task_collection,
+                        None,
+                        None,
+                        raw,
+                        threads)
             except Exception:
-                # If task submission raises, we roll back the job
-                self.delete(job.id)
+                # If task submission raises, we roll back the job unless it is shared
+                if not shared_job:
+                    self.delete(job.id)
                 raise
+            if manifest is not None:
+                manifest.save()
             if auto_complete:
                 # If the option to terminate the job was set, we need to reapply it with a patch
                 # now that the tasks have been added.
@@ -222,3 +354,60 @@ class ExtendedJobOperations(JobOperations):
             return tasks
         return result
     add.metadata = {'url': '/jobs'}
+
+    def watch(self, job, manifest, interval=60, polls=None, threads=None):
+        """Add a job with a taskPerFile or taskPerFileBatch task factory, or use it if it
+        already exists, and keep adding tasks to it for the files that land in the source
+        of the factory. The source is listed every interval seconds, and only files that
+        are not in the manifest get tasks. The manifest is saved after every listing, so watching can
+        be stopped and resumed later.
+        :param job: The job to be added.
+        :type job: :class:`ExtendedJobParameter<azext.batch.models.ExtendedJobParameter>`
+        :param manifest: The path of a file recording the files that tasks have been
+         submitted for, or a :class:`FileManifest<azext.batch._file_utils.FileManifest>`.
+        :param float interval: The number of seconds between listings of the source.
+        :param int polls: The number of times to list the source. Defaults to watching
+         until interrupted.
+        :param int threads: number of threads to use in parallel when adding tasks.
+        :return: :class:`TaskAddCollectionResult
+         <azure.batch.models.TaskAddCollectionResult>` for the tasks added.
+        """
+        factory = getattr(job, 'task_factory', None)
+        if not factory or factory.type not in templates.FILE_TASK_FACTORIES:
+            raise ValueError("Only a job with a taskPerFile or taskPerFileBatch task factory "
+                             "can watch for files.")
+        if factory.merge_task:
+            raise ValueError("A merge task cannot be used when watching for files, as tasks "
+                             "may be added to the job at any time.")
+        if job.on_all_tasks_complete and job.on_all_tasks_complete != 'noAction':
+            raise ValueError("onAllTasksComplete cannot be set when watching for files, as "
+                             "tasks may be added to the job at any time.")
+        if not isinstance(manifest, FileManifest):
+            manifest = FileManifest(manifest)
+        results = []
+        poll = 0
+        while True:
+            # Adding the job consumes its task factory
+            result = self.add(copy.deepcopy(job), threads=threads, manifest=manifest)
+            results.extend(result.value or [])
+            poll += 1
+            if polls is not None and poll >= polls:
+                return models.TaskAddCollectionResult(value=results)
+            time.sleep(interval)
+
+    def _add_streamed_tasks(self, job_id, task_collection, file_utils, os_flavor, raw, threads):
+        """Submit tasks that are generated on demand, processing and submitting one
+        add_collection request per thread at a time so that only those tasks are held
+        in memory.
+        :returns: :class:`TaskAddCollectionResult
+         <azure.batch.models.TaskAddCollectionResult>` for all the tasks.
+        """
+        results = []
+        window = templates.MAX_TASKS_PER_REQUEST * max(threads or 1, 1)
+        for chunk in task_collection.chunks(window):
+            templates.process_task_package_references(chunk, os_flavor)
+            chunk = templates.post_processing(chunk, file_utils, os_flavor)
+            templates.process_tasks_for_output_files(chunk, file_utils)
+            result = self._parent.task.add_collection(job_id, chunk, None, None, raw, threads)
+            results.extend(result.value or [])
+        return models.TaskAddCollectionResult(value=results)
@@ -28,11 +28,13 @@ class ExtendedPoolOperations(PoolOperations):
         self.get_storage_client = get_storage_account
 
     @staticmethod
-    def expand_template(template, parameters=None):
+    def expand_template(template, parameters=None, session=None):
         """Expand a JSON template, substituting in optional parameters.
         :param template: The template data. Must be a dictionary.
         :param parameters: The values of parameters to be substituted into
          the template. Must be a dictionary.
+        :param session: A session from `expansion_session` for the same template,
+         which only re-evaluates the parts affected by changed parameters.
         :returns: The pool specification JSON dictionary.
         """
         if not isinstance(template, dict):
@@ -41,12 +43,60 @@ class ExtendedPoolOperations(PoolOperations):
             raise ValueError("parameters isn't a JSON dictionary")
         elif not parameters:
             parameters = {}
-        expanded_pool_object = templates.expand_template(template, parameters)
         try:
-            return expanded_pool_object['pool']
+            return templates.expand_template(template, parameters, session=session,
+                                             pointer='/pool')
         except KeyError:
             raise ValueError("Template missing required 'pool' element")
 
+    @staticmethod
+    def expansion_session(template, compiled=None):
+        """Create a session for expanding a JSON template repeatedly, for example
+        as missing parameter values are supplied one at a time.
+        :param template: The template data. Must be a dictionary.
+        :param compiled: The compiled template, e.g. from `load_template_file`.
+        """
+        if not isinstance(template, dict):
+            raise ValueError("template isn't a JSON dictionary")
+        return templates.expansion_session(template, compiled)
+
+    @staticmethod
+    def missing_parameters(template, parameters=None, compiled=None):
+        """Find every parameter the template needs a value for that has not been
+        supplied, without expanding the template.
+        :param template: The template data. Must be a dictionary.
+        :param parameters: The values of parameters to be substituted into
+         the template. Must be a dictionary.
+        :param compiled: The compiled template, e.g. from `load_template_file`.
+        :returns: A list of MissingParameterValue errors.
+        """
+        if not isinstance(template, dict):
+            raise ValueError("template isn't a JSON dictionary")
+        return templates.missing_parameters(template, parameters, compiled, '/pool')
+
+    @staticmethod
+    def load_template_file(file_path, cache_dir=None):
+        """Load a JSON template file and compile it, reusing the compiled form
+        kept in a cache directory while the file is unchanged.
+        :param str file_path: The path of the template file.
+        :param str cache_dir: The directory of the on-disk template cache.
+        :returns: A (template, compiled template) pair.
+        """
+        return templates.load_template_file(file_path, cache_dir)
+
+    @staticmethod
+    def expand_template_to_stream(template, output, parameters=None):
+        """Expand a JSON template read from a file-like object, writing the pool
+        specification to another file-like object as it is expanded.
+        :param template: A readable file-like object with the template data.
+        :param output: A writable text file-like object for the pool specification JSON.
+        :param parameters: The values of parameters to be substituted into
+         the template. Must be a dictionary.
+        """
+        if parameters and not isinstance(parameters, dict):
+            raise ValueError("parameters isn't a JSON dictionary")
+        templates.expand_template_to_stream(template, output, parameters, member='pool')
+
     @staticmethod
     def poolparameter_from_json(json_data):
         """Create an ExtendedPoolParameter object from a JSON specification.
@@ -45,6 +45,10 @@ def load_arguments(self, _):
         c.argument('json_file', type=file_type, help='A file containing the job specification in JSON (formatted to match the respective REST API body). If this parameter is specified, all \'Job Arguments\' are ignored.', validator=validate_json_file, completer=FilesCompleter())
         c.argument('template', type=file_type, arg_group='Batch Extensions', help='A Batch job JSON template file. If this parameter is specified, all other parameters are ignored.', completer=FilesCompleter())
         c.argument('parameters', type=file_type, arg_group='Batch Extensions', help='Parameter values for a Batch job JSON template file. Can only be used with --template.', completer=FilesCompleter())
+        c.argument('parameter_sets', type=file_type, arg_group='Batch Extensions', help='A file containing a JSON list of parameter values for a Batch job JSON template file. One job is created for each set of values. Can only be used with --template.', completer=FilesCompleter())
+        c.argument('workers', type=int, arg_group='Batch Extensions', help='The number of processes used to expand the template when --parameter-sets is specified. The default is the number of CPU cores.')
+        c.argument('file_manifest', type=file_type, arg_group='Batch Extensions', help='A file recording the files of a taskPerFile task factory that tasks have been submitted for. Only files that are new or changed since the last run get tasks, which are added to the job if it already exists. The file is created if it does not exist.', completer=FilesCompleter())
+        c.argument('watch_interval', type=float, arg_group='Batch Extensions', help='Keep listing the source of a taskPerFile task factory every this many seconds, adding tasks to the job for new files until interrupted. Requires --file-manifest.')
         c.argument('metadata', arg_group='Job', nargs='+', type=metadata_item_format)
         c.argument('uses_task_dependencies', arg_group='Job', action='store_true', help='The flag that determines if this job will use tasks with dependencies. True if flag present.')
         c.argument('pool_id', arg_group='Job: Pool Info', help='The id of an existing pool. All the tasks of the job will run on the specified pool.')
@@ -15,6 +15,19 @@ from azext.batch.operations import ExtendedPoolOperations, ExtendedJobOperations
 
 logger = get_logger(__name__)
 
+
+def _template_cache_dir():
+    """The directory in which compiled templates are kept between CLI invocations."""
+    from azure.cli.core._environment import get_config_dir
+    return os.path.join(get_config_dir(), 'batch', 'templates')
+
+
+def _prompt_for_parameter(parameters, error):
+    param_prompt = error.parameter_name
+    param_prompt += " ({}): ".format(error.parameter_description)
+    parameters[error.parameter_name] = prompt(param_prompt)
+
+
 # NCJ custom commands
 # pylint: disable=redefined-builtin
 
@@ -56,14 +69,16 @@ def create_pool(client, template=None, parameters=None, json_file=None, id=None,
         if template:
             json_obj = None
             parameters = get_file_json(parameters) if parameters else {}
-            template_obj = get_file_json(template)
+            template_obj, compiled = client.pool.load_template_file(
+                template, _template_cache_dir())
+            for error in client.pool.missing_parameters(template_obj, parameters, compiled):
+                _prompt_for_parameter(parameters, error)
+            session = client.pool.expansion_session(template_obj, compiled)
             while json_obj is None:
                 try:
-                    json_obj = client.pool.expand_template(template_obj, parameters)
+                    json_obj = client.pool.expand_template(template_obj, parameters, session)
                 except MissingParameterValue as error:
-                    param_prompt = error.parameter_name
-                    param_prompt += " ({}): ".format(error.parameter_description)
-                    parameters[error.parameter_name] = prompt(param_prompt)
+                    _prompt_for_parameter(parameters, error)
                 except TypeError as error:
                     raise ValueError(str(error))
                 else:
@@ -152,27 +167,85 @@ def create_pool(client, template=None, parameters=None, json_file=None, id=None,
 create_pool.__doc__ = PoolAddParameter.__doc__
 
 
+def _job_from_json(json_obj):
+    """Create and validate a job from its JSON specification."""
+    try:
+        job = ExtendedJobOperations.jobparameter_from_json(json_obj)
+    except NotImplementedError:
+        logger.error("The specified template API version is not supported by the current SDK extension")
+        raise
+    if job is None:
+        raise ValueError("JSON job parameter is not in correct format.")
+    templates.validate_json_object(json_obj, job)
+    return job
+
+
+def _add_job(client, job, file_manifest=None, watch_interval=None):
+    from azext.batch.models import JobAddOptions
+    add_option = JobAddOptions()
+    try:
+        if watch_interval is not None:
+            client.job.watch(job, file_manifest, watch_interval,
+                             threads=multiprocessing.cpu_count()//2)
+        else:
+            client.job.add(job, add_option, threads=multiprocessing.cpu_count()//2,
+                           manifest=file_manifest)
+    except CreateTasksErrorException as e:
+        for error in e.failures:
+            logger.warning(error.task_id + " failed to be added due to " + error.error.code)
+
+
+def _create_jobs_from_parameter_sets(client, template, parameter_sets, workers=None):
+    """Create one job from a template for each set of parameter values in a JSON file.
+    Templates are expanded in parallel and each job is added as soon as it is ready."""
+    parameter_sets = get_file_json(parameter_sets)
+    if not isinstance(parameter_sets, list):
+        raise ValueError("The parameter sets file must contain a JSON list of parameter values.")
+    template_obj, compiled = client.job.load_template_file(template, _template_cache_dir())
+    for _, json_obj in client.job.expand_template_many(template_obj, parameter_sets, workers,
+                                                       compiled):
+        json_obj = json_obj.get('properties', json_obj)
+        _add_job(client, _job_from_json(json_obj))
+
+
 def create_job(client, template=None, parameters=None, json_file=None, id=None,  # pylint:disable=too-many-arguments, too-many-locals
                pool_id=None, priority=None, uses_task_dependencies=False, metadata=None,
                job_max_wall_clock_time=None, job_max_task_retry_count=None,
                job_manager_task_command_line=None, job_manager_task_environment_settings=None,
                job_manager_task_id=None, job_manager_task_resource_files=None, allow_task_preemption=None,
-               max_parallel_tasks=None, required_slots=None):
+               max_parallel_tasks=None, required_slots=None, parameter_sets=None, workers=None,
+               file_manifest=None, watch_interval=None):
     # pylint: disable=too-many-branches, too-many-statements
     from azext.batch.errors import MissingParameterValue
-    from azext.batch.models import JobManagerTask, JobAddOptions, PoolInformation
+    from azext.batch.models import JobManagerTask, PoolInformation
+    if watch_interval is not None and not file_manifest:
+        raise ValueError('--watch-interval can only be used with --file-manifest')
+    if file_manifest and not (template or json_file):
+        raise ValueError('--file-manifest can only be used with --template or --json-file')
+    if parameter_sets:
+        if not template:
+            raise ValueError('--parameter-sets can only be used with --template')
+        if parameters:
+            raise ValueError('--parameters cannot be used with --parameter-sets')
+        if file_manifest:
+            raise ValueError('--file-manifest cannot be used with --parameter-sets')
+        _create_jobs_from_parameter_sets(client, template, parameter_sets, workers)
+        return
     if template or json_file:
         if template:
             json_obj = None
             parameters = get_file_json(parameters) if parameters else {}
-            template_obj = get_file_json(template)
+            template_obj, compiled = client.job.load_template_file(
+                template, _template_cache_dir())
+            for error in client.job.missing_parameters(template_obj, parameters, compiled):
+                _prompt_for_parameter(parameters, error)
+            session = client.job.expansion_session(template_obj, compiled)
             while json_obj is None:
                 try:
-                    json_obj = client.job.expand_template(template_obj, parameters)
+                    json_obj = client.job.expand_template(template_obj, parameters, lazy=True,
+                                                          session=session)
                 except MissingParameterValue as error:
-                    param_prompt = error.parameter_name
-                    param_prompt += " ({}): ".format(error.parameter_description)
-                    parameters[error.parameter_name] = prompt(param_prompt)
+                    _prompt_for_parameter(parameters, error)
                 except TypeError as error:
                     raise ValueError(str(error))
                 else:
@@ -180,14 +253,7 @@ def create_job(client, template=None, parameters=None, json_file=None, id=None,
         else:
             json_obj = get_file_json(json_file)
         # validate the json file
-        try:
-            job = ExtendedJobOperations.jobparameter_from_json(json_obj)
-        except NotImplementedError:
-            logger.error("The specified template API version is not supported by the current SDK extension")
-            raise
-        if job is None:
-            raise ValueError("JSON job parameter is not in correct format.")
-        templates.validate_json_object(json_obj, job)
+        job = _job_from_json(json_obj)
     else:
         if not id:
             raise ValueError('Please supply template, json_file, or id')
@@ -214,12 +280,7 @@ def create_job(client, template=None, parameters=None, json_file=None, id=None,
             
             job.job_manager_task = job_manager_task
 
-    add_option = JobAddOptions()
-    try:
-        client.job.add(job, add_option, threads=multiprocessing.cpu_count()//2)
-    except CreateTasksErrorException as e:
-        for error in e.failures:
-            logger.warning(error.task_id + " failed to be added due to " + error.error.code)
+    _add_job(client, job, file_manifest, watch_interval)
 
 create_job.__doc__ = JobAddParameter.__doc__ + "\n" + JobConstraints.__doc__
 
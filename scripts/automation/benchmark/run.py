@@ -0,0 +1,277 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""Measure how the template engine scales with the size of synthetic templates.
+
+Each suite generates templates of increasing size along one axis and measures the
+time and peak memory of template expansion, task factory expansion and task post
+processing. The results are printed as a table and written to a JSON file along
+with the scaling exponent between consecutive sizes, which is about 1 for linear
+and 2 for quadratic behaviour.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import gc
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+from azext.batch import _template_utils as templates
+from azext.batch._pool_utils import PoolOperatingSystemFlavor
+from azext.batch.operations.job_operations import ExtendedJobOperations
+
+from automation.utilities.display import print_records
+from automation.utilities.path import get_test_results_dir
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+# Nesting depths are bounded by the recursion limit, so scale them separately
+DEPTHS = [16, 32, 64, 128]
+
+# Times shorter than this are too noisy to derive a scaling exponent from
+MIN_SCALING_TIME = 0.01
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+def _task(index, command_line):
+    return {'id': str(index), 'commandLine': command_line}
+
+
+def _string_sites(size):
+    """A task collection with one parameter reference per task."""
+    template = {
+        'parameters': {'image': {'type': 'string'}},
+        'job': {
+            'id': 'strings',
+            'poolInfo': {'poolId': 'pool'},
+            'taskFactory': {
+                'type': 'taskCollection',
+                'tasks': [_task(i, "[concat('run ', parameters('image'), ' {}')]".format(i))
+                          for i in range(size)]
+            }
+        }
+    }
+    return template, {'image': 'ubuntu'}
+
+
+def _nesting_depth(depth):
+    """A job whose metadata holds 1000 parameter references below nested objects."""
+    value = [{'name': str(i), 'value': "[parameters('value')]"} for i in range(1000)]
+    for level in range(depth):
+        value = {'level{}'.format(level): value}
+    template = {
+        'parameters': {'value': {'type': 'string'}},
+        'job': {
+            'id': 'depth',
+            'poolInfo': {'poolId': 'pool'},
+            'taskFactory': {'type': 'taskCollection', 'tasks': [_task(0, 'true')]},
+            'metadata': [{'name': 'nested', 'value': "[variables('nested')]"}]
+        },
+        'variables': {'nested': value}
+    }
+    return template, {'value': 'x'}
+
+
+def _check_nesting_depth(job, depth):
+    """Check that the nested variable was expanded down to its innermost references."""
+    value = job['metadata'][0]['value']
+    for level in reversed(range(depth)):
+        value = value['level{}'.format(level)]
+    if len(value) != 1000 or any(item['value'] != 'x' for item in value):
+        raise AssertionError('The nested variable was not expanded to depth {}'.format(depth))
+
+
+def _variable_fan_in(size):
+    """A variable concatenating one variable per parameter, used by one task."""
+    variables = {'v{}'.format(i): "[parameters('p{}')]".format(i) for i in range(size)}
+    variables['all'] = "[concat({})]".format(
+        ', '.join("variables('v{}')".format(i) for i in range(size)))
+    template = {
+        'parameters': {'p{}'.format(i): {'type': 'string'} for i in range(size)},
+        'variables': variables,
+        'job': {
+            'id': 'fanin',
+            'poolInfo': {'poolId': 'pool'},
+            'taskFactory': {'type': 'taskCollection',
+                            'tasks': [_task(0, "[variables('all')]")]}
+        }
+    }
+    return template, {'p{}'.format(i): 'x' for i in range(size)}
+
+
+def _object_parameters(size):
+    """Tasks selecting members of an object parameter holding expressions."""
+    settings = {'k{}'.format(i): "[concat('value', parameters('suffix'))]" for i in range(size)}
+    template = {
+        'parameters': {'settings': {'type': 'object'}, 'suffix': {'type': 'string'}},
+        'job': {
+            'id': 'objects',
+            'poolInfo': {'poolId': 'pool'},
+            'taskFactory': {
+                'type': 'taskCollection',
+                'tasks': [_task(i, "[parameters('settings').k{}]".format(i))
+                          for i in range(size)]
+            }
+        }
+    }
+    return template, {'settings': settings, 'suffix': '1'}
+
+
+def _parametric_sweep(size):
+    """A parametric sweep of one task per parameter value."""
+    template = {
+        'job': {
+            'id': 'sweep',
+            'poolInfo': {'poolId': 'pool'},
+            'taskFactory': {
+                'type': 'parametricSweep',
+                'parameterSets': [{'start': 1, 'end': size, 'step': 1}],
+                'repeatTask': {'commandLine': 'process {0:8}'}
+            }
+        }
+    }
+    return template, {}
+
+
+SUITES = {
+    'strings': (_string_sites, DEFAULT_SIZES),
+    'depth': (_nesting_depth, DEPTHS),
+    'fanin': (_variable_fan_in, DEFAULT_SIZES),
+    'objects': (_object_parameters, DEFAULT_SIZES),
+    'sweep': (_parametric_sweep, DEFAULT_SIZES),
+}
+
+# Checks that a suite's expanded job exercises what the suite measures
+CHECKS = {
+    'depth': _check_nesting_depth,
+}
+
+
+def _measure(function, trace_memory):
+    """Return the result, seconds taken and peak bytes allocated by a function."""
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = _timer()
+    try:
+        result = function()
+        elapsed = _timer() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def _stages(template, parameters):
+    """Yield the name and function of each stage, each taking the previous result."""
+    yield 'expand_template', lambda _: ExtendedJobOperations.expand_template(
+        template, parameters)
+    yield 'jobparameter_from_json', ExtendedJobOperations.jobparameter_from_json
+    # Parametric sweeps generate their tasks on demand, so generate them all here
+    yield 'expand_task_factory', lambda job: list(templates.expand_task_factory(job, None))
+    yield 'post_processing', lambda tasks: templates.post_processing(
+        tasks, None, PoolOperatingSystemFlavor.LINUX)
+
+
+def run_suite(name, sizes, repeat):
+    """Measure each stage of a suite for every size. Peak memory is measured in a
+    separate run, as tracing allocations slows the code down.
+    :returns: A list of result records.
+    """
+    generate = SUITES[name][0]
+    records = []
+    for size in sizes:
+        template, parameters = generate(size)
+        measured = collections.OrderedDict()
+        # Stages modify their input, so each run starts again from the template
+        runs = [False] * repeat + ([True] if tracemalloc else [])
+        for trace_memory in runs:
+            templates.engine.compiled_templates.clear()
+            value = None
+            for stage, function in _stages(template, parameters):
+                value, elapsed, peak = _measure(lambda f=function, v=value: f(v), trace_memory)
+                if stage == 'expand_template' and name in CHECKS:
+                    CHECKS[name](value, size)
+                record = measured.setdefault(stage, {'suite': name, 'size': size,
+                                                     'stage': stage, 'peak_bytes': None})
+                if trace_memory:
+                    record['peak_bytes'] = peak
+                else:
+                    record['seconds'] = min(elapsed, record.get('seconds', elapsed))
+        records.extend(measured.values())
+        print('{} {} done'.format(name, size), file=sys.stderr)
+    return records
+
+
+def scaling(records):
+    """Return the scaling exponent of the time of each stage between consecutive sizes."""
+    curves = {}
+    for record in records:
+        curves.setdefault((record['suite'], record['stage']), []).append(record)
+    exponents = []
+    for (suite, stage), points in sorted(curves.items()):
+        points.sort(key=lambda r: r['size'])
+        for low, high in zip(points, points[1:]):
+            if min(low['seconds'], high['seconds']) < MIN_SCALING_TIME:
+                continue
+            exponent = math.log(high['seconds'] / low['seconds']) / \
+                math.log(float(high['size']) / low['size'])
+            exponents.append({'suite': suite, 'stage': stage, 'from': low['size'],
+                              'to': high['size'], 'exponent': round(exponent, 3)})
+    return exponents
+
+
+def main():
+    parser = argparse.ArgumentParser('Template engine benchmarks')
+    parser.add_argument('--suite', dest='suites', action='append', choices=sorted(SUITES),
+                        help='Run only this suite. May be given more than once.')
+    parser.add_argument('--max-size', type=int, default=DEFAULT_SIZES[-1],
+                        help='The largest size to measure.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of timed runs per stage, of which the fastest counts.')
+    parser.add_argument('--output', help='The JSON file to write the results to.')
+    parser.add_argument('--max-exponent', type=float,
+                        help='Fail if any stage scales with a higher exponent.')
+    args = parser.parse_args()
+
+    records = []
+    for name in args.suites or sorted(SUITES):
+        sizes = [s for s in SUITES[name][1] if s <= args.max_size] or SUITES[name][1][:1]
+        records.extend(run_suite(name, sizes, args.repeat))
+    exponents = scaling(records)
+
+    output = args.output or os.path.join(
+        get_test_results_dir(with_timestamp=True, prefix='benchmark'), 'benchmark.json')
+    with open(output, 'w') as results_file:
+        json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                   'results': records, 'scaling': exponents}, results_file, indent=2)
+
+    print_records([(r['suite'], str(r['size']), r['stage'], '{:.4f}'.format(r['seconds']),
+                    r['peak_bytes'] if r['peak_bytes'] is not None else '-')
+                   for r in records], title='template engine benchmarks',
+                  foot_notes=['Results written to {}'.format(output)])
+    failures = [e for e in exponents
+                if args.max_exponent is not None and e['exponent'] > args.max_exponent]
+    for failure in failures:
+        print('{suite} {stage} scales with exponent {exponent} from {from} to {to}'.format(
+            **failure))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,9 +4,13 @@
 # --------------------------------------------------------------------------------------------
 
 import collections
+import io
 import json
 import os
 import requests
+import shutil
+import tempfile
+import threading
 import unittest
 from mock import patch, Mock, MagicMock
 
@@ -26,7 +30,7 @@ from azext.batch import operations
 from azext.batch import _template_utils as utils
 from azext.batch import _pool_utils as pool_utils
 from azext.batch import _file_utils as file_utils
-from azext.batch.errors import CreateTasksErrorException
+from azext.batch.errors import CreateTasksErrorException, MissingParameterValue
 
 
 class TestBatchExtensions(unittest.TestCase):
@@ -263,6 +267,494 @@ class TestBatchExtensions(unittest.TestCase):
         self.assertEqual(resolved['properties']['poolInfo']['poolId'], "xplatTestPool")
         self.assertFalse('[parameters(' in json.dumps(resolved))
 
+    def test_batch_extensions_compiled_template(self):
+        template = {
+            'parameters': {
+                'name': {'type': 'string'},
+                'count': {'type': 'int', 'defaultValue': 3}
+            },
+            'variables': {
+                'label': "[concat('[', parameters('name'), ']')]"
+            },
+            'result': "[variables('label')]",
+            'count': "[parameters('count')]",
+            'summary': "Run [parameters('name')] x[parameters('count')] [[escaped]"
+        }
+        engine = utils.engine
+        compiled = engine.compile_template(template)
+
+        # It should reuse the compiled template for the same content
+        self.assertIs(engine.compile_template(json.loads(json.dumps(template))), compiled)
+
+        # It should evaluate the compiled expressions against each set of parameters
+        first = compiled.expand({'name': 'alpha'})
+        second = compiled.expand({'name': 'beta', 'count': 5})
+        self.assertEqual(first['result'], '[alpha]')
+        self.assertEqual(first['count'], 3)
+        self.assertEqual(first['summary'], 'Run alpha x3 [escaped]')
+        self.assertEqual(second['result'], '[beta]')
+        self.assertEqual(second['count'], 5)
+
+        # It should not be affected by later changes to the source template
+        template['result'] = "[parameters('name')]"
+        self.assertIsNot(engine.compile_template(template), compiled)
+        self.assertEqual(compiled.expand({'name': 'alpha'})['result'], '[alpha]')
+        self.assertEqual(utils.expand_template(template, {'name': 'alpha'})['result'], 'alpha')
+
+        # It should evict the least recently used template
+        cache = engine.CompiledTemplateCache(max_size=1)
+        cache.get(template)
+        cache.get({'value': 'other'})
+        self.assertEqual(len(cache), 1)
+
+    def test_batch_extensions_expansion_copies_static_nodes(self):
+        template = {
+            'parameters': {
+                'jobId': {'type': 'string'},
+                'settings': {'type': 'object', 'defaultValue': {'retries': 2}}
+            },
+            'variables': {'tags': [{'name': 'team', 'value': 'render'}]},
+            'job': {
+                'properties': {
+                    'id': "[parameters('jobId')]",
+                    'constraints': "[parameters('settings')]",
+                    'poolInfo': {'poolId': 'static-pool'},
+                    'metadata': "[variables('tags')]",
+                    'commonResourceFiles': [{'blobSource': 'https://a/b', 'filePath': 'b'}]
+                }
+            }
+        }
+        first = utils.expand_template(template, {'jobId': 'first'})
+        self.assertEqual(first['job']['properties']['id'], 'first')
+        self.assertEqual(first['job']['properties']['constraints'], {'retries': 2})
+
+        # Modifying one expansion should not affect the template or any other expansion
+        properties = first['job']['properties']
+        properties['poolInfo']['poolId'] = 'MUTATED'
+        properties['constraints']['retries'] = 5
+        properties['metadata'].append({'name': 'extra', 'value': '1'})
+        properties['commonResourceFiles'][0]['filePath'] = 'c'
+        second = utils.expand_template(template, {'jobId': 'second'})['job']['properties']
+        self.assertEqual(second['poolInfo'], {'poolId': 'static-pool'})
+        self.assertEqual(second['constraints'], {'retries': 2})
+        self.assertEqual(second['metadata'], [{'name': 'team', 'value': 'render'}])
+        self.assertEqual(second['commonResourceFiles'], [{'blobSource': 'https://a/b', 'filePath': 'b'}])
+        job = operations.ExtendedJobOperations.expand_template(template, {'jobId': 'third'})
+        job['properties']['poolInfo']['poolId'] = 'MUTATED'
+        self.assertEqual(operations.ExtendedJobOperations.expand_template(
+            template, {'jobId': 'third'})['properties']['poolInfo'], {'poolId': 'static-pool'})
+
+        # It should convert blobSource without modifying the expansion
+        converted = utils.convert_blob_source_to_http_url(second)
+        self.assertEqual(converted['commonResourceFiles'],
+                         [{'httpUrl': 'https://a/b', 'filePath': 'b'}])
+        self.assertIs(converted['poolInfo'], second['poolInfo'])
+        self.assertIn('blobSource', second['commonResourceFiles'][0])
+        unchanged = {'poolInfo': {'poolId': 'static-pool'}}
+        self.assertIs(utils.convert_blob_source_to_http_url(unchanged), unchanged)
+
+    def test_batch_extensions_variable_resolution(self):
+        template = {
+            'parameters': {
+                'name': {'type': 'string'},
+                'sizes': {'type': 'object', 'defaultValue': {'small': {'cores': 2}}}
+            },
+            'variables': {
+                'full': "[concat(variables('prefix'), '-', parameters('name'))]",
+                'prefix': "[concat('job', '-', parameters('name'))]",
+                'cores': "[parameters('sizes').small.cores]"
+            },
+            'values': ["[variables('full')]", "[variables('full')]",
+                       "[parameters('sizes').small.cores]", "[variables('cores')]"]
+        }
+        compiled = utils.engine.compile_template(template)
+
+        # It should order variables after the variables they reference
+        order = compiled.variable_order
+        self.assertLess(order.index('prefix'), order.index('full'))
+
+        # It should resolve each parameter and variable only once per expansion
+        with patch.object(utils.ParameterValidator, 'validate', autospec=True,
+                          side_effect=utils.ParameterValidator.validate) as validate:
+            result = compiled.expand({'name': 'a'})
+        self.assertEqual(result['values'], ['job-a-a', 'job-a-a', 2, 2])
+        self.assertEqual(validate.call_count, 1)
+
+        # It should report variables that reference each other up front
+        template['variables']['prefix'] = "[variables('full')]"
+        with self.assertRaises(ValueError) as context:
+            utils.expand_template(template, {'name': 'a'})
+        self.assertIn('cycle', str(context.exception))
+
+    def test_batch_extensions_static_analysis(self):
+        template = {
+            'parameters': {
+                'jobId': {'type': 'string', 'metadata': {'description': 'The job id'}},
+                'poolId': {'type': 'string'},
+                'priority': {'type': 'int', 'defaultValue': 1},
+                'unused': {'type': 'string'}
+            },
+            'variables': {
+                'prefix': "[concat('job', '-', 'a')]",
+                'settings': {'retries': "[concat('', '3')]"},
+                'name': "[concat(variables('prefix'), '-', parameters('jobId'))]"
+            },
+            'job': {
+                'id': "[variables('name')]",
+                'poolInfo': {'poolId': "[parameters('poolId')]"},
+                'priority': "[parameters('priority')]",
+                'constraints': "[variables('settings')]",
+                'displayName': "[concat(variables('prefix'), '-', variables('settings').retries)]"
+            }
+        }
+        compiled = utils.engine.compile_template(template)
+
+        # It should list every referenced parameter without a value in one pass
+        missing = operations.ExtendedJobOperations.missing_parameters(template, {})
+        self.assertEqual(sorted(m.parameter_name for m in missing), ['jobId', 'poolId'])
+        self.assertEqual([m.parameter_description for m in missing
+                          if m.parameter_name == 'jobId'], ['The job id'])
+        self.assertEqual(compiled.missing_parameters({'jobId': 'a', 'poolId': 'b'}), [])
+
+        # It should evaluate the parts that depend on no parameters when compiling
+        self.assertEqual(compiled.constants['prefix'], 'job-a')
+        self.assertNotIn('name', compiled.constants)
+        self.assertTrue(compiled.root.members['job'].members['displayName'].static)
+        self.assertTrue(compiled.root.members['job'].members['constraints'].static)
+        self.assertFalse(compiled.root.members['job'].members['id'].static)
+        result = compiled.expand({'jobId': 'x', 'poolId': 'p'})
+        self.assertEqual(result['job'], {
+            'id': 'job-a-x', 'poolInfo': {'poolId': 'p'}, 'priority': 1,
+            'constraints': {'retries': '3'}, 'displayName': 'job-a-3'})
+        self.assertEqual(result['variables']['settings'], {'retries': '3'})
+
+    def test_batch_extensions_expand_pointer(self):
+        template = {
+            'parameters': {
+                'jobId': {'type': 'string'},
+                'owner': {'type': 'string'}
+            },
+            'variables': {
+                'pool': "[concat('pool-', parameters('jobId'))]",
+                'report': "[concat(parameters('owner'), variables('undefined'))]"
+            },
+            'metadata': {'owner': "[variables('report')]"},
+            'job': {
+                'properties': {
+                    'id': "[parameters('jobId')]",
+                    'poolInfo': {'poolId': "[variables('pool')]"},
+                    'tasks': ['static', "[parameters('jobId')]"],
+                    'a/b': {'c~d': 'escaped'}
+                }
+            }
+        }
+        compiled = utils.engine.compile_template(template)
+
+        # It should only evaluate the part requested and what it references
+        job = compiled.expand({'jobId': 'one'}, pointer='/job')
+        self.assertEqual(job['properties']['poolInfo'], {'poolId': 'pool-one'})
+        self.assertEqual(compiled.expand({'jobId': 'one'}, pointer='/job/properties/tasks/1'), 'one')
+        self.assertEqual(compiled.expand({}, pointer='/job/properties/a~1b/c~0d'), 'escaped')
+        with self.assertRaises(ValueError):
+            compiled.expand({'jobId': 'one'})
+        self.assertEqual(operations.ExtendedJobOperations.expand_template(
+            template, {'jobId': 'one'}), job)
+
+        self.assertEqual(compiled.referenced_parameters('/job'), set(['jobId']))
+        self.assertEqual([m.parameter_name for m in operations.ExtendedJobOperations.
+                          missing_parameters(template, {})], ['jobId'])
+
+        # It should report parts of the template that do not exist
+        with self.assertRaises(KeyError):
+            compiled.expand({}, pointer='/job/properties/tasks/2')
+        with self.assertRaises(ValueError) as context:
+            operations.ExtendedPoolOperations.expand_template(template, {'jobId': 'one'})
+        self.assertIn("'pool'", str(context.exception))
+
+    def test_batch_extensions_expansion_result_cache(self):
+        template = {
+            'parameters': {'jobId': {'type': 'string'}},
+            'job': {'id': "[parameters('jobId')]", 'constraints': {'name': "[parameters('jobId')]"}}
+        }
+        cache = utils.enable_expansion_cache(max_size=2)
+        self.addCleanup(utils.disable_expansion_cache)
+
+        # It should return the cached result for the same template and parameters
+        first = operations.ExtendedJobOperations.expand_template(template, {'jobId': 'a'})
+        second = operations.ExtendedJobOperations.expand_template(template, {'jobId': 'a'})
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+
+        # It should not change the cached result when a returned one is modified
+        second['constraints']['name'] = 'modified'
+        third = operations.ExtendedJobOperations.expand_template(template, {'jobId': 'a'})
+        self.assertEqual(third['constraints'], {'name': 'a'})
+        third['constraints']['name'] = 'modified'
+        self.assertEqual(first['constraints'], {'name': 'a'})
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(utils.expand_template(template, {'jobId': 'a'})['job'], first)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        # It should evict the least recently used result
+        operations.ExtendedJobOperations.expand_template(template, {'jobId': 'b'})
+        self.assertEqual(len(cache), 2)
+        operations.ExtendedJobOperations.expand_template(template, {'jobId': 'a'})
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+        # It should be skipped once disabled
+        utils.disable_expansion_cache()
+        operations.ExtendedJobOperations.expand_template(template, {'jobId': 'b'})
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+    def test_batch_extensions_expand_template_many(self):
+        with open(os.path.join(self.data_dir, 'batch.job.parametricsweep.json'), 'r') as template:
+            template_obj = json.load(template)
+        with open(os.path.join(self.data_dir, 'batch.job.parameters.json'), 'r') as parameter:
+            parameter_obj = json.load(parameter)
+        parameter_sets = []
+        for index in range(6):
+            parameters = dict(parameter_obj)
+            parameters['jobId'] = {'value': 'job{}'.format(index)}
+            parameter_sets.append(parameters)
+
+        # It should yield every job with the index of its parameters
+        results = list(operations.ExtendedJobOperations.expand_template_many(
+            template_obj, parameter_sets, workers=2))
+        self.assertEqual(sorted(i for i, _ in results), list(range(6)))
+        for index, job in results:
+            self.assertEqual(job, operations.ExtendedJobOperations.expand_template(
+                template_obj, parameter_sets[index]))
+            self.assertEqual(job['properties']['id'], 'job{}'.format(index))
+
+        # It should use a template compiled already, such as one from the template file cache
+        compiled = utils.engine.CompiledTemplate(template_obj)
+        with patch.object(utils.engine, 'compile_template') as compile_template:
+            results = list(operations.ExtendedJobOperations.expand_template_many(
+                template_obj, parameter_sets[:2], workers=1, compiled=compiled))
+        self.assertFalse(compile_template.called)
+        self.assertEqual(results[1][1]['properties']['id'], 'job1')
+
+        # It should check every set of parameters before starting any worker process
+        template_obj['parameters']['jobId'].pop('defaultValue', None)
+        with patch.object(utils.engine.multiprocessing, 'Pool') as pool:
+            with self.assertRaises(MissingParameterValue) as context:
+                operations.ExtendedJobOperations.expand_template_many(
+                    template_obj, iter([parameter_sets[0], {k: v for k, v in parameter_obj.items() if k != 'jobId'}]), workers=2)
+            self.assertEqual(context.exception.parameter_name, 'jobId')
+            template_obj['parameters']['jobId']['maxLength'] = 3
+            with self.assertRaises(ValueError) as context:
+                operations.ExtendedJobOperations.expand_template_many(
+                    template_obj, parameter_sets, workers=2)
+            self.assertIn("Maximum length: 3", str(context.exception))
+        self.assertFalse(pool.called)
+
+    def test_batch_extensions_expand_template_to_stream(self):
+        template_path = os.path.join(self.data_dir, 'batch.job.parametricsweep.json')
+        with open(template_path, 'r') as template:
+            template_obj = json.load(template)
+        with open(os.path.join(self.data_dir, 'batch.job.parameters.json'), 'r') as parameter:
+            parameter_obj = json.load(parameter)
+        expected = utils.expand_template(template_obj, parameter_obj)
+
+        # It should produce the same result however the template is split into chunks
+        for chunk_size in [1, 7, 4096]:
+            with open(template_path, 'rb') as template:
+                streamed = utils.engine.StreamedTemplate(template, chunk_size=chunk_size)
+                output = io.StringIO()
+                streamed.expand(output, utils._get_template_params(  # pylint:disable=protected-access
+                    streamed.sections, parameter_obj))
+            self.assertEqual(json.loads(output.getvalue()), expected)
+
+        # It should write only the job element, also from streams that cannot seek
+        source = io.BytesIO(json.dumps(template_obj).encode('utf-8'))
+        source.seekable = lambda: False
+        output = io.StringIO()
+        operations.ExtendedJobOperations.expand_template_to_stream(source, output, parameter_obj)
+        self.assertEqual(json.loads(output.getvalue()), expected['job'])
+
+        # It should skip a byte order mark, in binary and text mode, and read characters
+        # split between chunks
+        content = '\ufeff' + json.dumps({'job': {'id': 'x\u00e9\u4e2d'}}, ensure_ascii=False)
+        for source in [io.BytesIO(content.encode('utf-8')), io.StringIO(content)]:
+            for chunk_size in [1, 4096]:
+                source.seek(0)
+                output = io.StringIO()
+                utils.engine.StreamedTemplate(source, chunk_size=chunk_size).expand(output, member='job')
+                self.assertEqual(json.loads(output.getvalue()), {'id': 'x\u00e9\u4e2d'})
+
+        output = io.StringIO()
+        with self.assertRaises(ValueError):
+            operations.ExtendedPoolOperations.expand_template_to_stream(
+                io.StringIO(json.dumps(template_obj)), output, parameter_obj)
+
+    def test_batch_extensions_copy_loops(self):
+        template = {
+            'parameters': {
+                'count': {'type': 'int', 'defaultValue': 3},
+                'names': {'type': 'object', 'defaultValue': ['a', 'b', 'c']}
+            },
+            'job': {
+                'type': 'Microsoft.Batch/batchAccounts/jobs',
+                'properties': {
+                    'id': 'copyjob',
+                    'poolInfo': {'poolId': 'pool'},
+                    'taskFactory': {
+                        'type': 'taskCollection',
+                        'copy': [{
+                            'name': 'tasks',
+                            'count': "[parameters('count')]",
+                            'input': {
+                                'id': "[concat('task', copyIndex(1))]",
+                                'commandLine': "[concat('echo ', parameters('names')[copyIndex()])]"
+                            }
+                        }]
+                    }
+                }
+            }
+        }
+        expanded = utils.expand_template(template, {})
+        tasks = expanded['job']['properties']['taskFactory']['tasks']
+        self.assertEqual([t['id'] for t in tasks], ['task1', 'task2', 'task3'])
+        self.assertEqual([t['commandLine'] for t in tasks], ['echo a', 'echo b', 'echo c'])
+        self.assertNotIn('copy', expanded['job']['properties']['taskFactory'])
+
+        # Lazily expanded tasks are only generated when the task factory is expanded
+        job_json = operations.ExtendedJobOperations.expand_template(
+            template, {'count': 1000}, lazy=True)
+        loop = job_json['properties']['taskFactory']['tasks']
+        self.assertIsInstance(loop, utils.engine.CopyLoop)
+        self.assertEqual(len(loop), 1000)
+        with self.assertRaises(ValueError):
+            loop[999]  # pylint: disable=pointless-statement
+        job = operations.ExtendedJobOperations.jobparameter_from_json(job_json['properties'])
+        utils.validate_json_object(job_json['properties'], job)
+        self.assertIsInstance(job.task_factory.tasks, utils.LazyTaskCollection)
+        job_json = operations.ExtendedJobOperations.expand_template(template, {}, lazy=True)
+        job = operations.ExtendedJobOperations.jobparameter_from_json(job_json).properties
+        tasks = utils.expand_task_factory(job, None)
+        self.assertEqual([t.id for t in tasks], ['task1', 'task2', 'task3'])
+        self.assertIsInstance(tasks[0], models.ExtendedTaskParameter)
+
+        # Nested loops and named loops
+        template = {'a': {'copy': [{'name': 'rows', 'count': 2, 'input': {'copy': [
+            {'name': 'cells', 'count': 2, 'input': "[concat(copyIndex('rows'), copyIndex())]"}]}}]}}
+        self.assertEqual(utils.expand_template(template),
+                         {'a': {'rows': [{'cells': ['00', '01']}, {'cells': ['10', '11']}]}})
+        with self.assertRaises(ValueError):
+            utils.expand_template({'a': "[copyIndex()]"})
+        with self.assertRaises(ValueError):
+            utils.expand_template({'a': {'copy': [{'name': 'b', 'count': -1, 'input': 1}]}})
+
+    def test_batch_extensions_expansion_session(self):
+        template = {
+            'parameters': {
+                'jobId': {'type': 'string'},
+                'poolId': {'type': 'string'},
+                'settings': {'type': 'object', 'defaultValue': {'retries': 2}}
+            },
+            'variables': {
+                'pool': "[concat('pool-', parameters('poolId'))]"
+            },
+            'job': {
+                'properties': {
+                    'id': "[parameters('jobId')]",
+                    'poolInfo': {'poolId': "[variables('pool')]"},
+                    'constraints': "[parameters('settings')]",
+                    'displayName': "[concat(parameters('jobId'), '@', variables('pool'))]"
+                }
+            }
+        }
+        session = operations.ExtendedJobOperations.expansion_session(template)
+
+        # It should reuse values resolved before a missing parameter was reported
+        with self.assertRaises(MissingParameterValue):
+            operations.ExtendedJobOperations.expand_template(template, {'poolId': 'a'},
+                                                             session=session)
+        first = operations.ExtendedJobOperations.expand_template(
+            template, {'poolId': 'a', 'jobId': 'one'}, session=session)
+        self.assertEqual(first['properties']['poolInfo'], {'poolId': 'pool-a'})
+        self.assertEqual(first['properties']['displayName'], 'one@pool-a')
+
+        # It should only re-evaluate the parts affected by the changed parameter
+        second = operations.ExtendedJobOperations.expand_template(
+            template, {'poolId': 'a', 'jobId': 'two'}, session=session)
+        self.assertEqual(second['properties']['id'], 'two')
+        self.assertEqual(second['properties']['displayName'], 'two@pool-a')
+        self.assertIs(second['properties']['poolInfo'], first['properties']['poolInfo'])
+        self.assertIs(second['properties']['constraints'], first['properties']['constraints'])
+        self.assertIsNot(second['properties'], first['properties'])
+
+        # Changes reaching a site through a variable should be re-evaluated too
+        third = operations.ExtendedJobOperations.expand_template(
+            template, {'poolId': 'b', 'jobId': 'two'}, session=session)
+        self.assertEqual(third['properties']['poolInfo'], {'poolId': 'pool-b'})
+        self.assertEqual(third['properties']['displayName'], 'two@pool-b')
+        self.assertEqual(third, operations.ExtendedJobOperations.expand_template(
+            template, {'poolId': 'b', 'jobId': 'two'}))
+
+    def test_batch_extensions_template_file_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        template_path = os.path.join(cache_dir, 'template.json')
+        with open(template_path, 'w') as template_file:
+            json.dump({'parameters': {'name': {'type': 'string'}},
+                       'pool': {'id': "[parameters('name')]"}}, template_file)
+        cache = utils.template_cache.TemplateFileCache(os.path.join(cache_dir, 'cache'))
+
+        # It should compile the template once and then reuse the cached form
+        template, compiled = cache.load(template_path)
+        self.assertEqual(compiled.expand({'name': 'a'})['pool'], {'id': 'a'})
+        with patch('azext.batch._template_engine.compile_value') as compile_value:
+            template, compiled = cache.load(template_path)
+            os.utime(template_path, (0, 0))
+            cache.load(template_path)
+        self.assertFalse(compile_value.called)
+        session = operations.ExtendedPoolOperations.expansion_session(template, compiled)
+        self.assertEqual(operations.ExtendedPoolOperations.expand_template(
+            template, {'name': 'b'}, session), {'id': 'b'})
+
+        # It should compile the template again when its content changes
+        with open(template_path, 'w') as template_file:
+            json.dump({'pool': {'id': 'static'}}, template_file)
+        _, compiled = operations.ExtendedPoolOperations.load_template_file(
+            template_path, cache.directory)
+        self.assertEqual(compiled.expand()['pool'], {'id': 'static'})
+
+        # It should compile the template again after the package is upgraded
+        entry_path = os.path.join(cache.directory, utils.template_cache._entry_name(  # pylint:disable=protected-access
+            template_path))
+        with patch.object(utils.template_cache, '_FORMAT_VERSION', (4, '999.0.0')):
+            self.assertIsNone(cache._read(entry_path))  # pylint:disable=protected-access
+            cache.load(template_path)
+            self.assertEqual(cache._read(entry_path)['version'], (4, '999.0.0'))  # pylint:disable=protected-access
+
+        # It should create the cache accessible only to the current user, and ignore
+        # entries that anyone else could have written
+        if hasattr(os, 'getuid'):
+            self.assertEqual(os.stat(cache.directory).st_mode & 0o777, 0o700)
+            cache.load(template_path)
+            for directory_mode, entry_mode in [(0o770, 0o600), (0o700, 0o666)]:
+                os.chmod(cache.directory, directory_mode)
+                os.chmod(entry_path, entry_mode)
+                with patch('azext.batch._template_engine.compile_value',
+                           wraps=utils.engine.compile_value) as compile_value:
+                    _, compiled = cache.load(template_path)
+                self.assertTrue(compile_value.called)
+                self.assertEqual(compiled.expand()['pool'], {'id': 'static'})
+            os.chmod(cache.directory, 0o700)
+            os.chmod(entry_path, 0o600)
+            with patch('azext.batch._template_engine.compile_value') as compile_value:
+                cache.load(template_path)
+            self.assertFalse(compile_value.called)
+
+        # It should evict the least recently used entries beyond its size
+        other_path = os.path.join(cache_dir, 'other.json')
+        shutil.copy(template_path, other_path)
+        cache.max_size = 1
+        cache.load(other_path)
+        self.assertEqual(len(os.listdir(cache.directory)), 0)
+
     def test_batch_extensions_replace_parametric_sweep_command(self):
         test_input = Mock(value="cmd {{{0}}}.mp3 {1}.mp3")
         utils._replacement_transform(utils._transform_sweep_str,  # pylint:disable=protected-access
@@ -311,6 +803,20 @@ class TestBatchExtensions(unittest.TestCase):
             "-sOutputFile=5-%03d.png -r250 5.pdf && for f in *.png; do tesseract "
             "$f ${f%.*};done")
 
+    def test_batch_extensions_placeholder_format(self):
+        string_format = utils._PlaceholderFormat(  # pylint:disable=protected-access
+            "cmd {{{0:3}}} {1}.mp3 }}{{", utils._SweepPlaceholder)  # pylint:disable=protected-access
+        self.assertEqual(len(string_format.segments), 5)
+        self.assertEqual(string_format.format([7, 10]), 'cmd {007} 10.mp3 }{')
+        self.assertEqual(string_format.format([42, -1]), 'cmd {042} -1.mp3 }{')
+        with self.assertRaises(ValueError):
+            string_format.format([7])
+        with self.assertRaises(ValueError):
+            utils._PlaceholderFormat("cmd {0:10}", utils._SweepPlaceholder)  # pylint:disable=protected-access
+        string_format = utils._PlaceholderFormat(  # pylint:disable=protected-access
+            "{fileName} {{url}}", utils._FilePlaceholder)  # pylint:disable=protected-access
+        self.assertEqual(string_format.format({'fileName': 'a.txt'}), 'a.txt {url}')
+
     def test_batch_extensions_replace_invalid_parametric_sweep(self):
 
         test_input = Mock(value="cmd {0}.mp3 {2}.mp3")
@@ -582,6 +1088,378 @@ class TestBatchExtensions(unittest.TestCase):
         self.assertEqual(result[-1].depends_on.task_id_ranges[0].start, 0)
         self.assertEqual(result[-1].depends_on.task_id_ranges[0].end, 2)
 
+    def test_batch_extensions_streamed_parametricsweep(self):
+        factory = models.ParametricSweepTaskFactory(
+            parameter_sets=[models.ParameterSet(start=1, end=50), models.ParameterSet(start=0, end=8, step=2)],
+            repeat_task=models.RepeatTask(command_line="/bin/bash -c 'cmd {0} {1}'"),
+            merge_task=models.MergeTask(command_line="/bin/bash -c summary"))
+        tasks = utils._expand_parametric_sweep(factory)  # pylint: disable=protected-access
+        self.assertEqual(len(tasks), 251)
+        self.assertEqual(tasks[7].command_line, "/bin/bash -c 'cmd 2 4'")
+        self.assertEqual(tasks[-2].id, '249')
+        self.assertEqual(tasks[-1].depends_on.task_id_ranges[0].end, 249)
+        self.assertEqual([t.command_line for t in tasks], [t.command_line for t in tasks[:]])
+
+        # It should submit the tasks a window of requests at a time
+        parent = Mock()
+        parent.task.add_collection.side_effect = lambda job_id, chunk, *_: TaskAddCollectionResult(
+            value=[TaskAddResult(status=TaskAddStatus.success, task_id=t.id) for t in chunk])
+        job_ops = operations.ExtendedJobOperations(
+            parent, Mock(), Mock(), self._serialize, self._deserialize, None)
+        job = models.ExtendedJobParameter(
+            id='sweep', pool_info=models.PoolInformation(pool_id='pool'), task_factory=factory)
+        with patch('azure.batch.operations._job_operations.JobOperations.add'):
+            result = job_ops.add(job, threads=2)
+        chunks = [c[0][1] for c in parent.task.add_collection.call_args_list]
+        self.assertEqual([len(c) for c in chunks], [200, 51])
+        self.assertEqual(chunks[1][-1].id, 'merge')
+        self.assertEqual(len(result.value), 251)
+        self.assertTrue(job.uses_task_dependencies)
+
+    def test_batch_extensions_repeat_task_skeleton(self):
+        repeat_task = models.RepeatTask(
+            command_line="cmd {0}",
+            resource_files=[models.ExtendedResourceFile(http_url="http://account.blob/{0}.dat", file_path="in")],
+            environment_settings=[models.EnvironmentSetting(name='NAME', value='value')],
+            constraints=models.TaskConstraints(max_task_retry_count=1),
+            output_files=[models.OutputFile(
+                file_pattern="*.txt",
+                destination=models.ExtendedOutputFileDestination(
+                    auto_storage=models.OutputFileAutoStorageDestination(file_group='outputs')),
+                upload_options=models.OutputFileUploadOptions(upload_condition='taskSuccess'))])
+        skeleton = utils._TaskSkeleton(repeat_task, utils._SweepPlaceholder)  # pylint: disable=protected-access
+        first, second = skeleton.render((1,), 0), skeleton.render((2,), 1)
+        self.assertEqual((first.id, first.command_line), ('0', 'cmd 1'))
+        self.assertEqual(second.resource_files[0].http_url, 'http://account.blob/2.dat')
+        self.assertEqual(repeat_task.resource_files[0].http_url, 'http://account.blob/{0}.dat')
+
+        # Attributes without placeholders should be shared, the rest copied
+        self.assertIs(first.environment_settings, repeat_task.environment_settings)
+        self.assertIs(first.constraints, second.constraints)
+        self.assertIsNot(first.output_files[0].destination, second.output_files[0].destination)
+        self.assertIsNot(first.output_files[0].destination.auto_storage,
+                         repeat_task.output_files[0].destination.auto_storage)
+
+    def test_batch_extensions_sharded_parametricsweep(self):
+        factory = models.ParametricSweepTaskFactory(
+            parameter_sets=[models.ParameterSet(start=1, end=30), models.ParameterSet(start=9, end=0, step=-3)],
+            repeat_task=models.RepeatTask(command_line="/bin/bash -c 'cmd {0} {1}'"),
+            merge_task=models.MergeTask(command_line="/bin/bash -c summary"))
+        expected = [(t.id, t.command_line) for t in utils._expand_parametric_sweep(factory)]  # pylint: disable=protected-access
+        self.assertEqual(expected[5], ('5', "/bin/bash -c 'cmd 2 6'"))
+
+        # Shards should hold every task once, with the same IDs, with and without NumPy
+        for vectorized in (utils.numpy, None):
+            with patch.object(utils, 'numpy', vectorized):
+                tasks = utils._expand_parametric_sweep(factory)  # pylint: disable=protected-access
+                shards = [utils.shard_tasks(tasks, k, 3) for k in range(3)]
+                self.assertEqual([(t.id, t.command_line) for s in shards for t in s], expected)
+                self.assertEqual(shards[1][0].id, str(len(shards[0])))
+                self.assertEqual(shards[2][-1].id, 'merge')
+        self.assertEqual(utils.shard_tasks(['a', 'b', 'c', 'd'], 1, 2), ['c', 'd'])
+        with self.assertRaises(ValueError):
+            utils.shard_tasks(tasks, 3, 3)
+
+        # A shard should be submitted to a job created by another shard
+        parent = Mock()
+        parent.task.add_collection.side_effect = lambda job_id, chunk, *_: TaskAddCollectionResult(
+            value=[TaskAddResult(status=TaskAddStatus.success, task_id=t.id) for t in chunk])
+        job_ops = operations.ExtendedJobOperations(
+            parent, Mock(), Mock(), self._serialize, self._deserialize, None)
+        job = models.ExtendedJobParameter(
+            id='sweep', pool_info=models.PoolInformation(pool_id='pool'), task_factory=factory)
+        error = BatchErrorException(Mock(), Mock(status_code=409))
+        error.error = BatchError(code='JobExists')
+        with patch('azure.batch.operations._job_operations.JobOperations.add', side_effect=error):
+            result = job_ops.add(job, shard=(0, 3))
+        self.assertEqual([r.task_id for r in result.value], [t[0] for t in expected[:40]])
+        job.task_factory = factory
+        job.on_all_tasks_complete = 'terminateJob'
+        with self.assertRaises(ValueError):
+            job_ops.add(job, shard=(0, 3))
+
+    def test_batch_extensions_merge_task_fan_in(self):
+        factory = models.ParametricSweepTaskFactory(
+            parameter_sets=[models.ParameterSet(start=1, end=10)],
+            repeat_task=models.RepeatTask(command_line="cmd {0}"),
+            merge_task=models.MergeTask(command_line="merge", fan_in=3))
+        tasks = list(utils._expand_parametric_sweep(factory))  # pylint: disable=protected-access
+        merges = [(t.id, t.depends_on.task_id_ranges[0].start, t.depends_on.task_id_ranges[0].end,
+                   {e.name: e.value for e in t.environment_settings}['BATCH_MERGE_LEVEL'])
+                  for t in tasks[10:]]
+        self.assertEqual(merges, [('10', 0, 2, '1'), ('11', 3, 5, '1'), ('12', 6, 8, '1'),
+                                  ('13', 9, 9, '1'), ('14', 10, 12, '2'), ('15', 13, 13, '2'),
+                                  ('merge', 14, 15, '3')])
+        self.assertEqual(tasks[-1].environment_settings[2].value, '15')
+        self.assertFalse(hasattr(tasks[-1], 'fan_in'))
+        self.assertEqual(utils._expand_parametric_sweep(factory).sample()[-1].id, 'merge')  # pylint: disable=protected-access
+
+        # A merge task with no more dependencies than its fan-in should be unchanged
+        fileutils = Mock(iter_container_list=Mock(return_value=[
+            {'url': 'http://account.blob/data/{}.txt'.format(i), 'filePath': '{}.txt'.format(i),
+             'fileName': '{}.txt'.format(i), 'fileNameWithoutExtension': str(i)} for i in range(3)]))
+        factory = models.FileCollectionTaskFactory(
+            source=models.FileSource(file_group='data'),
+            repeat_task=models.RepeatTask(command_line="cmd {fileName}"),
+            merge_task=models.MergeTask(command_line="merge", fan_in=3))
+        tasks = list(utils._expand_task_per_file(factory, fileutils))  # pylint: disable=protected-access
+        self.assertEqual([t.id for t in tasks], ['0', '1', '2', 'merge'])
+        self.assertEqual(tasks[-1].depends_on.task_id_ranges[0].end, 2)
+
+        factory.merge_task.fan_in = 1
+        with self.assertRaises(ValueError):
+            utils._expand_task_per_file(factory, fileutils)  # pylint: disable=protected-access
+
+    def test_batch_extensions_streamed_taskperfile(self):
+        Blob = collections.namedtuple('Blob', 'name properties')
+        listed = threading.Event()
+
+        def list_blobs(container, prefix=None):
+            self.assertEqual((container, prefix), ('fgrp-data', 'in/'))
+            for i in range(250):
+                if i == 5:
+                    # Later pages of the listing should not hold up the first tasks
+                    listed.wait(5)
+                yield Blob('in/{}.txt'.format(i), Mock(content_length=i))
+        blob_service = Mock(list_blobs=list_blobs, make_blob_url=lambda c, b, sas_token: b)
+        factory = models.FileCollectionTaskFactory(
+            source=models.FileSource(file_group='data', prefix='in/'),
+            repeat_task=models.RepeatTask(command_line="cmd {fileName}"),
+            merge_task=models.MergeTask(command_line="merge"))
+        tasks = utils.expand_task_factory(
+            Mock(task_factory=factory), file_utils.FileUtils(lambda: blob_service))
+        sample = tasks.sample()
+        self.assertEqual([(t.id, t.command_line) for t in sample], [('0', 'cmd 0.txt'), ('merge', 'merge')])
+        self.assertFalse(listed.is_set())
+        listed.set()
+
+        parent = Mock()
+        parent.task.add_collection.side_effect = lambda job_id, chunk, *_: TaskAddCollectionResult(
+            value=[TaskAddResult(status=TaskAddStatus.success, task_id=t.id) for t in chunk])
+        job_ops = operations.ExtendedJobOperations(
+            parent, Mock(), Mock(), self._serialize, self._deserialize, None)
+        result = job_ops._add_streamed_tasks(  # pylint: disable=protected-access
+            'job', tasks, None, pool_utils.PoolOperatingSystemFlavor.LINUX, False, 2)
+        chunks = [c[0][1] for c in parent.task.add_collection.call_args_list]
+        self.assertEqual([len(c) for c in chunks], [200, 51])
+        self.assertIn('cmd 0.txt', chunks[0][0].command_line)
+        self.assertIn('cmd 249.txt', chunks[1][-2].command_line)
+        self.assertEqual(chunks[1][-1].depends_on.task_id_ranges[0].end, 249)
+        self.assertEqual(len(result.value), 251)
+
+        # Errors while listing should be raised to the consumer
+        def failing_list_blobs(*_, **__):
+            yield Blob('in/0.txt', Mock(content_length=0))
+            raise ValueError('listing failed')
+        blob_service.list_blobs = failing_list_blobs
+        tasks = utils.expand_task_factory(
+            Mock(task_factory=factory), file_utils.FileUtils(lambda: blob_service))
+        with self.assertRaises(ValueError):
+            list(tasks)
+
+    def test_batch_extensions_file_manifest(self):
+        Blob = collections.namedtuple('Blob', 'name properties')
+        blobs = [Blob(n, Mock(etag=e)) for n, e in [('a.txt', '1'), ('b.txt', '1'), ('c.txt', '1')]]
+        blob_service = Mock(list_blobs=lambda container, prefix=None: iter(blobs),
+                            make_blob_url=lambda c, b, sas_token: b)
+        parent = Mock()
+        parent.task.add_collection.side_effect = lambda job_id, chunk, *_: TaskAddCollectionResult(
+            value=[TaskAddResult(status=TaskAddStatus.success, task_id=t.id) for t in chunk])
+        parent.pool.get.return_value = models.CloudPool(id='pool')
+        job_ops = operations.ExtendedJobOperations(
+            parent, Mock(), Mock(), self._serialize, self._deserialize, lambda: blob_service)
+
+        def new_job():
+            return models.ExtendedJobParameter(
+                id='files', pool_info=models.PoolInformation(pool_id='pool'),
+                task_factory=models.FileCollectionTaskFactory(
+                    source=models.FileSource(file_group='data'),
+                    repeat_task=models.RepeatTask(command_line="cmd {fileName}")))
+        error = BatchErrorException(Mock(), Mock(status_code=409))
+        error.error = BatchError(code='JobExists')
+        manifest_path = os.path.join(tempfile.mkdtemp(), 'manifest.json')
+        try:
+            with patch('azure.batch.operations._job_operations.JobOperations.add'):
+                result = job_ops.add(new_job(), manifest=manifest_path)
+            self.assertEqual([r.task_id for r in result.value], ['0', '1', '2'])
+
+            # Only new and changed files should get tasks, added to the existing job
+            blobs[1] = Blob('b.txt', Mock(etag='2'))
+            blobs.append(Blob('d.txt', Mock(etag='1')))
+            with patch('azure.batch.operations._job_operations.JobOperations.add', side_effect=error):
+                result = job_ops.add(new_job(), manifest=manifest_path)
+                self.assertEqual([r.task_id for r in result.value], ['3', '4'])
+                tasks = parent.task.add_collection.call_args[0][1]
+                self.assertIn('cmd d.txt', tasks[1].command_line)
+                with open(manifest_path) as manifest_file:
+                    self.assertEqual(json.load(manifest_file),
+                                     {'nextTaskId': 5, 'files': {'a.txt': '1', 'b.txt': '2',
+                                                                 'c.txt': '1', 'd.txt': '1'}})
+
+                # Watching should only add tasks for files landing between listings
+                def list_blobs(container, prefix=None):
+                    blobs.append(Blob('{}.txt'.format(len(blobs)), Mock(etag='1')))
+                    return iter(blobs)
+                blob_service.list_blobs = list_blobs
+                result = job_ops.watch(new_job(), manifest_path, interval=0, polls=2)
+                self.assertEqual([r.task_id for r in result.value], ['5', '6'])
+                self.assertEqual(file_utils.FileManifest(manifest_path).next_task_id, 7)
+                job = new_job()
+                job.task_factory.merge_task = models.MergeTask(command_line='merge')
+                with self.assertRaises(ValueError):
+                    job_ops.watch(job, manifest_path, polls=1)
+                with self.assertRaises(ValueError) as context:
+                    job_ops.add(job, manifest=manifest_path)
+                self.assertIn('merge task', str(context.exception))
+                self.assertEqual(file_utils.FileManifest(manifest_path).next_task_id, 7)
+        finally:
+            shutil.rmtree(os.path.dirname(manifest_path))
+
+    def test_batch_extensions_file_batches(self):
+        sizes = [5, 70, 20, 45, 100, 30, 150, 10]
+        files = [{'url': 'http://account.blob/data/{}.txt'.format(i), 'filePath': 'data/{}.txt'.format(i),
+                  'fileName': '{}.txt'.format(i), 'fileNameWithoutExtension': str(i), 'contentLength': size}
+                 for i, size in enumerate(sizes)]
+        factory = models.FileBatchTaskFactory(
+            source=models.FileSource(file_group='data'),
+            repeat_task=models.RepeatTask(
+                command_line="process {fileCount} {fileNames}",
+                resource_files=[
+                    models.ExtendedResourceFile(http_url="{url}", file_path="in/{fileName}"),
+                    models.ExtendedResourceFile(http_url="http://account.blob/tool", file_path="tool")]),
+            max_files=3)
+        fileutils = Mock(iter_container_list=Mock(return_value=files))
+        tasks = list(utils.expand_task_factory(Mock(task_factory=factory), fileutils))
+        self.assertEqual([t.command_line for t in tasks],
+                         ['process 3 0.txt 1.txt 2.txt', 'process 3 3.txt 4.txt 5.txt', 'process 2 6.txt 7.txt'])
+        self.assertEqual([(r.http_url, r.file_path) for r in tasks[2].resource_files],
+                         [('http://account.blob/tool', 'tool'), ('http://account.blob/data/6.txt', 'in/6.txt'),
+                          ('http://account.blob/data/7.txt', 'in/7.txt')])
+        self.assertEqual(factory.repeat_task.resource_files[0].http_url, '{url}')
+
+        # Packing by size should fill batches largest file first, oversized files alone
+        batches = utils._pack_files(files, 150, 3)  # pylint: disable=protected-access
+        self.assertEqual([[f['contentLength'] for f in b] for b in batches], [[150], [100, 30, 10], [70, 45, 20], [5]])
+        self.assertEqual(sorted(f['fileName'] for b in batches for f in b), sorted(f['fileName'] for f in files))
+        factory.max_bytes = 150
+        factory.merge_task = models.MergeTask(command_line='merge')
+        fileutils.iter_container_list.return_value = files
+        tasks = list(utils.expand_task_factory(Mock(task_factory=factory), fileutils))
+        self.assertEqual(tasks[0].command_line, 'process 1 6.txt')
+        self.assertEqual((tasks[-1].id, tasks[-1].depends_on.task_id_ranges[0].end), ('merge', 3))
+
+        factory.max_files = factory.max_bytes = None
+        with self.assertRaises(ValueError):
+            utils.expand_task_factory(Mock(task_factory=factory), fileutils)
+
+    def test_batch_extensions_task_order(self):
+        factory = models.ParametricSweepTaskFactory(
+            parameter_sets=[models.ParameterSet(start=1, end=40), models.ParameterSet(start=1, end=3)],
+            repeat_task=models.RepeatTask(command_line="cmd {0} {1}"),
+            merge_task=models.MergeTask(command_line="merge"),
+            cost="({0} % 10) * {1}")
+        expected = sorted([(a, b) for a in range(1, 41) for b in range(1, 4)], key=lambda v: -(v[0] % 10) * v[1])
+        # The costliest tasks should come first, with the same order with and without NumPy
+        for vectorized in (utils.numpy, None):
+            with patch.object(utils, 'numpy', vectorized):
+                tasks = list(utils._expand_parametric_sweep(factory))  # pylint: disable=protected-access
+                self.assertEqual([t.command_line for t in tasks[:-1]], ['cmd {} {}'.format(*v) for v in expected])
+                self.assertEqual([t.id for t in tasks[:3]], ['0', '1', '2'])
+                self.assertEqual(tasks[-1].depends_on.task_id_ranges[0].end, 119)
+        for cost in ["{0} +", "__import__('os')", "{2} * 2", "'a'"]:
+            factory.cost = cost
+            with self.assertRaises(ValueError):
+                utils._expand_parametric_sweep(factory)  # pylint: disable=protected-access
+        # Costs that are not finite numbers should raise the same error with and without NumPy
+        for cost in ["1 / ({0} - 7)", "(-{1}) ** 0.5", "{0} ** 400", "10 ** 400 * {0}", "(1 / 0) * {0}"]:
+            factory.cost = cost
+            messages = set()
+            for vectorized in (utils.numpy, None):
+                with patch.object(utils, 'numpy', vectorized):
+                    with self.assertRaises(ValueError) as context:
+                        utils._expand_parametric_sweep(factory)  # pylint: disable=protected-access
+                    messages.add(str(context.exception))
+            self.assertEqual(len(messages), 1, messages)
+            self.assertIn("is not a finite number for the parameter values", messages.pop())
+        factory.cost = "1 / ({0} - 7)"
+        with self.assertRaises(ValueError) as context:
+            utils._expand_parametric_sweep(factory)  # pylint: disable=protected-access
+        self.assertIn("parameter values 7, 1.", str(context.exception))
+
+        # It should name the same task when evaluating the costs of all tasks at once fails
+        def evaluate(cost, values):
+            if any(isinstance(v, utils.numpy.ndarray) for v in values):
+                raise TypeError('unsupported operand')
+            return original(cost, values)
+        original = utils._CostExpression.evaluate  # pylint: disable=protected-access
+        factory.cost = "1 / ({0} - 30)"
+        self.assertGreaterEqual(120, utils._VECTORIZED_SWEEP_SIZE)  # pylint: disable=protected-access
+        with patch.object(utils._CostExpression, 'evaluate', evaluate):  # pylint: disable=protected-access
+            with self.assertRaises(ValueError) as context:
+                utils._expand_parametric_sweep(factory)  # pylint: disable=protected-access
+        self.assertIn("parameter values 30, 1.", str(context.exception))
+
+        files = [{'url': 'http://account.blob/data/{}.txt'.format(i), 'filePath': 'data/{}.txt'.format(i),
+                  'fileName': '{}.txt'.format(i), 'fileNameWithoutExtension': str(i), 'contentLength': size}
+                 for i, size in enumerate([5, 70, 5, 100])]
+        factory = models.FileCollectionTaskFactory(
+            source=models.FileSource(file_group='data'),
+            repeat_task=models.RepeatTask(command_line="cmd {fileName}"),
+            order='largestFirst')
+        fileutils = Mock(iter_container_list=Mock(return_value=files))
+        tasks = list(utils.expand_task_factory(Mock(task_factory=factory), fileutils))
+        self.assertEqual([(t.id, t.command_line) for t in tasks],
+                         [('0', 'cmd 3.txt'), ('1', 'cmd 1.txt'), ('2', 'cmd 0.txt'), ('3', 'cmd 2.txt')])
+        factory = models.FileBatchTaskFactory(
+            source=models.FileSource(file_group='data'),
+            repeat_task=models.RepeatTask(command_line="cmd {fileNames}"),
+            max_files=2, order='largestFirst')
+        tasks = list(utils.expand_task_factory(Mock(task_factory=factory), fileutils))
+        self.assertEqual([t.command_line for t in tasks], ['cmd 2.txt 3.txt', 'cmd 0.txt 1.txt'])
+        factory.order = 'smallestFirst'
+        with self.assertRaises(ValueError):
+            utils.expand_task_factory(Mock(task_factory=factory), fileutils)
+
+    def test_batch_extensions_task_dependencies(self):
+        def task(task_id, *depends_on, **kwargs):
+            return models.TaskAddParameter(
+                id=task_id, command_line='cmd',
+                depends_on=models.TaskDependencies(task_ids=list(depends_on), **kwargs))
+        tasks = [task(str(i)) for i in range(10)]
+        tasks.append(task('merge', 'a', '9', '1', '2', '3', '5', '6', '7', '07', '2'))
+        tasks.append(task('a', '0'))
+        tasks.append(task('07'))
+        utils.process_task_dependencies(tasks)
+        depends_on = tasks[10].depends_on
+        self.assertEqual(depends_on.task_ids, ['a', '07', '9'])
+        self.assertEqual([(r.start, r.end) for r in depends_on.task_id_ranges],
+                         [(1, 3), (5, 7)])
+        self.assertEqual(tasks[11].depends_on.task_ids, ['0'])
+        self.assertIsNone(tasks[11].depends_on.task_id_ranges)
+
+        tasks.append(task('b', '10', 'missing'))
+        with self.assertRaises(ValueError) as context:
+            utils.validate_task_dependencies(tasks)
+        self.assertIn("'b' depends on '10', 'b' depends on 'missing'", str(context.exception))
+        tasks[-1] = task('b', 'merge')
+        tasks[1] = task('1', 'b')
+        with self.assertRaises(ValueError) as context:
+            utils.validate_task_dependencies(tasks)
+        self.assertIn("cycle: 1 -> b -> merge -> 1", str(context.exception))
+        tasks[1] = task('1', task_id_ranges=[models.TaskIdRange(start=1, end=1)])
+        with self.assertRaises(ValueError) as context:
+            utils.validate_task_dependencies(tasks)
+        self.assertIn("cycle: 1 -> 1", str(context.exception))
+        tasks[1] = task('1', task_id_ranges=[models.TaskIdRange(start=4, end=1000000)])
+        tasks[8] = task('8', '1')
+        with self.assertRaises(ValueError) as context:
+            utils.validate_task_dependencies(tasks)
+        self.assertIn("cycle: 1 -> 8 -> 1", str(context.exception))
+        tasks[1] = task('a')
+        with self.assertRaises(ValueError) as context:
+            utils.validate_task_dependencies(tasks)
+        self.assertIn("'a' is used by more than one task", str(context.exception))
+
     def test_batch_extensions_parse_invalid_parametricsweep(self):
 
         with self.assertRaises(ValueError):
@@ -721,6 +1599,32 @@ class TestBatchExtensions(unittest.TestCase):
         with self.assertRaises(TypeError):
             utils._validate_parameter('d', content['d'], 3)
 
+    def test_batch_extensions_parameter_validator(self):
+        validator = utils.ParameterValidator('size', {
+            'type': 'string', 'minLength': 2, 'allowedValues': ['small', 'large']})
+        self.assertEqual(validator.allowed_set, frozenset(['small', 'large']))
+        self.assertEqual(validator.min_length, 2)
+        self.assertEqual(validator.validate('large'), 'large')
+        with self.assertRaises(ValueError):
+            validator.validate('medium')
+
+        # It should compile each parameter of a template once and reuse it
+        template = {'parameters': {'count': {'type': 'int', 'maxValue': 5}},
+                    'value': "[parameters('count')]"}
+        compiled = utils.engine.compile_template(template)
+        self.assertEqual(compiled.expand({'count': '4'})['value'], 4)
+        self.assertIs(compiled.validator('count', template['parameters']['count']),
+                      compiled.validators['count'])
+        with self.assertRaises(ValueError):
+            compiled.expand({'count': 6})
+
+        # It should check allowed values that cannot be hashed
+        validator = utils.ParameterValidator('o', {'type': 'object', 'allowedValues': [{'a': 1}]})
+        self.assertIsNone(validator.allowed_set)
+        self.assertEqual(validator.validate({'a': 1}), {'a': 1})
+        with self.assertRaises(ValueError):
+            validator.validate({'a': 2})
+
     def test_batch_extensions_simple_linux_package_manager(self):
         pool = models.ExtendedPoolParameter(
             id="testpool",
@@ -1237,6 +2141,48 @@ class TestBatchExtensions(unittest.TestCase):
         self.assertIn('az_batch:property', ve.exception.args[0],
                       'Expect metadata \'az_batch:property\' to be mentioned')
 
+    def test_batch_extensions_application_template_registry(self):
+        template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, template_dir)
+        template_path = os.path.join(template_dir, 'apptemplate.json')
+        shutil.copy(self.apptemplate_with_params_path, template_path)
+        registry = utils.ApplicationTemplateRegistry()
+
+        def expand():
+            job = models.ExtendedJobParameter(id="parameterJob", pool_info=None,
+                application_template_info=models.ApplicationTemplateInfo(
+                    file_path=template_path,
+                    parameters={'blobName': "music.mp3", 'keyValue': "yale"}))
+            utils.expand_application_template(job, self._deserialize, registry)
+            return job
+
+        # It should load and compile each template once for every job
+        template = registry.get(template_path)
+        with patch('azext.batch._template_utils.ApplicationTemplate') as load:
+            job = expand()
+            os.utime(template_path, (0, 0))
+            expand()
+        self.assertFalse(load.called)
+        self.assertIs(registry.get(template_path), template)
+        self.assertEqual(job.job_manager_task.resource_files[1].file_path, 'music.mp3')
+        self.assertEqual(len(registry), 1)
+
+        # It should load the template again when its content changes
+        with open(template_path, 'r') as template_file:
+            template_json = json.load(template_file)
+        template_json['jobManagerTask']['displayName'] = 'changed'
+        with open(template_path, 'w') as template_file:
+            json.dump(template_json, template_file)
+        self.assertIsNot(registry.get(template_path), template)
+        self.assertEqual(expand().job_manager_task.display_name, 'changed')
+
+        # It should validate the parameters of each job against the cached template
+        job = models.ExtendedJobParameter(id="parameterJob", pool_info=None,
+            application_template_info=models.ApplicationTemplateInfo(
+                file_path=template_path, parameters={'blobName': "music.mp3"}))
+        with self.assertRaises(ValueError):
+            utils.expand_application_template(job, self._deserialize, registry)
+
     def test_batch_extensions_validate_parameter_usage(self):
         # should throw an error if no value is provided for a parameter without
         # a default